@@ -0,0 +1,70 @@
+// Prefaulting of the memory a sampling child shares with its parent, included
+// by both mc_profiler.c and mc_profiler.cpp.
+#ifndef MC_PREFAULT_H
+#define MC_PREFAULT_H
+
+#include <stdio.h>
+#include <string.h>
+#include <sys/mman.h>
+#include <unistd.h>
+
+#ifndef MADV_POPULATE_WRITE
+#define MADV_POPULATE_WRITE 23  // Linux 5.14
+#endif
+
+#define MC_PREFAULT_CHUNK 4096  // pages per mincore() call
+
+// Write fault the pages [begin, end). Without MADV_POPULATE_WRITE they are
+// touched one by one if `touch` is set.
+static void mc_prefault_range(unsigned long begin, unsigned long end,
+                              unsigned long page, int touch) {
+    if (madvise((void *)begin, end - begin, MADV_POPULATE_WRITE) == 0) return;
+    if (!touch) return;
+    for (unsigned long p = begin; p < end; p += page) {
+        volatile char *c = (volatile char *)p;
+        *c = *c;
+    }
+}
+
+// Copy the writable private memory a sampling child shares with its parent
+// up front, so that the copy-on-write faults of the first writes to it are
+// not timed in the profiled region. Only pages resident in the parent are
+// shared; untouched bss, heap and stack reservations fault in the region of
+// an unsampled run just the same and are left alone. Without
+// MADV_POPULATE_WRITE only anonymous pages are touched; pages of private file
+// mappings then remain shared, which biases batched samples against
+// unbatched ones.
+static void mc_prefault(void) {
+    FILE *maps = fopen("/proc/self/maps", "r");
+    if (!maps) return;
+    unsigned long page = (unsigned long)sysconf(_SC_PAGESIZE);
+    unsigned char resident[MC_PREFAULT_CHUNK];
+    char line[4096];
+    while (fgets(line, sizeof(line), maps)) {
+        unsigned long begin, end, inode;
+        char perms[5];
+        if (sscanf(line, "%lx-%lx %4s %*s %*s %lu", &begin, &end, perms, &inode) != 4)
+            continue;
+        if (strncmp(perms, "rw", 2) != 0 || perms[3] != 'p') continue;
+        int touch = inode == 0;  // touching past the end of the file would fault
+        for (unsigned long chunk = begin; chunk < end; chunk += MC_PREFAULT_CHUNK * page) {
+            unsigned long chunk_end = end - chunk > MC_PREFAULT_CHUNK * page
+                                          ? chunk + MC_PREFAULT_CHUNK * page
+                                          : end;
+            if (mincore((void *)chunk, chunk_end - chunk, resident) != 0) break;
+            unsigned long run = 0;  // start of the current run of resident pages
+            for (unsigned long p = chunk; p < chunk_end; p += page) {
+                if (resident[(p - chunk) / page] & 1) {
+                    if (!run) run = p;
+                } else if (run) {
+                    mc_prefault_range(run, p, page, touch);
+                    run = 0;
+                }
+            }
+            if (run) mc_prefault_range(run, chunk_end, page, touch);
+        }
+    }
+    fclose(maps);
+}
+
+#endif  // MC_PREFAULT_H
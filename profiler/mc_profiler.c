@@ -1,23 +1,193 @@
-#define _POSIX_C_SOURCE 199309L
+#define _POSIX_C_SOURCE 200809L
+#define _DEFAULT_SOURCE  // syscall()
 #include <time.h>
+#include <fcntl.h>
 #include <stdint.h>
 #include <stdlib.h>
 #include <stdio.h>
+#include <string.h>
+#include <linux/perf_event.h>
+#include <sys/ioctl.h>
+#include <sys/syscall.h>
+#include <sys/types.h>
+#include <sys/wait.h>
+#include <unistd.h>
+
+#include "mc_prefault.h"
+
+// Marks the binary record of MC_PROFILING_SAMPLES mode: the magic, a uint32
+// sample count, a uint32 channel count and count * channels uint64 values in
+// native byte order. The channels are the duration and, if counting, the
+// hardware counters.
+#define MC_SAMPLES_MAGIC "MC_SAMPLES"
+#define MC_INVALID_SAMPLE UINT64_MAX
+#define MC_COUNTERS 3  // cycles, instructions, cache misses
+#define MC_MAX_CHANNELS (1 + MC_COUNTERS)
 
 // --- Internal state ---
 static char        *mc_file   = NULL;
+static int          mc_result_fd = -1;  // MC_PROFILING_FD, receives the record only
 static uint64_t     mc_duration = 0;
 static int          mc_timing   = 0;
 static int          mc_valid    = 1;
 static struct timespec mc_start;
 
+// --- Hardware counters (MC_PROFILING_COUNTERS) ---
+static int          mc_counting = 0;    // all counters could be opened
+static int          mc_counter_fds[MC_COUNTERS] = {-1, -1, -1};
+static uint64_t     mc_counter_totals[MC_COUNTERS];
+
+// --- Multi-sample mode ---
+static uint32_t     mc_samples  = 0;    // requested samples, 0 = disabled
+static int          mc_sampled  = 0;    // samples were taken already
+static int          mc_sample_fd = -1;  // write end of the pipe in a sampling child
+static uint64_t    *mc_sample_values = NULL;
+static uint32_t     mc_samples_taken = 0;
+static int          mc_exit_status = 0; // nonzero if a sampling child failed
+
+static void mc_counters_close(void) {
+    for (int i = 0; i < MC_COUNTERS; i++) {
+        if (mc_counter_fds[i] >= 0) close(mc_counter_fds[i]);
+        mc_counter_fds[i] = -1;
+    }
+    mc_counting = 0;
+}
+
+// Open the counters of this process as one group, disabled until begin.
+// Without permission or PMU support, only the timer is used.
+static void mc_counters_open(void) {
+    static const uint64_t configs[MC_COUNTERS] = {
+        PERF_COUNT_HW_CPU_CYCLES,
+        PERF_COUNT_HW_INSTRUCTIONS,
+        PERF_COUNT_HW_CACHE_MISSES,
+    };
+    for (int i = 0; i < MC_COUNTERS; i++) {
+        struct perf_event_attr attr;
+        memset(&attr, 0, sizeof(attr));
+        attr.size = sizeof(attr);
+        attr.type = PERF_TYPE_HARDWARE;
+        attr.config = configs[i];
+        attr.disabled = i == 0;  // the others follow the group leader
+        attr.exclude_kernel = 1;
+        attr.exclude_hv = 1;
+        int group = i == 0 ? -1 : mc_counter_fds[0];
+        mc_counter_fds[i] = (int)syscall(SYS_perf_event_open, &attr, 0, -1, group, 0);
+        if (mc_counter_fds[i] < 0) {
+            mc_counters_close();
+            return;
+        }
+    }
+    mc_counting = 1;
+}
+
+static uint32_t mc_channels(void) {
+    return mc_counting ? MC_MAX_CHANNELS : 1;
+}
+
 // Called before main()
 static void __attribute__((constructor)) mc_timer_init(void) {
     mc_file = getenv("MC_INLINE_PROFILING_FILE");
+    char *result_fd = getenv("MC_PROFILING_FD");
+    if (result_fd) mc_result_fd = (int)strtol(result_fd, NULL, 10);
+    char *samples = getenv("MC_PROFILING_SAMPLES");
+    if (samples) mc_samples = (uint32_t)strtoul(samples, NULL, 10);
+    if (getenv("MC_PROFILING_COUNTERS")) mc_counters_open();
+}
+
+// The measurement of this process: the duration and, if counting, the counters.
+static void mc_current_values(uint64_t *values) {
+    values[0] = mc_valid ? mc_duration : MC_INVALID_SAMPLE;
+    memcpy(values + 1, mc_counter_totals, sizeof(mc_counter_totals));
+}
+
+// Write the binary record to the start of the result fd, which the caller
+// truncates before every run.
+static void mc_write_result(uint32_t count, uint32_t channels, const uint64_t *values) {
+    size_t header = sizeof(MC_SAMPLES_MAGIC) + 2 * sizeof(uint32_t);
+    size_t size = header + (size_t)count * channels * sizeof(uint64_t);
+    char *buffer = malloc(size);
+    if (!buffer) return;
+    memcpy(buffer, MC_SAMPLES_MAGIC, sizeof(MC_SAMPLES_MAGIC));
+    memcpy(buffer + sizeof(MC_SAMPLES_MAGIC), &count, sizeof(count));
+    memcpy(buffer + sizeof(MC_SAMPLES_MAGIC) + sizeof(count), &channels, sizeof(channels));
+    if (size > header) memcpy(buffer + header, values, size - header);
+    if (pwrite(mc_result_fd, buffer, size, 0) != (ssize_t)size)
+        mc_valid = 0;  // the caller finds no complete record
+    free(buffer);
+}
+
+// Fork one child per sample, one after the other. Every child runs the rest
+// of the program from the first __mc_profiling_begin() with its output
+// discarded, and reports its duration through a pipe when it exits. The
+// parent only collects the samples: it exits once they are taken, so the
+// region runs exactly once per sample.
+static void mc_take_samples(void) {
+    uint32_t channels = mc_channels();
+    mc_sample_values = calloc((size_t)mc_samples * channels, sizeof(uint64_t));
+    if (!mc_sample_values) return;
+    fflush(NULL);  // buffered output must not be written by the children
+    for (uint32_t i = 0; i < mc_samples; i++) {
+        int fds[2];
+        if (pipe(fds) != 0) break;
+        pid_t pid = fork();
+        if (pid < 0) {
+            close(fds[0]);
+            close(fds[1]);
+            break;
+        }
+        if (pid == 0) {
+            close(fds[0]);
+            mc_sample_fd = fds[1];
+            mc_prefault();
+            if (mc_counting) {  // counters of the parent do not count the child
+                mc_counters_close();
+                mc_counters_open();
+                if (!mc_counting) mc_valid = 0;
+            }
+            int devnull = open("/dev/null", O_WRONLY);
+            if (devnull >= 0) {
+                dup2(devnull, STDOUT_FILENO);
+                close(devnull);
+            }
+            return;
+        }
+        close(fds[1]);
+        uint64_t *values = mc_sample_values + (size_t)mc_samples_taken * channels;
+        size_t size = channels * sizeof(uint64_t);
+        if (read(fds[0], values, size) != (ssize_t)size)
+            values[0] = MC_INVALID_SAMPLE;  // the child died
+        close(fds[0]);
+        int status;
+        if (waitpid(pid, &status, 0) != pid || !WIFEXITED(status) ||
+            WEXITSTATUS(status) != 0)
+            mc_exit_status = 1;
+        mc_samples_taken++;
+    }
+    exit(mc_exit_status);  // writes the record, see mc_timer_fini
 }
 
 // Called after main() (or exit)
 static void __attribute__((destructor)) mc_timer_fini(void) {
+    if (mc_sample_fd >= 0) {
+        uint64_t values[MC_MAX_CHANNELS];
+        mc_current_values(values);
+        size_t size = mc_channels() * sizeof(uint64_t);
+        if (write(mc_sample_fd, values, size) != (ssize_t)size)
+            _exit(1);
+        close(mc_sample_fd);
+        return;
+    }
+    if (mc_result_fd >= 0) {
+        if (mc_samples > 0) {
+            mc_write_result(mc_samples_taken, mc_channels(), mc_sample_values);
+        } else {
+            uint64_t values[MC_MAX_CHANNELS];
+            mc_current_values(values);
+            mc_write_result(1, mc_channels(), values);
+        }
+        return;
+    }
+
     FILE *out = stdout;
     if (mc_file) {
         FILE *f = fopen(mc_file, "w");
@@ -29,18 +199,44 @@ static void __attribute__((destructor)) mc_timer_fini(void) {
     } else {
         fprintf(out, "MC_TIMER_INVALID\n");
     }
+    if (mc_samples > 0) {
+        uint32_t channels = mc_channels();
+        fwrite(MC_SAMPLES_MAGIC, 1, sizeof(MC_SAMPLES_MAGIC), out);
+        fwrite(&mc_samples_taken, sizeof(mc_samples_taken), 1, out);
+        fwrite(&channels, sizeof(channels), 1, out);
+        if (mc_samples_taken > 0)
+            fwrite(mc_sample_values, sizeof(uint64_t),
+                   (size_t)mc_samples_taken * channels, out);
+    }
     if (out != stdout) fclose(out);
 }
 
 // Exposed hooks (no C++ name‐mangling)
 void __mc_profiling_begin(void) {
+    if (mc_samples > 0 && !mc_sampled) {
+        mc_sampled = 1;
+        mc_take_samples();
+    }
     if (mc_timing) mc_valid = 0;  // nested begin→invalid
     mc_timing = 1;
     clock_gettime(CLOCK_MONOTONIC, &mc_start);
+    if (mc_counting) {
+        ioctl(mc_counter_fds[0], PERF_EVENT_IOC_RESET, PERF_IOC_FLAG_GROUP);
+        ioctl(mc_counter_fds[0], PERF_EVENT_IOC_ENABLE, PERF_IOC_FLAG_GROUP);
+    }
 }
 
 void __mc_profiling_end(void) {
     struct timespec end;
+    if (mc_counting) {
+        ioctl(mc_counter_fds[0], PERF_EVENT_IOC_DISABLE, PERF_IOC_FLAG_GROUP);
+        for (int i = 0; i < MC_COUNTERS; i++) {
+            uint64_t count = 0;
+            if (read(mc_counter_fds[i], &count, sizeof(count)) != sizeof(count))
+                mc_valid = 0;
+            mc_counter_totals[i] += count;
+        }
+    }
     if (!mc_timing) mc_valid = 0; // unmatched end→invalid
     mc_timing = 0;
     clock_gettime(CLOCK_MONOTONIC, &end);
@@ -50,4 +246,3 @@ void __mc_profiling_end(void) {
         (uint64_t)(end.tv_nsec - mc_start.tv_nsec);
     mc_duration += this_ns;
 }
-
@@ -1,23 +1,73 @@
-
+#include <array>
 #include <chrono>
 #include <cstdint>
+#include <cstdio>
 #include <cstdlib>
+#include <cstring>
+#include <fcntl.h>
 #include <fstream>
 #include <iostream>
+#include <linux/perf_event.h>
 #include <optional>
+#include <sys/ioctl.h>
+#include <sys/syscall.h>
+#include <sys/wait.h>
+#include <unistd.h>
+#include <vector>
+
+#include "mc_prefault.h"
 
 namespace {
+// Marks the binary record of MC_PROFILING_SAMPLES mode: the magic, a uint32
+// sample count, a uint32 channel count and count * channels uint64 values in
+// native byte order. The channels are the duration and, if counting, the
+// hardware counters.
+constexpr char samples_magic[] = "MC_SAMPLES";
+constexpr uint64_t invalid_sample = UINT64_MAX;
+constexpr int num_counters = 3; // cycles, instructions, cache misses
+constexpr uint64_t counter_configs[num_counters] = {
+    PERF_COUNT_HW_CPU_CYCLES,
+    PERF_COUNT_HW_INSTRUCTIONS,
+    PERF_COUNT_HW_CACHE_MISSES,
+};
+
 class MCTimer {
 public:
   MCTimer() {
     if (auto c = getenv("MC_INLINE_PROFILING_FILE"))
       file = c;
+    if (auto fd = getenv("MC_PROFILING_FD"))
+      result_fd = static_cast<int>(strtol(fd, nullptr, 10));
+    if (auto s = getenv("MC_PROFILING_SAMPLES"))
+      samples = static_cast<uint32_t>(strtoul(s, nullptr, 10));
+    if (getenv("MC_PROFILING_COUNTERS"))
+      open_counters();
   }
   ~MCTimer() {
+    if (sample_fd >= 0) {
+      uint64_t values[1 + num_counters];
+      current_values(values);
+      ssize_t size = channels() * sizeof(uint64_t);
+      if (write(sample_fd, values, size) != size)
+        _exit(1);
+      close(sample_fd);
+      return;
+    }
+    if (result_fd >= 0) {
+      if (samples > 0) {
+        write_result(sample_values.size() / channels(), sample_values.data());
+      } else {
+        uint64_t values[1 + num_counters];
+        current_values(values);
+        write_result(1, values);
+      }
+      return;
+    }
+
     std::ofstream ofs;
     std::ostream *os;
     if (file) {
-      ofs.open(*file);
+      ofs.open(*file, std::ios::binary);
       os = &ofs;
     } else {
       os = &std::cout;
@@ -26,15 +76,43 @@ public:
       *os << "MC_TIMER " << duration << "\n";
     else
       *os << "MC_TIMER_INVALID\n";
+    if (samples > 0) {
+      uint32_t num_channels = channels();
+      uint32_t count = sample_values.size() / num_channels;
+      os->write(samples_magic, sizeof(samples_magic));
+      os->write(reinterpret_cast<const char *>(&count), sizeof(count));
+      os->write(reinterpret_cast<const char *>(&num_channels),
+                sizeof(num_channels));
+      os->write(reinterpret_cast<const char *>(sample_values.data()),
+                sample_values.size() * sizeof(uint64_t));
+    }
+    os->flush();
   }
   void begin() {
+    if (samples > 0 && !sampled) {
+      sampled = true;
+      take_samples();
+    }
     if (timing)
       valid = false;
     timing = true;
 
     start_time = std::chrono::high_resolution_clock::now();
+    if (counting) {
+      ioctl(counter_fds[0], PERF_EVENT_IOC_RESET, PERF_IOC_FLAG_GROUP);
+      ioctl(counter_fds[0], PERF_EVENT_IOC_ENABLE, PERF_IOC_FLAG_GROUP);
+    }
   }
   void end() {
+    if (counting) {
+      ioctl(counter_fds[0], PERF_EVENT_IOC_DISABLE, PERF_IOC_FLAG_GROUP);
+      for (int i = 0; i < num_counters; i++) {
+        uint64_t count = 0;
+        if (read(counter_fds[i], &count, sizeof(count)) != sizeof(count))
+          valid = false;
+        counter_totals[i] += count;
+      }
+    }
     if (!timing)
       valid = false;
     timing = false;
@@ -47,12 +125,130 @@ public:
   }
 
 private:
+  // Open the counters of this process as one group, disabled until begin().
+  // Without permission or PMU support, only the timer is used.
+  void open_counters() {
+    for (int i = 0; i < num_counters; i++) {
+      perf_event_attr attr;
+      std::memset(&attr, 0, sizeof(attr));
+      attr.size = sizeof(attr);
+      attr.type = PERF_TYPE_HARDWARE;
+      attr.config = counter_configs[i];
+      attr.disabled = i == 0; // the others follow the group leader
+      attr.exclude_kernel = 1;
+      attr.exclude_hv = 1;
+      int group = i == 0 ? -1 : counter_fds[0];
+      counter_fds[i] = static_cast<int>(
+          syscall(SYS_perf_event_open, &attr, 0, -1, group, 0));
+      if (counter_fds[i] < 0) {
+        close_counters();
+        return;
+      }
+    }
+    counting = true;
+  }
+  void close_counters() {
+    for (int &fd : counter_fds) {
+      if (fd >= 0)
+        close(fd);
+      fd = -1;
+    }
+    counting = false;
+  }
+  uint32_t channels() const { return counting ? 1 + num_counters : 1; }
+
+  // The measurement of this process: the duration and, if counting, the
+  // counters.
+  void current_values(uint64_t *values) const {
+    values[0] = valid ? duration : invalid_sample;
+    std::memcpy(values + 1, counter_totals.data(), sizeof(counter_totals));
+  }
+
+  // Write the binary record to the start of the result fd, which the caller
+  // truncates before every run.
+  void write_result(uint32_t count, const uint64_t *values) {
+    uint32_t num_channels = channels();
+    std::vector<char> buffer(samples_magic, samples_magic + sizeof(samples_magic));
+    auto append = [&buffer](const void *data, size_t size) {
+      auto bytes = static_cast<const char *>(data);
+      buffer.insert(buffer.end(), bytes, bytes + size);
+    };
+    append(&count, sizeof(count));
+    append(&num_channels, sizeof(num_channels));
+    append(values, count * num_channels * sizeof(uint64_t));
+    ssize_t size = buffer.size();
+    if (pwrite(result_fd, buffer.data(), size, 0) != size)
+      valid = false; // the caller finds no complete record
+  }
+
+  // Fork one child per sample, one after the other. Every child runs the rest
+  // of the program from the first begin() with its output discarded, and
+  // reports its duration through a pipe when it exits. The parent only
+  // collects the samples: it exits once they are taken, so the region runs
+  // exactly once per sample.
+  void take_samples() {
+    std::cout.flush(); // buffered output must not be written by the children
+    fflush(nullptr);
+    uint32_t num_channels = channels();
+    for (uint32_t i = 0; i < samples; i++) {
+      int fds[2];
+      if (pipe(fds) != 0)
+        break;
+      pid_t pid = fork();
+      if (pid < 0) {
+        close(fds[0]);
+        close(fds[1]);
+        break;
+      }
+      if (pid == 0) {
+        close(fds[0]);
+        sample_fd = fds[1];
+        mc_prefault();
+        if (counting) { // counters of the parent do not count the child
+          close_counters();
+          open_counters();
+          if (!counting)
+            valid = false;
+        }
+        int devnull = open("/dev/null", O_WRONLY);
+        if (devnull >= 0) {
+          dup2(devnull, STDOUT_FILENO);
+          close(devnull);
+        }
+        return;
+      }
+      close(fds[1]);
+      std::vector<uint64_t> values(num_channels, 0);
+      ssize_t size = num_channels * sizeof(uint64_t);
+      if (read(fds[0], values.data(), size) != size)
+        values[0] = invalid_sample; // the child died
+      close(fds[0]);
+      int status;
+      if (waitpid(pid, &status, 0) != pid || !WIFEXITED(status) ||
+          WEXITSTATUS(status) != 0)
+        exit_status = 1;
+      sample_values.insert(sample_values.end(), values.begin(), values.end());
+    }
+    std::exit(exit_status); // writes the record, see ~MCTimer
+  }
+
   std::optional<char *> file;
+  int result_fd = -1; // MC_PROFILING_FD, receives the record only
   std::chrono::time_point<std::chrono::high_resolution_clock> start_time;
   uint64_t duration = 0;
   bool timing = false;
   bool valid = true;
 
+  uint32_t samples = 0; // requested samples, 0 = disabled
+  bool sampled = false;
+  int sample_fd = -1; // write end of the pipe in a sampling child
+  std::vector<uint64_t> sample_values;
+  int exit_status = 0; // nonzero if a sampling child failed
+
+  bool counting = false; // all counters could be opened
+  std::array<int, num_counters> counter_fds = {-1, -1, -1};
+  std::array<uint64_t, num_counters> counter_totals = {};
+
 } timer;
 } // namespace
 
@@ -32,7 +32,7 @@ class InlineMonteCarloAdvisor(MonteCarloAdvisor[bool]):
             f"-inliner-interactive-channel-base={self.filename}",
         ]
 
-    def get_rollout_decision(self, tv=None) -> bool:
+    def get_rollout_decision(self, tv=None, heuristic=None) -> bool:
         choice = random.random()
         return True if choice >= 0.5 else False
 
@@ -45,30 +45,23 @@ class InlineMonteCarloAdvisor(MonteCarloAdvisor[bool]):
         state.subtree_is_fully_explored = True
         current = state.parent
         while current:
-            if len(current.children) == 2 and all(
-                c.subtree_is_fully_explored for c in current.children
-            ):
+            if current.num_children() == 2 and current.num_explored_children() == 2:
                 current.subtree_is_fully_explored = True
                 current = current.parent
             else:
                 return
 
     def get_next_state(
-        self, state: State[bool], tv: Optional[list[TensorValue]]
+        self, state: State[bool], tv: Optional[list[TensorValue]], heuristic=None
     ) -> State[bool]:
         if state.is_leaf():
             choice = self.get_rollout_decision()
             return state.add_child(choice)
-        elif len(state.children) == 2:
-            return max(
-                (
-                    c for c in state.children if not c.subtree_is_fully_explored
-                ),  # we only want unexplored paths
-                key=self.uct,
-            )
-        elif state.children[0].decisions[-1] == False:
+        elif state.num_children() == 2:
+            return self.select_uct_child(state)  # only considers unexplored paths
+        elif state.child(False) is not None:
             return state.add_child(True)
-        elif state.children[0].decisions[-1] == True:
+        elif state.child(True) is not None:
             return state.add_child(False)
         else:
             assert False
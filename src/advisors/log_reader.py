@@ -8,6 +8,8 @@ import dataclasses
 import io
 import json
 import math
+import select
+import struct
 import sys
 import numpy as np
 from typing import List, Optional, Union
@@ -25,30 +27,54 @@ _element_types = {
     "uint64_t": ctypes.c_uint64,
 }
 
+_struct_codes = {
+    ctypes.c_float: "f",
+    ctypes.c_double: "d",
+    ctypes.c_int8: "b",
+    ctypes.c_uint8: "B",
+    ctypes.c_int16: "h",
+    ctypes.c_uint16: "H",
+    ctypes.c_int32: "i",
+    ctypes.c_uint32: "I",
+    ctypes.c_int64: "q",
+    ctypes.c_uint64: "Q",
+}
 
-def send(f: io.BufferedWriter, value: Union[int, float], spec: Optional["TensorSpec"]):
-    """Send the `value` - currently just a scalar - formatted as per `spec`."""
-    assert spec
 
-    if spec.element_type == ctypes.c_int64:
-        convert_el_func = int
-        ctype_func = ctypes.c_int64
-    elif spec.element_type == ctypes.c_float:
-        convert_el_func = float
-        ctype_func = ctypes.c_float
-    else:
-        print(spec.element_type, "not supported")
-        assert False
+class AdviceEncoder:
+    """Encodes advice for one TensorSpec, with its struct format compiled once."""
 
-    if isinstance(value, list):
-        to_send = (ctype_func * len(value))(*[convert_el_func(el) for el in value])
-    else:
-        to_send = ctype_func(convert_el_func(value))
+    def __init__(self, spec: "TensorSpec"):
+        self.spec = spec
+        self.count = math.prod(spec.shape)
+        code = _struct_codes[spec.element_type]
+        self.convert = float if code in "fd" else int
+        self.struct = struct.Struct(f"={self.count}{code}")
+
+    def encode(self, value: Union[int, float, list]) -> bytes:
+        """The wire format of `value`, raises struct.error if it does not fit the spec."""
+        if isinstance(value, list):
+            return self.struct.pack(*map(self.convert, value))
+        return self.struct.pack(self.convert(value))
+
+
+class AdviceWriter:
+    """
+    Writes advice to the compiler. The advice is buffered instead of flushed
+    after every scalar: the writer is flushed once per turn of the
+    request/response protocol, right before waiting for the compiler's reply.
+    """
+
+    def __init__(self, f: io.BufferedWriter, spec: Optional["TensorSpec"]):
+        assert spec
+        self.f = f
+        self.encoder = AdviceEncoder(spec)
+
+    def send(self, value: Union[int, float, list]):
+        self.f.write(self.encoder.encode(value))
 
-    assert f.write(bytes(to_send)) == ctypes.sizeof(spec.element_type) * math.prod(
-        spec.shape
-    )
-    f.flush()
+    def flush(self):
+        self.f.flush()
 
 
 @dataclasses.dataclass(frozen=True)
@@ -75,11 +101,14 @@ class TensorSpec:
 
 
 class TensorValue:
-    def __init__(self, spec: TensorSpec, buffer: bytes):
+    """A tensor as a NumPy view of `buffer`, which is not copied."""
+
+    def __init__(self, spec: TensorSpec, buffer):
         self._spec = spec
-        self._buffer = buffer
-        self._view = ctypes.cast(self._buffer, ctypes.POINTER(self._spec.element_type))
         self._len = math.prod(self._spec.shape)
+        self._array = np.frombuffer(
+            buffer, dtype=np.dtype(spec.element_type), count=self._len
+        )
 
     def spec(self) -> TensorSpec:
         return self._spec
@@ -87,11 +116,12 @@ class TensorValue:
     def to_numpy(self) -> np.ndarray:
         # TODO our unroll model currently expects only signed int inputs -
         # interpret unsigned ints as signed ones for now
-        el_ty = self._spec.element_type
         if self._spec.element_type == ctypes.c_ulong:
-            el_ty = ctypes.c_long
-        return np.frombuffer(
-            self._buffer, dtype=el_ty, count=self._len)
+            return self._array.view(np.dtype(ctypes.c_long))
+        return self._array
+
+    def copy(self) -> "TensorValue":
+        return TensorValue(self._spec, self._array.tobytes())
 
     def __len__(self) -> int:
         return self._len
@@ -99,7 +129,7 @@ class TensorValue:
     def __getitem__(self, index):
         if index < 0 or index >= self._len:
             raise IndexError(f"Index {index} out of range [0..{self._len})")
-        return self._view[index]
+        return self._array[index]
 
 
 def read_tensor(fs: io.BufferedReader, ts: TensorSpec) -> TensorValue:
@@ -108,6 +138,48 @@ def read_tensor(fs: io.BufferedReader, ts: TensorSpec) -> TensorValue:
     return TensorValue(ts, data)
 
 
+def readinto_exactly(f: io.BufferedReader, buffer: memoryview):
+    """Fill `buffer` from `f`, waiting for more input if `f` is nonblocking."""
+    while buffer:
+        n = f.readinto(buffer)
+        if n is None:
+            select.select([f], [], [])
+            continue
+        if n == 0:
+            raise EOFError("Stream ended inside a tensor")
+        buffer = buffer[n:]
+
+
+class ObservationDecoder:
+    """
+    Decoder for the features of one observation, precomputed from the header's
+    TensorSpec list: the features are laid out as a structured dtype and read
+    with a single readinto into a reusable buffer. The returned TensorValues are
+    views of that buffer and only valid until the next read.
+    """
+
+    def __init__(self, tensor_specs: List[TensorSpec]):
+        self.tensor_specs = tensor_specs
+        self.dtype = np.dtype(
+            {
+                "names": [f"f{i}" for i in range(len(tensor_specs))],
+                "formats": [
+                    (np.dtype(ts.element_type), tuple(ts.shape)) for ts in tensor_specs
+                ],
+            }
+        )
+        self.buffer = bytearray(self.dtype.itemsize)
+        view = memoryview(self.buffer)
+        self.features = []
+        for name, ts in zip(self.dtype.names, tensor_specs):
+            field, offset = self.dtype.fields[name][:2]
+            self.features.append(TensorValue(ts, view[offset : offset + field.itemsize]))
+
+    def read(self, f: io.BufferedReader) -> List[TensorValue]:
+        readinto_exactly(f, memoryview(self.buffer))
+        return self.features
+
+
 def string_tensor_value(tv: TensorValue) -> str:
     return f'{tv.spec().name}: {",".join([str(v) for v in tv])}'
 
@@ -130,15 +202,17 @@ def read_one_observation(
     f: io.BufferedReader,
     tensor_specs: List[TensorSpec],
     score_spec: Optional[TensorSpec],
+    decoder: Optional[ObservationDecoder] = None,
 ):
     event = json.loads(event_str)
     if "context" in event:
         context = event["context"]
         event = json.loads(f.readline())
     observation_id = int(event["observation"])
-    features = []
-    for ts in tensor_specs:
-        features.append(read_tensor(f, ts))
+    if decoder is not None:
+        features = decoder.read(f)
+    else:
+        features = [read_tensor(f, ts) for ts in tensor_specs]
     f.readline()
     score = None
     if score_spec is not None:
@@ -1,6 +1,6 @@
 import logging
 import random
-from math import sqrt
+from math import ceil, sqrt
 from typing import Optional, final
 
 import numpy as np
@@ -27,6 +27,10 @@ class LoopUnrollMonteCarloAdvisor(MonteCarloAdvisor[int]):
         self.filename = self.runner.channel_base
 
         self.MAX_UNROLL_FACTOR = 32
+        # progressive widening: a node with n visits may have
+        # ceil(widening_constant * n ** widening_exponent) children
+        self.widening_constant: float = 1.0
+        self.widening_exponent: float = 0.5
 
         if model_path is not None:
             self.interpreter = Interpreter(model_path=model_path)
@@ -104,8 +108,9 @@ class LoopUnrollMonteCarloAdvisor(MonteCarloAdvisor[int]):
         state.subtree_is_fully_explored = True
         current = state.parent
         while current:
-            if len(current.children) == self.MAX_UNROLL_FACTOR and all(
-                c.subtree_is_fully_explored for c in current.children
+            if (
+                current.num_children() == self.MAX_UNROLL_FACTOR
+                and current.num_explored_children() == self.MAX_UNROLL_FACTOR
             ):
                 current.subtree_is_fully_explored = True
                 current = current.parent
@@ -113,21 +118,40 @@ class LoopUnrollMonteCarloAdvisor(MonteCarloAdvisor[int]):
                 return
 
     def get_next_state(self, state: State[int], tv, heuristic) -> State[int]:
-        # TODO do something with these
         if state.is_leaf():
             choice = self.get_rollout_decision(tv, heuristic)
             return state.add_child(choice)
-        if len(state.children) == self.MAX_UNROLL_FACTOR:
-            return max(
-                (c for c in state.children if not c.subtree_is_fully_explored),
-                key=self.uct,
-            )
-        else:
-            visited_unroll_factors = set([c.decisions[-1] for c in state.children])
-            remaining_unroll_factors = (
-                set(range(1, self.MAX_UNROLL_FACTOR + 1)) - visited_unroll_factors
-            )
-            return state.add_child(random.choice(list(remaining_unroll_factors)))
+        can_expand = state.num_unvisited(self.MAX_UNROLL_FACTOR) > 0
+        if can_expand and (
+            state.num_children() < self.widening_limit(state)
+            or state.num_explored_children() == state.num_children()
+        ):
+            return state.add_child(self.next_unroll_factor(state, tv, heuristic))
+        return self.select_uct_child(state)
+
+    def widening_limit(self, state: State[int]) -> int:
+        """Number of children `state` may have after its visits so far."""
+        visits = max(state.visits, 1)
+        limit = ceil(self.widening_constant * visits**self.widening_exponent)
+        return min(limit, self.MAX_UNROLL_FACTOR)
+
+    def next_unroll_factor(self, state: State[int], tv, heuristic) -> int:
+        """
+        The most promising factor without a child below `state`: the one with
+        the highest predicted speedup, or else the one closest to the heuristic.
+        """
+        factors = state.unvisited_decisions(1, self.MAX_UNROLL_FACTOR)
+        predictions = self.get_model_predictions(tv)
+        if predictions is not None and len(predictions) > 0:
+            # predictions start at factor 2, not unrolling is the baseline
+            speedups = np.ones(self.MAX_UNROLL_FACTOR + 1)
+            n = min(len(predictions), self.MAX_UNROLL_FACTOR - 1)
+            speedups[2 : 2 + n] = np.asarray(predictions)[:n]
+            return int(factors[np.argmax(speedups[factors])])
+        if heuristic is None:
+            return int(random.choice(factors))
+        default = self.get_default_decision(LOOP_UNROLL, tv, heuristic)
+        return int(factors[np.argmin(np.abs(factors - default))])
 
     def check_unroll_success(self, action: bool):
         if action:
@@ -136,7 +160,7 @@ class LoopUnrollMonteCarloAdvisor(MonteCarloAdvisor[int]):
             # we are in rollout, so we don't want to block off our mc state, but want the path to accurately reflect what choices we made
             self.current_path[-1] = 1
             return
-        if not self.in_rollout and self.current and self.current.decisions[-1] != 1:
+        if not self.in_rollout and self.current and self.current.decision != 1:
             # assert self.current.is_leaf()
             # should only happen in leaf states, otherwise would have triggered earlier
             logger.warning("Unsuccessful unrolling")
@@ -144,10 +168,12 @@ class LoopUnrollMonteCarloAdvisor(MonteCarloAdvisor[int]):
 
     @override
     def get_score(self, path: str, timeout: Optional[float], scoring_function):
-        self.runner.compile_once(
-            self.opt_args() + ["-o", path + "mod-post-mc.bc", path + "mod-pre-mc.bc"],
+        self.runner.compile_module(
+            self.opt_args(),
+            path + "mod-pre-mc.bc",
+            path + "mod-post-mc.bc",
             self.advice,
             on_action=self.check_unroll_success,
             timeout=timeout,
         )
-        return scoring_function()
+        return self.score_path(scoring_function)
@@ -23,15 +23,18 @@ import os
 import subprocess
 import sys
 import threading
-import time
-from time import sleep
 from typing import Any, BinaryIO, Callable, List, Optional, Tuple, Union, final
 
 from typing_extensions import override
 
 import utils
 from advisors import log_reader
-from advisors.mc_runner import CompilerCommunicator
+from advisors.mc_runner import (
+    ChannelCommunicator,
+    Exchange,
+    set_blocking,
+    set_nonblocking,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -71,18 +74,19 @@ class CompilationResult:
 
 
 @final
-class LoopUnrollCompilerCommunicator(CompilerCommunicator):
+class LoopUnrollCompilerCommunicator(ChannelCommunicator):
     def __init__(
         self,
         input_name: str,
         debug,
+        session_directory: Optional[str] = None,
     ):
         """
         on_features: operation on tensor with feature values
         on_heuristic: operation on default decision of compiler
         on_action: operation on whether given unroll decision succeeded
         """
-        super().__init__(input_name, debug)
+        super().__init__(input_name, debug, session_directory)
         self.features = []
 
         self.tensor_mode = "numpy"
@@ -92,8 +96,11 @@ class LoopUnrollCompilerCommunicator(CompilerCommunicator):
         self.advice_spec = None
 
     def on_features_collect(self, tensor_values):
+        # the values are views of the decoder's buffer, which the next observation reuses
         if self.tensor_mode == "numpy":
-            tensor_values = [tv.to_numpy() for tv in tensor_values]
+            tensor_values = [tv.to_numpy().copy() for tv in tensor_values]
+        else:
+            tensor_values = [tv.copy() for tv in tensor_values]
         self.features.append(tensor_values)
 
     def on_heuristic_print(self, heuristic):
@@ -130,131 +137,76 @@ class LoopUnrollCompilerCommunicator(CompilerCommunicator):
     def get_features_spec(self):
         return self.features_spec
 
-    def communicate_with_proc(
+    def exchange(
         self,
         compiler_proc: subprocess.Popen[bytes],
-        advice: Callable[[str, list[log_reader.TensorValue], int], int],
+        tc: io.BufferedWriter,
+        fc: io.BufferedReader,
+        advice: Callable[[str, list[log_reader.TensorValue], Optional[int]], int],
         on_features: Optional[Callable[[list[log_reader.TensorValue]], Any]] = None,
         on_heuristic: Optional[Callable[[int], Any]] = None,
         on_action: Optional[Callable[[bool], Any]] = None,
-        timeout: Optional[float] = None,
-    ):
-        def set_nonblocking(pipe):
-            os.set_blocking(pipe.fileno(), False)
-
-        def set_blocking(pipe):
-            os.set_blocking(pipe.fileno(), True)
-
-        logger.debug(f"Opening pipes {self.to_compiler} and {self.from_compiler}")
-
-        os.mkfifo(self.to_compiler, 0o666)
-        os.mkfifo(self.from_compiler, 0o666)
-
-        set_nonblocking(compiler_proc.stdout)
-
-        logger.debug(f"Starting communication")
-        # threading.current_thread().name = "loop-unroll-communicator"
-        start = time.time()
-
-        with io.BufferedWriter(io.FileIO(self.to_compiler, "w+b")) as tc:
-            with io.BufferedReader(io.FileIO(self.from_compiler, "r+b")) as fc:
-                # We need to set the reading pipe to nonblocking for the purpose
-                # of peek'ing and checking if it is readable without blocking
-                # and watch for the process diyng as well. We rever to blocking
-                # mode for the actual communication.
-
-                def input_available():
-                    if len(fc.peek(1)) > 0:
-                        return "yes"
-                    if compiler_proc.poll() is not None:
-                        return "dead"
-                    return "no"
-
-                def no_stop_event():
-                    if timeout and time.time() - start > timeout:
-                        logger.debug(
-                            f"Timeout for opt in loop unroll runner: opt took longer than {timeout} seconds to complete."
-                        )
-                        # utils.terminate(compiler_proc) # we don't terminate the process here because it leads to issues when two threads call terminate() in rapid succession
-                        raise TimeoutError()
-                    return True
-
-                set_nonblocking(fc)
-                while no_stop_event():
-                    ia = input_available()
-                    if ia == "dead":
-                        return None
-                    elif ia == "yes":
-                        break
-                    elif ia == "no":
-                        sleep(0)
-                    else:
-                        assert False
-                #
-                set_blocking(fc)
-
-                header, tensor_specs, _, advice_spec = log_reader.read_header(fc)
-                context = None
-
-                set_nonblocking(fc)
-                while no_stop_event():
-                    ia = input_available()
-                    if ia == "dead":
-                        break
-                    elif ia == "yes":
-                        ...
-                    elif ia == "no":
-                        sleep(0)
-                        continue
-                    else:
-                        assert False
-
-                    set_blocking(fc)
-                    next_event = fc.readline()
-                    if not next_event:
-                        break
-                    (
-                        last_context,
-                        observation_id,
-                        features,
-                        _,
-                    ) = log_reader.read_one_observation(
-                        context, next_event, fc, tensor_specs, None
-                    )
-                    if last_context != context:
-                        logger.debug(f"context: {last_context}")
-                    context = last_context
-                    logger.debug(f"observation: {observation_id}")
-                    tensor_values = []
-                    for fv in features:
-                        # logger.debug(fv.to_numpy())
-                        # logger.debug(log_reader.string_tensor_value(fv))
-                        tensor_values.append(fv)
-
-                    if on_features:
-                        on_features(tensor_values)
-
-                    heuristic = self.read_heuristic(fc)
-                    if on_heuristic:
-                        on_heuristic(heuristic)
-
-                    log_reader.send(
-                        tc,
-                        advice(utils.LOOP_UNROLL, tensor_values, heuristic),
-                        advice_spec,
-                    )
-
-                    action = self.read_action(fc)
-                    if on_action:
-                        try:
-                            on_action(action)
-                        except utils.MonteCarloError as e:
-                            # utils.terminate(
-                            #     compiler_proc
-                            # )  # do want to terminate, since action only raises exception when we have path we dont want to continue anymore -> no need to let inline continue, but termination is handled in corresponding compile_once function
-                            raise e
-
-                    send_instrument_response(tc, None)
-                    set_nonblocking(fc)
-
-                set_blocking(fc)
+    ) -> Exchange:
+        # We need to set the reading pipe to nonblocking for the purpose
+        # of peek'ing and checking if it is readable without blocking
+        # and watch for the process diyng as well. We rever to blocking
+        # mode for the actual communication.
+        set_nonblocking(fc)
+        if (yield) != "yes":
+            return
+        #
+        set_blocking(fc)
+
+        header, tensor_specs, _, advice_spec = log_reader.read_header(fc)
+        decoder = log_reader.ObservationDecoder(tensor_specs)
+        writer = log_reader.AdviceWriter(tc, advice_spec)
+        context = None
+
+        set_nonblocking(fc)
+        while (yield) == "yes":
+            set_blocking(fc)
+            next_event = fc.readline()
+            if not next_event:
+                break
+            (
+                last_context,
+                observation_id,
+                features,
+                _,
+            ) = log_reader.read_one_observation(
+                context, next_event, fc, tensor_specs, None, decoder
+            )
+            if last_context != context:
+                logger.debug(f"context: {last_context}")
+            context = last_context
+            logger.debug(f"observation: {observation_id}")
+            tensor_values = []
+            for fv in features:
+                # logger.debug(fv.to_numpy())
+                # logger.debug(log_reader.string_tensor_value(fv))
+                tensor_values.append(fv)
+
+            if on_features:
+                on_features(tensor_values)
+
+            heuristic = self.read_heuristic(fc)
+            if on_heuristic:
+                on_heuristic(heuristic)
+
+            writer.send(advice(utils.LOOP_UNROLL, tensor_values, heuristic))
+            writer.flush()  # opt replies with the action
+
+            action = self.read_action(fc)
+            if on_action:
+                try:
+                    on_action(action)
+                except utils.MonteCarloError as e:
+                    # utils.terminate(
+                    #     compiler_proc
+                    # )  # do want to terminate, since action only raises exception when we have path we dont want to continue anymore -> no need to let inline continue, but termination is handled in corresponding compile_once function
+                    raise e
+
+            send_instrument_response(tc, None)
+            set_nonblocking(fc)
+
+        set_blocking(fc)
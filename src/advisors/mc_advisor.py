@@ -1,111 +1,22 @@
+import heapq
 import logging
 import subprocess
+import threading
 from abc import ABC, abstractmethod
 from math import log, sqrt
-from typing import Any, Generic, Optional, TypeVar
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from typing import Any, Callable, Generic, Optional
+
+import numpy as np
 
 import utils
 from advisors import log_reader
 from advisors.mc_runner import CompilerCommunicator
+from advisors.search_tree import D, SearchTree, State
 
 logger = logging.getLogger(__name__)
 
-D = TypeVar("D", int, bool)
-
-
-class State(Generic[D]):
-    def __init__(
-        self,
-        decisions=None,
-        score=0.0,
-        speedup_sum=0.0,
-        visits=0,
-        parent=None,
-        children=None,
-    ):
-        self.decisions: list[D] = [] if decisions is None else decisions
-        self.score: float = score
-        self.speedup_sum: float = speedup_sum
-        self.visits: int = visits
-        self.parent: Optional["State"] = parent
-        self.children: list["State"] = [] if children is None else children
-        self.subtree_is_fully_explored: bool = False
-
-    def __repr__(self) -> str:
-        return (
-            f"State(decisions={self.decisions}, "
-            f"score={self.score:.7f},"
-            f"visits={self.visits})" + (f"*" if self.subtree_is_fully_explored else "")
-        )
-
-    def __getitem__(self, index: D):
-        return next(c for c in self.children if c.decisions[-1] == index)
-
-    def repr_subtree(self):
-        """
-        Print the subtree rooted at `root` in an ASCII-tree layout.
-        """
-        lines: list[str] = ["\n"]
-
-        def _walk(node: "State", prefix: str, label: str | None, is_last: bool):
-            # pick branch symbols
-            connector = "└── " if is_last else "├── "
-            label_str = f"[{label}] " if label else ""
-            lines.append(prefix + connector + label_str + repr(node))
-
-            # prepare prefix for children
-            new_prefix = prefix + ("      " if is_last else "│     ")
-
-            # gather existing children in order
-            labeled_children = []
-            for child in node.children:
-                labeled_children.append((str(child.decisions[-1]), child))
-
-            # recurse
-            for idx, (lbl, child) in enumerate(labeled_children):
-                _walk(child, new_prefix, lbl, idx == len(labeled_children) - 1)
-
-        # print the root node itself (no connector or label)
-        lines.append(repr(self))
-
-        # then its immediate children
-        root_children = []
-        for child in self.children:
-            root_children.append((str(child.decisions[-1]), child))
-
-        for idx, (lbl, child) in enumerate(root_children):
-            _walk(child, "", lbl, idx == len(root_children) - 1)
-
-        return "\n".join(lines)
-
-    def __eq__(self, other) -> bool:
-        if not isinstance(other, type(self)):
-            return NotImplemented
-        return self.score == other.score
-
-    def __lt__(self, other) -> bool:
-        if not isinstance(other, type(self)):
-            return NotImplemented
-        return self.score < other.score
-
-    def add_child(
-        self, choice: D, score: float = 0.0, speedup_sum=0.0, visits: int = 0
-    ) -> "State[D]":
-        """Create, link, and return a new child state."""
-        child = State(
-            self.decisions[:] + [choice],
-            score=score,
-            speedup_sum=speedup_sum,
-            visits=visits,
-        )
-        self.children.append(child)
-        self.children.sort(key=lambda c: c.decisions[-1])
-        child.parent = self
-        return child
-
-    def is_leaf(self) -> bool:
-        return self.children == []
-
 
 class MonteCarloAdvisor(ABC, Generic[D]):
     def __init__(
@@ -115,15 +26,28 @@ class MonteCarloAdvisor(ABC, Generic[D]):
     ) -> None:
         self.runner: CompilerCommunicator
         self.C = C
-        self.root = State[D]()
+        self.tree = SearchTree()
+        self.root: State[D] = self.tree.root
         self.current = self.root
         self.in_rollout: bool = False
         self.default_path: list[D]
         self.current_path: list[D] = []
         self.all_runs: list[tuple[list[D], float]] = []
+        self.best_run_index: int = -1
+        self.top_k: int = 0  # number of best runs to keep in `top_runs`, 0 disables it
+        self.top_runs: list[tuple[float, int]] = []  # min-heap of (score, run index)
+        # complete decision path -> (mean score, number of measurements)
+        self.path_scores: dict[tuple[D, ...], tuple[float, int]] = {}
+        self.max_refinements: int = 0  # extra measurements of a repeated path
+        self.refine_function: Optional[Callable[[], float]] = None
         self.invalid_paths: set = set()
         self.max_speedup_after_n_iterations: list[float] = []
         self.filename = input_name
+        # Tree parallelism: advisors searching the same tree share the tree,
+        # its lock and the run history of the `leader`.
+        self.leader: MonteCarloAdvisor[D] = self
+        self.lock = threading.RLock()
+        self.in_flight: list[int] = []  # nodes holding a virtual loss of this advisor
 
     def __repr__(self):
         return self.root.repr_subtree()
@@ -178,43 +102,106 @@ class MonteCarloAdvisor(ABC, Generic[D]):
         self.root.speedup_sum = 1.0
         self.root.visits = 1
 
-        self.runner.compile_once(
-            self.opt_args() + ["-o", path + "mod-post-mc.bc", path + "mod-pre-mc.bc"],
+        self.runner.compile_module(
+            self.opt_args(),
+            path + "mod-pre-mc.bc",
+            path + "mod-post-mc.bc",
             build_initial_path,
         )
         assert self.current
         self.default_path = self.current.decisions
-        self.all_runs.append((self.default_path[:], 1.0))
-        self.max_speedup_after_n_iterations.append(1.0)
+        self.path_scores[tuple(self.default_path)] = (1.0, 1)
+        self.record_run(self.default_path[:], 1.0)
 
     def advice(
         self, advisor_type: str, tv: list[log_reader.TensorValue], heuristic
     ) -> Any:
         assert self.current
-        if self.current.visits == 0:
-            self.in_rollout = True
-            decision = self.get_rollout_decision(tv, heuristic)
-        else:
-            next = self.get_next_state(self.current, tv, heuristic)
-            assert next
-            self.current = next
-            decision = next.decisions[-1]
+        with self.lock:
+            if self.current.visits == 0:
+                self.in_rollout = True
+                decision = self.get_rollout_decision(tv, heuristic)
+            else:
+                next = self.get_next_state(self.current, tv, heuristic)
+                assert next
+                self.enter_state(next)
+                decision = next.decision
         self.current_path.append(decision)
         logger.debug(f"Current path: {self.current_path}")
         return self.wrap_advice(advisor_type, decision)
 
+    def enter_state(self, state: State[D]):
+        """Move the current iteration to `state`, adding a virtual loss to it."""
+        self.current = state
+        self.tree.add_virtual_loss(state.index)
+        self.in_flight.append(state.index)
+
+    def clear_virtual_loss(self):
+        for index in self.in_flight:
+            self.tree.remove_virtual_loss(index)
+        self.in_flight = []
+
     def uct(self, state: State) -> float:
         parent = state.parent
         assert parent and state.visits > 0
         return state.score + self.C * sqrt(log(parent.visits) / state.visits)
 
+    def select_uct_child(self, state: State[D]) -> State[D]:
+        """
+        Return the child of `state` that is not fully explored and has the
+        highest UCT value, scoring all children at once. Iterations still in
+        flight count as visits with a score of 0 (virtual loss).
+        """
+        tree = state.tree
+        children = tree.child_array(state.index)
+        unexplored = children[~tree.explored[children]]
+        # all children can only be explored by another iteration running in parallel
+        if len(unexplored) > 0:
+            children = unexplored
+        score = tree.score[children]
+        visits = tree.visits[children]
+        parent_visits = state.visits
+        in_flight = tree.in_flight[children]
+        if in_flight.any():
+            visits = visits + in_flight
+            score = np.where(in_flight > 0, tree.speedup_sum[children] / visits, score)
+            parent_visits += int(tree.in_flight[state.index])
+        with np.errstate(divide="ignore"):  # unvisited children get an infinite bonus
+            uct = score + self.C * np.sqrt(log(parent_visits) / visits)
+        return tree.state(int(children[np.argmax(uct)]))
+
     def get_score(self, path: str, timeout: Optional[float], scoring_function):
-        self.runner.compile_once(
-            self.opt_args() + ["-o", path + "mod-post-mc.bc", path + "mod-pre-mc.bc"],
+        self.runner.compile_module(
+            self.opt_args(),
+            path + "mod-pre-mc.bc",
+            path + "mod-post-mc.bc",
             self.advice,
             timeout=timeout,
         )
-        return scoring_function()
+        return self.score_path(scoring_function)
+
+    def score_path(self, scoring_function: Callable[[], float]) -> float:
+        """
+        Score the path that was just compiled. Complete paths that were already
+        measured reuse their score, or refine it with `refine_function` up to
+        `max_refinements` times. Scores of rejected candidates are not reused.
+        """
+        key = tuple(self.current_path)
+        known = self.path_scores.get(key)
+        if known is None:
+            score = scoring_function()
+            if not isinstance(score, utils.PartialScore):
+                self.path_scores[key] = (score, 1)
+            return score
+
+        score, measurements = known
+        if self.refine_function is None or measurements > self.max_refinements:
+            logger.info(f"Path was measured {measurements} times, reusing score {score}")
+            return score
+        score = (score * measurements + self.refine_function()) / (measurements + 1)
+        logger.info(f"Refined score of repeated path to {score}")
+        self.path_scores[key] = (score, measurements + 1)
+        return score
 
     def update_score(self, score: float):
         assert self.current
@@ -224,93 +211,220 @@ class MonteCarloAdvisor(ABC, Generic[D]):
             self.current.speedup_sum / self.current.visits
         )  # average speedup
 
-        if len(self.current.decisions) == len(
+        if self.current.depth == len(
             self.current_path
         ):  # if we have as many decisions as the current path _in_ the node, then we have reached the bottom of the tree
             self.set_state_as_fully_explored(self.current)
 
-    def get_max_state(self) -> State:
-        def get_max_state_helper(current: State | None, max_state: State) -> State:
-            if current is None:
-                return max_state
-            if current.is_leaf():
-                return max(current, max_state)
-
-            max_state = max(current, max_state)
-            return max(
-                map(lambda s: get_max_state_helper(s, max_state), current.children)
-            )
+    def record_run(self, path: list[D], score: float):
+        """Append a run to the history and update the best run trackers."""
+        if self.leader is not self:
+            return self.leader.record_run(path, score)
+        self.all_runs.append((path, score))
+        index = len(self.all_runs) - 1
+        if self.best_run_index < 0 or score > self.all_runs[self.best_run_index][1]:
+            self.best_run_index = index
+        if self.top_k > 0:
+            if len(self.top_runs) < self.top_k:
+                heapq.heappush(self.top_runs, (score, index))
+            else:
+                heapq.heappushpop(self.top_runs, (score, index))
+        self.max_speedup_after_n_iterations.append(
+            max(self.max_speedup_after_n_iterations[-1], score)
+            if self.max_speedup_after_n_iterations
+            else score
+        )
 
-        return get_max_state_helper(self.root, self.root)
+    def get_max_state(self) -> State:
+        """The node with the highest score recorded so far."""
+        return self.tree.best_state()
 
     def get_max_run(self) -> tuple[list[D], float]:
-        return max(self.all_runs, key=lambda x: x[1])
+        return self.all_runs[self.best_run_index]
+
+    def get_top_runs(self, n: Optional[int] = None) -> list[tuple[list[D], float]]:
+        """Return up to `n` (default: `top_k`) best runs, highest score first."""
+        best = sorted(self.top_runs, reverse=True)[:n]
+        return [self.all_runs[i] for _, i in best]
 
     def mark_state_as_invalid(self, state: State[D], error_code: int):
         state.score = error_code
         state.speedup_sum = error_code
         state.visits = 1
+        if self.tree.best_index == state.index:
+            self.tree.reset_best()
         self.set_state_as_fully_explored(state)
-        self.all_runs.append((self.current_path[:], error_code))
-        self.max_speedup_after_n_iterations.append(
-            self.max_speedup_after_n_iterations[-1]
-        )
+        self.record_run(self.current_path[:], error_code)
 
-    def run_monte_carlo(
-        self, nr_of_turns: int, path: str, timeout: Optional[float], scoring_function
-    ):
-        self.get_initial_tree(path)
-        logger.info(self)
-        max_score = 1.0
-        for i in range(nr_of_turns):
-            logger.info(f"Monte Carlo iteration {i}")
-            if self.root.subtree_is_fully_explored:
-                logger.info("Explored the entire tree!")
-                break
-            try:
-                self.current = self.root
-                self.current_path = []
-                self.in_rollout = False
-                score = self.get_score(path, timeout, scoring_function)
+    def merge(self, others: list["MonteCarloAdvisor[D]"]):
+        """
+        Combine the trees and run histories of independent (root parallel)
+        searches into this advisor. Runs are interleaved by iteration.
+        """
+        for other in others:
+            self.tree.merge(other.tree)
+            for path, (score, measurements) in other.path_scores.items():
+                known_score, known_measurements = self.path_scores.get(path, (0.0, 0))
+                total = known_measurements + measurements
+                self.path_scores[path] = (
+                    (known_score * known_measurements + score * measurements) / total,
+                    total,
+                )
+            self.invalid_paths |= other.invalid_paths
+        self.root = self.tree.root
+        self.current = self.root
+        self.default_path = others[0].default_path
+        for i in range(max(len(other.all_runs) for other in others)):
+            for other in others:
+                if i < len(other.all_runs):
+                    path, score = other.all_runs[i]
+                    self.record_run(path, score)
+
+    def share_search(self, leader: "MonteCarloAdvisor[D]"):
+        """
+        Search the tree of `leader` concurrently with it (tree parallelism).
+        Runs are recorded in the history of `leader`.
+        """
+        self.leader = leader
+        self.tree = leader.tree
+        self.root = leader.root
+        self.current = self.root
+        self.lock = leader.lock
+        self.default_path = leader.default_path
+        self.path_scores = leader.path_scores
+        self.invalid_paths = leader.invalid_paths
+        self.max_refinements = leader.max_refinements
+
+    def run_iteration(self, path: str, timeout: Optional[float], scoring_function):
+        """Select, compile and score one path and propagate its score."""
+        with self.lock:
+            self.enter_state(self.root)
+        self.current_path = []
+        self.in_rollout = False
+        try:
+            score = self.get_score(path, timeout, scoring_function)
+            with self.lock:
+                self.clear_virtual_loss()
                 while self.current:
                     self.update_score(score)
                     self.current = self.current.parent
-                self.all_runs.append((self.current_path[:], score))
-                max_score = max(max_score, score)
-                self.max_speedup_after_n_iterations.append(max_score)
-            except (
-                utils.MonteCarloError
-            ):  # should happen if we have an invalid loop unroll while not in rollout
-                assert self.current
+                self.record_run(self.current_path[:], score)
+        except (
+            utils.MonteCarloError
+        ):  # should happen if we have an invalid loop unroll while not in rollout
+            assert self.current
+            with self.lock:
                 self.mark_state_as_invalid(self.current, utils.LOOP_UNROLL_ERROR_CODE)
-            except (
-                subprocess.TimeoutExpired,
-                TimeoutError,
-            ):  # should happen if opt/llc times out
-                assert self.current
+        except (
+            subprocess.TimeoutExpired,
+            TimeoutError,
+        ):  # should happen if opt/llc times out
+            assert self.current
+            with self.lock:
                 self.invalid_paths.add(tuple(self.current_path[:]))
                 if self.current.decisions == self.current_path:
                     self.mark_state_as_invalid(
                         self.current, utils.TIMEOUT_ERROR_CODE
                     )  # we timed out in a tree node
                 else:
-                    self.all_runs.append(
-                        (self.current_path[:], utils.TIMEOUT_ERROR_CODE)
-                    )
-                    self.max_speedup_after_n_iterations.append(
-                        self.max_speedup_after_n_iterations[-1]
-                    )
+                    self.record_run(self.current_path[:], utils.TIMEOUT_ERROR_CODE)
                     self.current.visits += 1
-                logger.warning(
-                    f"State: {self.current} with decisions {self.current_path} timed out."
-                )
-                # TODO: find some way to penalize llc/opt that takes too long, so that we avoid exploring that path again
+            logger.warning(
+                f"State: {self.current} with decisions {self.current_path} timed out."
+            )
+            # TODO: find some way to penalize llc/opt that takes too long, so that we avoid exploring that path again
+        finally:
+            with self.lock:
+                self.clear_virtual_loss()
+
+    def run_monte_carlo(
+        self,
+        nr_of_turns: int,
+        path: str,
+        timeout: Optional[float],
+        scoring_function,
+        refine_function: Optional[Callable[[], float]] = None,
+        checkpoint_function: Optional[Callable[[], Any]] = None,
+        checkpoint_interval: int = 10,
+    ):
+        self.refine_function = refine_function
+        if not self.all_runs:
+            self.get_initial_tree(path)
+        else:
+            logger.info(f"Continuing after {len(self.all_runs) - 1} iterations")
+        logger.info(self)
+        for i in range(len(self.all_runs) - 1, nr_of_turns):
+            logger.info(f"Monte Carlo iteration {i}")
+            if self.root.subtree_is_fully_explored:
+                logger.info("Explored the entire tree!")
+                break
+            try:
+                self.run_iteration(path, timeout, scoring_function)
             except KeyboardInterrupt as k:
                 logger.error(f"Received keyboard interrupt {k}")
                 break
             except BaseException as e:
                 print(f"Encountered an unhandled exception: {e}")
                 raise e
+            if checkpoint_function and (i + 1) % checkpoint_interval == 0:
+                checkpoint_function()
             # logger.debug(self)
+        if checkpoint_function:
+            checkpoint_function()
+        logger.info(self)
+        logger.info(f"Highest scoring decisions: {self.get_max_run()}")
+
+    def run_tree_parallel(
+        self,
+        pipelines: list[tuple["MonteCarloAdvisor[D]", str, Callable, Optional[Callable]]],
+        nr_of_turns: int,
+        timeout: Optional[float],
+        checkpoint_function: Optional[Callable[[], Any]] = None,
+        checkpoint_interval: int = 10,
+    ):
+        """
+        Like `run_monte_carlo`, but with one thread per pipeline that searches
+        the tree of this advisor. A pipeline is a tuple of (advisor, path,
+        scoring_function, refine_function); its advisor compiles through its
+        own channels and the first pipeline must be this advisor.
+        """
+        assert pipelines[0][0] is self
+        if not self.all_runs:
+            self.get_initial_tree(pipelines[0][1])
+        else:
+            logger.info(f"Continuing after {len(self.all_runs) - 1} iterations")
+        for advisor, *_ in pipelines[1:]:
+            advisor.share_search(self)
+        logger.info(self)
+
+        iterations = count(len(self.all_runs) - 1)
+        stop = threading.Event()
+
+        def work(advisor: MonteCarloAdvisor[D], path, scoring_function, refine_function):
+            advisor.refine_function = refine_function
+            while not stop.is_set():
+                with self.lock:
+                    i = next(iterations)
+                    if i >= nr_of_turns or self.root.subtree_is_fully_explored:
+                        return
+                logger.info(f"Monte Carlo iteration {i}")
+                advisor.run_iteration(path, timeout, scoring_function)
+                if checkpoint_function and (i + 1) % checkpoint_interval == 0:
+                    with self.lock:
+                        checkpoint_function()
+
+        with ThreadPoolExecutor(max_workers=len(pipelines)) as executor:
+            futures = [executor.submit(work, *pipeline) for pipeline in pipelines]
+            try:
+                for future in futures:
+                    future.result()
+            except KeyboardInterrupt as k:
+                logger.error(f"Received keyboard interrupt {k}")
+            finally:  # let running iterations finish, but start no new ones
+                stop.set()
+        if self.root.subtree_is_fully_explored:
+            logger.info("Explored the entire tree!")
+        if checkpoint_function:
+            checkpoint_function()
         logger.info(self)
         logger.info(f"Highest scoring decisions: {self.get_max_run()}")
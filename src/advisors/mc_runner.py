@@ -1,21 +1,164 @@
+import asyncio
+import io
 import logging
 import os
+import selectors
+import shutil
 import subprocess
 import tempfile
+import time
+import weakref
 from abc import ABC, abstractmethod
-from typing import Any, Callable, Optional, Union
+from contextlib import contextmanager
+from typing import Any, Callable, Generator, Optional, Union
 
 import utils
 from advisors import log_reader
 
 logger = logging.getLogger(__name__)
 
+# how often a wait without pidfd wakes up to check the compiler
+WAKEUP_INTERVAL = 0.05
+
+# Protocol of one channel, written as a generator: it yields whenever it waits
+# for the compiler and is sent the result of the wait, see InputWaiter.wait.
+Exchange = Generator[None, str, None]
+
+
+def session_root() -> Optional[str]:
+    """The tmpfs for session directories, or None for the default temporary directory."""
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return None
+
+
+def set_nonblocking(pipe):
+    os.set_blocking(pipe.fileno(), False)
+
+
+def set_blocking(pipe):
+    os.set_blocking(pipe.fileno(), True)
+
+
+class InputWaiter:
+    """
+    Waits for output of the compiler on the `fc` FIFO without spinning: it
+    blocks on the FIFO and on a pidfd of the compiler, until either becomes
+    readable or the timeout passes. `fc` has to be in nonblocking mode.
+    Compilers without a pidfd are polled.
+    """
+
+    def __init__(
+        self,
+        fc: io.BufferedReader,
+        compiler_proc: subprocess.Popen[bytes],
+        timeout: Optional[float] = None,
+        name: str = "runner",
+    ) -> None:
+        self.fc = fc
+        self.compiler_proc = compiler_proc
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.timeout = timeout
+        self.name = name
+        try:
+            self.pidfd: Optional[int] = os.pidfd_open(compiler_proc.pid)
+        except (AttributeError, OSError):  # no pidfd support, poll the process
+            self.pidfd = None
+        self.watch()
+
+    def watch(self):
+        self.selector = selectors.DefaultSelector()
+        for fd in self.fds():
+            self.selector.register(fd, selectors.EVENT_READ)
+
+    def unwatch(self):
+        self.selector.close()
+
+    def fds(self) -> list[int]:
+        return [self.fc.fileno()] + ([self.pidfd] if self.pidfd is not None else [])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.unwatch()
+        if self.pidfd is not None:
+            os.close(self.pidfd)
+            self.pidfd = None
+
+    def status(self) -> Optional[str]:
+        if len(self.fc.peek(1)) > 0:
+            return "yes"
+        if self.compiler_proc.poll() is not None:
+            return "dead"
+        return None
+
+    def interval(self) -> Optional[float]:
+        """How long to block until the next check, raises TimeoutError after the timeout."""
+        interval = None
+        if self.pidfd is None:
+            interval = WAKEUP_INTERVAL
+        if self.deadline:
+            remaining = self.deadline - time.monotonic()
+            if remaining <= 0:
+                logger.debug(
+                    f"Timeout for opt in {self.name}: opt took longer than {self.timeout} seconds to complete."
+                )
+                raise TimeoutError()
+            interval = remaining if interval is None else min(interval, remaining)
+        return interval
+
+    def wait(self) -> str:
+        """
+        Returns "yes" once input is available and "dead" if the compiler
+        exited. Raises TimeoutError after the timeout.
+        """
+        while (status := self.status()) is None:
+            self.selector.select(self.interval())
+        return status
+
+
+class AsyncInputWaiter(InputWaiter):
+    """InputWaiter for an asyncio event loop, waiting on the loop's readers."""
+
+    def watch(self):
+        self.loop = asyncio.get_running_loop()
+        self.readable = asyncio.Event()
+        for fd in self.fds():
+            self.loop.add_reader(fd, self.readable.set)
+
+    def unwatch(self):
+        for fd in self.fds():
+            self.loop.remove_reader(fd)
+
+    async def wait(self) -> str:
+        while (status := self.status()) is None:
+            self.readable.clear()
+            interval = self.interval()
+            try:
+                await asyncio.wait_for(self.readable.wait(), interval)
+            except TimeoutError:  # checked again by interval()
+                pass
+        return status
+
 
 class CompilerCommunicator(ABC):
-    def __init__(self, input_name, debug):
-        self.channel_base: str = input_name + type(self).__name__
+    def __init__(self, input_name, debug, session_directory: Optional[str] = None):
+        # Every communicator gets its own directory for the FIFOs and the
+        # output module, so that compiles of the same input can run side by side.
+        if session_directory is None:
+            session_directory = tempfile.mkdtemp(prefix="mc-session-", dir=session_root())
+            weakref.finalize(self, shutil.rmtree, session_directory, ignore_errors=True)
+        self.session_directory = session_directory
+        self.channel_base: str = os.path.join(
+            session_directory, os.path.basename(input_name) + type(self).__name__
+        )
         self.to_compiler = self.channel_base + ".in"
         self.from_compiler = self.channel_base + ".out"
+        self.output_module = os.path.join(session_directory, "mod-post-mc.bc")
         self.debug: bool = debug
 
     @abstractmethod
@@ -27,7 +170,8 @@ class CompilerCommunicator(ABC):
         on_heuristic: Optional[Callable[[int], Any]] = None,
         on_action: Optional[Callable[[bool], Any]] = None,
         timeout: Optional[float] = None,
-    ): ...
+    ):
+        pass
 
     def clean_up_pipes(self):
         logger.debug(f"Cleaning up pipes for {type(self).__name__} ")
@@ -40,6 +184,31 @@ class CompilerCommunicator(ABC):
         except FileNotFoundError:
             pass
 
+    def compile_module(
+        self,
+        opt_args: list[str],
+        input_module: str,
+        output_module: str,
+        advice: Callable[[str, list[log_reader.TensorValue], Optional[int]], int],
+        on_action: Optional[Callable[[bool], Any]] = None,
+        timeout: Optional[float] = None,
+    ):
+        """
+        Compile `input_module` into the session directory and copy the result
+        to `output_module` once opt finished. The session directory may be on a
+        different filesystem, so the copy goes to a temporary file next to
+        `output_module` that is renamed into place, and readers never see a
+        partial module.
+        """
+        self.compile_once(
+            opt_args + ["-o", self.output_module, input_module],
+            advice,
+            on_action=on_action,
+            timeout=timeout,
+        )
+        utils.atomic_copy(self.output_module, output_module)
+        os.unlink(self.output_module)  # /dev/shm is memory
+
     def compile_once(
         self,
         process_and_args: list[str],
@@ -78,3 +247,88 @@ class CompilerCommunicator(ABC):
                     ):  # -2 is Ctrl-C and -15 is us terminating the process
                         logger.error(f"Process failed with error code: {status}")
                         exit(status)
+
+
+class ChannelCommunicator(CompilerCommunicator):
+    """
+    A communicator for a single pair of FIFOs, whose protocol is the `exchange`
+    generator. It yields whenever it waits for opt.
+    """
+
+    @abstractmethod
+    def exchange(
+        self,
+        compiler_proc: subprocess.Popen[bytes],
+        tc: io.BufferedWriter,
+        fc: io.BufferedReader,
+        advice: Callable[[str, list[log_reader.TensorValue], Optional[int]], int],
+        on_features: Optional[Callable[[list[log_reader.TensorValue]], Any]] = None,
+        on_heuristic: Optional[Callable[[int], Any]] = None,
+        on_action: Optional[Callable[[bool], Any]] = None,
+    ) -> Exchange:
+        """The protocol of this channel, driven by communicate_with_proc or communicate_async."""
+
+    @contextmanager
+    def channel(self):
+        logger.debug(f"Opening pipes {self.to_compiler} and {self.from_compiler}")
+        os.mkfifo(self.to_compiler, 0o666)
+        os.mkfifo(self.from_compiler, 0o666)
+        with io.BufferedWriter(io.FileIO(self.to_compiler, "w+b")) as tc:
+            with io.BufferedReader(io.FileIO(self.from_compiler, "r+b")) as fc:
+                yield tc, fc
+
+    def communicate_with_proc(
+        self,
+        compiler_proc: subprocess.Popen[bytes],
+        advice: Callable[[str, list[log_reader.TensorValue], Optional[int]], int],
+        on_features: Optional[Callable[[list[log_reader.TensorValue]], Any]] = None,
+        on_heuristic: Optional[Callable[[int], Any]] = None,
+        on_action: Optional[Callable[[bool], Any]] = None,
+        timeout: Optional[float] = None,
+    ):
+        set_nonblocking(compiler_proc.stdout)
+        with self.channel() as (tc, fc):
+            logger.debug("Starting communication")
+            # The waiter raises TimeoutError but does not terminate the process,
+            # because that leads to issues when two threads call terminate() in
+            # rapid succession.
+            with InputWaiter(
+                fc, compiler_proc, timeout, type(self).__name__
+            ) as waiter:
+                exchange = self.exchange(
+                    compiler_proc, tc, fc, advice, on_features, on_heuristic, on_action
+                )
+                try:
+                    next(exchange)
+                    while True:
+                        tc.flush()  # the advice of this turn, before waiting for opt
+                        exchange.send(waiter.wait())
+                except StopIteration:
+                    return
+
+    async def communicate_async(
+        self,
+        compiler_proc: subprocess.Popen[bytes],
+        advice: Callable[[str, list[log_reader.TensorValue], Optional[int]], int],
+        on_features: Optional[Callable[[list[log_reader.TensorValue]], Any]] = None,
+        on_heuristic: Optional[Callable[[int], Any]] = None,
+        on_action: Optional[Callable[[bool], Any]] = None,
+        timeout: Optional[float] = None,
+    ):
+        """communicate_with_proc in an event loop, so that channels can share a thread."""
+        set_nonblocking(compiler_proc.stdout)
+        with self.channel() as (tc, fc):
+            logger.debug("Starting communication")
+            with AsyncInputWaiter(
+                fc, compiler_proc, timeout, type(self).__name__
+            ) as waiter:
+                exchange = self.exchange(
+                    compiler_proc, tc, fc, advice, on_features, on_heuristic, on_action
+                )
+                try:
+                    next(exchange)
+                    while True:
+                        tc.flush()  # the advice of this turn, before waiting for opt
+                        exchange.send(await waiter.wait())
+                except StopIteration:
+                    return
@@ -33,8 +33,8 @@ class MergedMonteCarloAdvisor(MonteCarloAdvisor[bool | int]):
             "-inliner-interactive-include-default",
             # "-debug-only=inline,inline-ml",
             "-enable-ml-inliner=release",
-            f"-inliner-interactive-channel-base={self.inline_advisor.filename}",
-            f"--mlgo-loop-unroll-interactive-channel-base={self.loop_unroll_advisor.filename}",
+            f"-inliner-interactive-channel-base={self.runner.inline_comm.channel_base}",
+            f"--mlgo-loop-unroll-interactive-channel-base={self.runner.loop_comm.channel_base}",
             "--mlgo-loop-unroll-advisor-mode=development",
             "-debug-only=loop-unroll-development-advisor,loop-unroll,inline,inline-ml",
         ]
@@ -49,7 +49,7 @@ class MergedMonteCarloAdvisor(MonteCarloAdvisor[bool | int]):
         if state.is_leaf():
             choice = self.get_rollout_decision(tv, heuristic, advisor_type)
             return state.add_child(choice)
-        assert (type(state.children[0].decisions[-1]) is bool) == (
+        assert state.has_bool_children() == (
             advisor_type == utils.INLINE
         )  # if we have an inlining decision, we expect the children to be inline == bool decision states
         match advisor_type:
@@ -91,17 +91,15 @@ class MergedMonteCarloAdvisor(MonteCarloAdvisor[bool | int]):
         state.subtree_is_fully_explored = True
         current = state.parent
         while current:
-            if type(current.children[0].decisions[-1]) is bool:
-                all_children_visited = len(current.children) == 2
-            elif type(current.children[0].decisions[-1]) is int:
+            if current.has_bool_children():
+                all_children_visited = current.num_children() == 2
+            else:
                 all_children_visited = (
-                    len(current.children) == self.loop_unroll_advisor.MAX_UNROLL_FACTOR
+                    current.num_children() == self.loop_unroll_advisor.MAX_UNROLL_FACTOR
                 )
-            else:
-                logger.error("Decisions should only be int or bools... what happened?")
-                exit(-1)
-            if all_children_visited and all(
-                c.subtree_is_fully_explored for c in current.children
+            if (
+                all_children_visited
+                and current.num_explored_children() == current.num_children()
             ):
                 current.subtree_is_fully_explored = True
                 current = current.parent
@@ -116,7 +114,7 @@ class MergedMonteCarloAdvisor(MonteCarloAdvisor[bool | int]):
             self.current_path[-1] = 1
             logger.debug("Unsuccessful unrolling during rollout")
             return
-        if not self.in_rollout and self.current and self.current.decisions[-1] != 1:
+        if not self.in_rollout and self.current and self.current.decision != 1:
             # assert self.current.is_leaf()
             # should only happen in leaf states, otherwise would have triggered earlier
             logger.warning("Unsuccessful unrolling")
@@ -125,13 +123,14 @@ class MergedMonteCarloAdvisor(MonteCarloAdvisor[bool | int]):
     @override
     def advice(self, advisor_type: str, tv, heuristic) -> Any:
         assert self.current
-        if self.current.visits == 0:
-            self.in_rollout = True
-            decision = self.get_rollout_decision(tv, heuristic, advisor_type)
-        else:
-            next = self.get_next_state(self.current, tv, heuristic, advisor_type)
-            self.current = next
-            decision = next.decisions[-1]
+        with self.lock:
+            if self.current.visits == 0:
+                self.in_rollout = True
+                decision = self.get_rollout_decision(tv, heuristic, advisor_type)
+            else:
+                next = self.get_next_state(self.current, tv, heuristic, advisor_type)
+                self.enter_state(next)
+                decision = next.decision
         self.current_path.append(decision)
         logger.debug(f"Current path: {self.current_path}")
         return self.wrap_advice(advisor_type, decision)
@@ -148,10 +147,12 @@ class MergedMonteCarloAdvisor(MonteCarloAdvisor[bool | int]):
 
     @override
     def get_score(self, path: str, timeout: Optional[float], scoring_function):
-        self.runner.compile_once(
-            self.opt_args() + ["-o", path + "mod-post-mc.bc", path + "mod-pre-mc.bc"],
+        self.runner.compile_module(
+            self.opt_args(),
+            path + "mod-pre-mc.bc",
+            path + "mod-post-mc.bc",
             self.advice,
             on_action=self.check_unroll_success,
             timeout=timeout,
         )
-        return scoring_function()
+        return self.score_path(scoring_function)
@@ -13,40 +13,42 @@
 # limitations under the License.
 """Module for communicate with compiler for unroll decisions"""
 
+import asyncio
 import logging
 import subprocess
-import tempfile
-import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Any, BinaryIO, Callable, List, Optional, Tuple, Union, final
+from typing import Any, Callable, Optional, final
 
 from typing_extensions import override
 
-import utils
 from advisors import log_reader
 from advisors.inline.inline_runner import InlineCompilerCommunicator
 from advisors.loop_unroll.loop_unroll_runner import LoopUnrollCompilerCommunicator
-from advisors.mc_runner import CompilerCommunicator
+from advisors.mc_runner import ChannelCommunicator, CompilerCommunicator
 
 logger = logging.getLogger(__name__)
 
 
 @final
 class MergedCompilerCommunicator(CompilerCommunicator):
+    """
+    Drives the channels of all advisors of one opt process in a single event
+    loop. The first error cancels the other channels and is raised.
+    """
+
     def __init__(self, input_name: str, debug):
         super().__init__(input_name, debug)
-        # self.input_name = input_name
-        # self.debug = debug
-        self.stop_event: threading.Event = threading.Event()
         self.inline_comm = InlineCompilerCommunicator(
-            input_name, False, self.stop_event
+            input_name, False, session_directory=self.session_directory
+        )
+        self.loop_comm = LoopUnrollCompilerCommunicator(
+            input_name, False, self.session_directory
         )
-        self.loop_comm = LoopUnrollCompilerCommunicator(input_name, False)
+        self.channels: list[ChannelCommunicator] = [self.inline_comm, self.loop_comm]
 
     @override
     def clean_up_pipes(self):
-        self.inline_comm.clean_up_pipes()
-        self.loop_comm.clean_up_pipes()
+        for channel in self.channels:
+            channel.clean_up_pipes()
 
     def communicate_with_proc(
         self,
@@ -57,40 +59,38 @@ class MergedCompilerCommunicator(CompilerCommunicator):
         on_action: Optional[Callable[[bool], Any]] = None,
         timeout: Optional[float] = None,
     ):
-        self.stop_event.clear()
-        with ThreadPoolExecutor(max_workers=2) as executor:
-            fut_inline = executor.submit(
-                self.inline_comm.communicate_with_proc,
-                compiler_proc,
-                advice,
-                None,
-                None,
-                None,
-                timeout,
+        # one event loop per compile instead of a thread per channel, closed
+        # once the channels finished or were cancelled
+        with asyncio.Runner() as runner:
+            runner.run(
+                self.communicate_async(
+                    compiler_proc, advice, None, None, on_action, timeout
+                )
             )
-            fut_loop = executor.submit(
-                self.loop_comm.communicate_with_proc,
-                compiler_proc,
-                advice,
-                None,
-                None,
-                on_action,
-                timeout,
-            )
-
-            for fut in as_completed([fut_inline, fut_loop]):
-                try:
-                    fut.result()
-                except TimeoutError as t:
-                    if fut_inline.done() and fut_loop.done():
-                        logger.warning(
-                            f"Timeout: opt timed out after {timeout} seconds"
-                        )
-                        raise t
-                except utils.MonteCarloError as e:
-                    self.stop_event.set()
-                    raise e
 
-                except BaseException as e:
-                    self.stop_event.set()
-                    raise e
+    async def communicate_async(
+        self,
+        compiler_proc: subprocess.Popen[bytes],
+        advice: Callable[[str, list[log_reader.TensorValue], Optional[int]], int],
+        on_features: Optional[Callable[[list[log_reader.TensorValue]], Any]] = None,
+        on_heuristic: Optional[Callable[[int], Any]] = None,
+        on_action: Optional[Callable[[bool], Any]] = None,
+        timeout: Optional[float] = None,
+    ):
+        tasks = [
+            asyncio.create_task(
+                channel.communicate_async(
+                    compiler_proc, advice, on_features, on_heuristic, on_action, timeout
+                )
+            )
+            for channel in self.channels
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except TimeoutError:
+            logger.warning(f"Timeout: opt timed out after {timeout} seconds")
+            raise
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
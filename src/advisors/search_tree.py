@@ -0,0 +1,489 @@
+import logging
+from typing import Generic, Optional, TypeVar
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+D = TypeVar("D", int, bool)
+
+NO_NODE = -1
+
+# Width of the child slot table of a node: unroll factors are looked up
+# directly by value, booleans only need two slots.
+INT_SLOTS = 33
+BOOL_SLOTS = 2
+
+
+class SearchTree:
+    """
+    Struct-of-arrays store for the Monte Carlo search tree.
+
+    Every node is an index into a set of NumPy arrays. A node only stores its
+    own (last) decision and a link to its parent, the full decision path is
+    rebuilt on demand by walking the parent links.
+
+    Children are kept in a linked list (for enumeration) and additionally in a
+    per-node slot table indexed by decision value, which makes looking up and
+    inserting a child O(1).
+    """
+
+    _arrays = (
+        "parent",
+        "decision",
+        "is_bool",
+        "depth",
+        "score",
+        "speedup_sum",
+        "visits",
+        "explored",
+        "first_child",
+        "next_sibling",
+        "num_children",
+        "explored_children",
+        "slot_row",
+    )
+    # Per-node state of running iterations, not part of checkpoints
+    _transient_arrays = ("in_flight",)
+
+    def __init__(self, capacity: int = 1024) -> None:
+        self.size = 0
+        self.parent = np.empty(capacity, dtype=np.int64)
+        self.decision = np.empty(capacity, dtype=np.int64)
+        self.is_bool = np.empty(capacity, dtype=np.bool_)
+        self.depth = np.empty(capacity, dtype=np.int32)
+        self.score = np.empty(capacity, dtype=np.float64)
+        self.speedup_sum = np.empty(capacity, dtype=np.float64)
+        self.visits = np.empty(capacity, dtype=np.int64)
+        self.explored = np.empty(capacity, dtype=np.bool_)
+        self.first_child = np.empty(capacity, dtype=np.int64)
+        self.next_sibling = np.empty(capacity, dtype=np.int64)
+        self.num_children = np.empty(capacity, dtype=np.int32)
+        self.explored_children = np.empty(capacity, dtype=np.int32)
+        # Row into `int_slots` (>= 0) or `bool_slots` (encoded as -row - 2)
+        self.slot_row = np.empty(capacity, dtype=np.int64)
+        # Number of iterations currently passing through a node (virtual loss)
+        self.in_flight = np.empty(capacity, dtype=np.int32)
+        rows = max(capacity // 4, 1)
+        self.int_slots = np.full((rows, INT_SLOTS), NO_NODE, dtype=np.int64)
+        self.bool_slots = np.full((rows, BOOL_SLOTS), NO_NODE, dtype=np.int64)
+        self.int_rows = 0
+        self.bool_rows = 0
+
+        # Best score ever written to a node. Later (lower) averages of the same
+        # node do not overwrite it, so revisiting the best node keeps its record.
+        self.best_index: int = NO_NODE
+        self.best_score: float = -np.inf
+
+        self.root: State = self.state(self.add_node(NO_NODE, 0))
+
+    def __len__(self) -> int:
+        return self.size
+
+    def to_arrays(self) -> dict[str, np.ndarray]:
+        """The used part of all arrays, e.g. for checkpointing."""
+        arrays = {name: getattr(self, name)[: self.size] for name in self._arrays}
+        arrays["int_slots"] = self.int_slots[: self.int_rows]
+        arrays["bool_slots"] = self.bool_slots[: self.bool_rows]
+        arrays["best"] = np.array([self.best_index, self.best_score])
+        return arrays
+
+    @staticmethod
+    def from_arrays(arrays: dict[str, np.ndarray]) -> "SearchTree":
+        """Inverse of `to_arrays`."""
+        size = len(arrays["parent"])
+        tree = SearchTree(capacity=max(2 * size, 1024))
+        for name in SearchTree._arrays:
+            getattr(tree, name)[:size] = arrays[name]
+        tree.in_flight[:size] = 0
+        tree.size = size
+        tree.root = tree.state(0)
+        for table in ["int_slots", "bool_slots"]:
+            rows, width = arrays[table].shape
+            restored = np.full(
+                (max(2 * rows, 1), max(width, getattr(tree, table).shape[1])),
+                NO_NODE,
+                dtype=np.int64,
+            )
+            restored[:rows, :width] = arrays[table]
+            setattr(tree, table, restored)
+        tree.int_rows = len(arrays["int_slots"])
+        tree.bool_rows = len(arrays["bool_slots"])
+        tree.best_index = int(arrays["best"][0])
+        tree.best_score = float(arrays["best"][1])
+        return tree
+
+    def capacity(self) -> int:
+        return len(self.parent)
+
+    def _grow(self):
+        new_capacity = 2 * self.capacity()
+        for name in self._arrays + self._transient_arrays:
+            old = getattr(self, name)
+            new = np.empty(new_capacity, dtype=old.dtype)
+            new[: self.size] = old[: self.size]
+            setattr(self, name, new)
+
+    def _new_slot_row(self, is_bool: bool) -> int:
+        table = self.bool_slots if is_bool else self.int_slots
+        rows = self.bool_rows if is_bool else self.int_rows
+        if rows == len(table):
+            table = np.concatenate([table, np.full_like(table, NO_NODE)])
+            if is_bool:
+                self.bool_slots = table
+            else:
+                self.int_slots = table
+        if is_bool:
+            self.bool_rows += 1
+            return -rows - 2
+        self.int_rows += 1
+        return rows
+
+    def _widen_int_slots(self, width: int):
+        extra = np.full(
+            (len(self.int_slots), width - self.int_slots.shape[1]),
+            NO_NODE,
+            dtype=np.int64,
+        )
+        self.int_slots = np.concatenate([self.int_slots, extra], axis=1)
+
+    def slots(self, index: int) -> Optional[np.ndarray]:
+        """View of the child slot table of `index`, indexed by decision value."""
+        row = int(self.slot_row[index])
+        if row == NO_NODE:
+            return None
+        if row < NO_NODE:
+            return self.bool_slots[-row - 2]
+        return self.int_slots[row]
+
+    def child(self, index: int, choice) -> int:
+        value = int(choice)  # NumPy would read a bool as a mask
+        slots = self.slots(index)
+        if slots is None or not 0 <= value < len(slots):
+            return NO_NODE
+        return int(slots[value])
+
+    def add_node(
+        self,
+        parent: int,
+        choice,
+        score: float = 0.0,
+        speedup_sum: float = 0.0,
+        visits: int = 0,
+    ) -> int:
+        """Append a node below `parent` and return its index."""
+        if self.size == self.capacity():
+            self._grow()
+        i = self.size
+        self.size += 1
+
+        self.parent[i] = parent
+        self.decision[i] = int(choice)
+        self.is_bool[i] = isinstance(choice, bool)
+        self.speedup_sum[i] = speedup_sum
+        self.visits[i] = visits
+        self.explored[i] = False
+        self.first_child[i] = NO_NODE
+        self.next_sibling[i] = NO_NODE
+        self.num_children[i] = 0
+        self.explored_children[i] = 0
+        self.slot_row[i] = NO_NODE
+        self.in_flight[i] = 0
+
+        if parent == NO_NODE:
+            self.depth[i] = 0
+        else:
+            self.depth[i] = self.depth[parent] + 1
+            self.next_sibling[i] = self.first_child[parent]
+            self.first_child[parent] = i
+            self.num_children[parent] += 1
+            self._link_slot(parent, i)
+        self.set_score(i, score)
+        return i
+
+    def _link_slot(self, parent: int, child: int):
+        value = int(self.decision[child])
+        if value < 0:
+            raise ValueError(f"Decisions need to be non-negative, got {value}")
+        if self.slot_row[parent] == NO_NODE:
+            self.slot_row[parent] = self._new_slot_row(bool(self.is_bool[child]))
+        slots = self.slots(parent)
+        assert slots is not None
+        if value >= len(slots):
+            if self.slot_row[parent] < NO_NODE:
+                raise ValueError(f"Decision {value} below a boolean decision node")
+            self._widen_int_slots(value + 1)
+            slots = self.slots(parent)
+            assert slots is not None
+        if slots[value] == NO_NODE:  # duplicates stay reachable through the sibling list
+            slots[value] = child
+
+    def set_explored(self, index: int, explored: bool):
+        if self.explored[index] == explored:
+            return
+        self.explored[index] = explored
+        parent = self.parent[index]
+        if parent != NO_NODE:
+            self.explored_children[parent] += 1 if explored else -1
+
+    def set_score(self, index: int, score: float):
+        self.score[index] = score
+        if score > self.best_score or (
+            score == self.best_score and self.depth[index] > self.depth[self.best_index]
+        ):  # on ties prefer the deeper node, i.e. the one the score was measured for
+            self.best_index = index
+            self.best_score = float(score)
+
+    def add_virtual_loss(self, index: int):
+        """Count an iteration that passes through `index` but has no score yet."""
+        self.in_flight[index] += 1
+
+    def remove_virtual_loss(self, index: int):
+        self.in_flight[index] -= 1
+
+    def reset_best(self):
+        """Fall back to the highest current score, e.g. after the best node was invalidated."""
+        self.best_index = int(np.argmax(self.score[: self.size]))
+        self.best_score = float(self.score[self.best_index])
+
+    def is_invalid(self, index: int) -> bool:
+        """Invalid nodes carry a (negative) error code instead of a speedup."""
+        return bool(self.score[index] < 0)
+
+    def best_state(self) -> "State":
+        return self.state(self.best_index)
+
+    def merge(self, other: "SearchTree"):
+        """
+        Add the statistics of `other` to this tree, matching nodes by their
+        decision path. Nodes that only exist in `other` are added. Error codes
+        are not summed with speedups: a node that is invalid in either tree is
+        invalid in the merged one.
+        """
+        mapping = np.empty(other.size, dtype=np.int64)
+        for i in range(other.size):  # parents always come before their children
+            if other.parent[i] == NO_NODE:
+                target = 0
+            else:
+                parent = int(mapping[other.parent[i]])
+                choice = other.get_decision(i)
+                target = self.child(parent, choice)
+                if target == NO_NODE:
+                    target = self.add_node(parent, choice)
+            mapping[i] = target
+            if other.explored[i]:
+                self.set_explored(target, True)
+            if self.is_invalid(target):
+                continue
+            if other.is_invalid(i):
+                self.visits[target] = other.visits[i]
+                self.speedup_sum[target] = other.speedup_sum[i]
+                self.set_score(target, other.score[i])
+                if self.best_index == target:
+                    self.reset_best()
+                continue
+            self.visits[target] += other.visits[i]
+            self.speedup_sum[target] += other.speedup_sum[i]
+            if self.visits[target] > 0:
+                self.set_score(target, self.speedup_sum[target] / self.visits[target])
+
+    def state(self, index: int) -> "State":
+        """A handle for the node at `index`. Handles are created on demand and
+        not kept, equal handles refer to the same node."""
+        return State(self, index)
+
+    def get_decision(self, index: int):
+        value = int(self.decision[index])
+        return bool(value) if self.is_bool[index] else value
+
+    def decisions(self, index: int) -> list:
+        path = []
+        while self.parent[index] != NO_NODE:
+            path.append(self.get_decision(index))
+            index = int(self.parent[index])
+        path.reverse()
+        return path
+
+    def unexpanded_decisions(self, index: int, low: int, high: int) -> np.ndarray:
+        """Decisions in [low, high] that do not have a child below `index` yet."""
+        slots = self.slots(index)
+        if slots is None:
+            return np.arange(low, high + 1)
+        return np.flatnonzero(slots[low : high + 1] == NO_NODE) + low
+
+    def child_array(self, index: int) -> np.ndarray:
+        """Indices of the children of `index`, ordered by decision."""
+        slots = self.slots(index)
+        if slots is None:
+            return np.empty(0, dtype=np.int64)
+        return slots[slots != NO_NODE]
+
+    def child_indices(self, index: int) -> list[int]:
+        """Children of `index` in insertion order."""
+        children = []
+        child = int(self.first_child[index])
+        while child != NO_NODE:
+            children.append(child)
+            child = int(self.next_sibling[child])
+        children.reverse()
+        return children
+
+
+class State(Generic[D]):
+    """Lightweight handle to a single node of a `SearchTree`."""
+
+    __slots__ = ("tree", "index")
+
+    def __init__(self, tree: SearchTree, index: int):
+        self.tree = tree
+        self.index = index
+
+    def __eq__(self, other) -> bool:
+        return (
+            isinstance(other, State)
+            and other.tree is self.tree
+            and other.index == self.index
+        )
+
+    def __hash__(self) -> int:
+        return hash((id(self.tree), self.index))
+
+    @property
+    def decisions(self) -> list[D]:
+        return self.tree.decisions(self.index)
+
+    @property
+    def decision(self) -> D:
+        """The decision that led from the parent to this state."""
+        assert self.tree.parent[self.index] != NO_NODE
+        return self.tree.get_decision(self.index)
+
+    @property
+    def depth(self) -> int:
+        return int(self.tree.depth[self.index])
+
+    @property
+    def score(self) -> float:
+        return float(self.tree.score[self.index])
+
+    @score.setter
+    def score(self, value: float):
+        self.tree.set_score(self.index, value)
+
+    @property
+    def speedup_sum(self) -> float:
+        return float(self.tree.speedup_sum[self.index])
+
+    @speedup_sum.setter
+    def speedup_sum(self, value: float):
+        self.tree.speedup_sum[self.index] = value
+
+    @property
+    def visits(self) -> int:
+        return int(self.tree.visits[self.index])
+
+    @visits.setter
+    def visits(self, value: int):
+        self.tree.visits[self.index] = value
+
+    @property
+    def subtree_is_fully_explored(self) -> bool:
+        return bool(self.tree.explored[self.index])
+
+    @subtree_is_fully_explored.setter
+    def subtree_is_fully_explored(self, value: bool):
+        self.tree.set_explored(self.index, value)
+
+    @property
+    def parent(self) -> Optional["State[D]"]:
+        parent = int(self.tree.parent[self.index])
+        return None if parent == NO_NODE else self.tree.state(parent)
+
+    @property
+    def children(self) -> list["State[D]"]:
+        """Children sorted by their decision."""
+        children = self.tree.child_indices(self.index)
+        children.sort(key=lambda c: self.tree.decision[c])
+        return [self.tree.state(c) for c in children]
+
+    def __repr__(self) -> str:
+        return (
+            f"State(decisions={self.decisions}, "
+            f"score={self.score:.7f},"
+            f"visits={self.visits})" + (f"*" if self.subtree_is_fully_explored else "")
+        )
+
+    def __getitem__(self, index: D):
+        child = self.child(index)
+        if child is None:
+            raise KeyError(index)
+        return child
+
+    def child(self, choice: D) -> Optional["State[D]"]:
+        """The child reached by `choice`, if it was already expanded."""
+        child = self.tree.child(self.index, choice)
+        return None if child == NO_NODE else self.tree.state(child)
+
+    def has_bool_children(self) -> bool:
+        return self.tree.slot_row[self.index] < NO_NODE
+
+    def repr_subtree(self):
+        """
+        Print the subtree rooted at `root` in an ASCII-tree layout.
+        """
+        lines: list[str] = ["\n"]
+
+        def _walk(node: "State", prefix: str, label: str | None, is_last: bool):
+            # pick branch symbols
+            connector = "└── " if is_last else "├── "
+            label_str = f"[{label}] " if label else ""
+            lines.append(prefix + connector + label_str + repr(node))
+
+            # prepare prefix for children
+            new_prefix = prefix + ("      " if is_last else "│     ")
+
+            # gather existing children in order
+            labeled_children = []
+            for child in node.children:
+                labeled_children.append((str(child.decision), child))
+
+            # recurse
+            for idx, (lbl, child) in enumerate(labeled_children):
+                _walk(child, new_prefix, lbl, idx == len(labeled_children) - 1)
+
+        # print the root node itself (no connector or label)
+        lines.append(repr(self))
+
+        # then its immediate children
+        root_children = []
+        for child in self.children:
+            root_children.append((str(child.decision), child))
+
+        for idx, (lbl, child) in enumerate(root_children):
+            _walk(child, "", lbl, idx == len(root_children) - 1)
+
+        return "\n".join(lines)
+
+    def add_child(
+        self, choice: D, score: float = 0.0, speedup_sum=0.0, visits: int = 0
+    ) -> "State[D]":
+        """Create, link, and return a new child state."""
+        return self.tree.state(
+            self.tree.add_node(self.index, choice, score, speedup_sum, visits)
+        )
+
+    def num_children(self) -> int:
+        return int(self.tree.num_children[self.index])
+
+    def num_explored_children(self) -> int:
+        return int(self.tree.explored_children[self.index])
+
+    def num_unvisited(self, branching_factor: int) -> int:
+        """Number of decisions out of `branching_factor` without a child yet."""
+        return branching_factor - self.num_children()
+
+    def unvisited_decisions(self, low: int, high: int) -> np.ndarray:
+        return self.tree.unexpanded_decisions(self.index, low, high)
+
+    def is_leaf(self) -> bool:
+        return self.tree.first_child[self.index] == NO_NODE
@@ -0,0 +1,127 @@
+"""
+Checkpoints of a Monte Carlo run: the search tree, the run history and the
+baseline measurement, stored as NumPy arrays in a single `.npz` file.
+"""
+
+import io
+import logging
+
+import numpy as np
+
+from advisors.mc_advisor import MonteCarloAdvisor
+from advisors.search_tree import SearchTree
+from datastructures import AdaptiveBenchmarkingResult
+from utils import MonteCarloError, atomic_write
+
+logger = logging.getLogger(__name__)
+
+TREE_PREFIX = "tree_"
+
+
+def pack_paths(paths, prefix: str) -> dict[str, np.ndarray]:
+    """Flatten a list of decision paths into value, type and offset arrays."""
+    values = [d for path in paths for d in path]
+    return {
+        f"{prefix}_values": np.array(values, dtype=np.int64),
+        f"{prefix}_is_bool": np.array(
+            [isinstance(d, bool) for d in values], dtype=np.bool_
+        ),
+        f"{prefix}_offsets": np.cumsum([0] + [len(path) for path in paths]),
+    }
+
+
+def unpack_paths(arrays, prefix: str) -> list[list]:
+    values = arrays[f"{prefix}_values"].tolist()
+    is_bool = arrays[f"{prefix}_is_bool"].tolist()
+    decisions = [bool(v) if b else v for v, b in zip(values, is_bool)]
+    offsets = arrays[f"{prefix}_offsets"].tolist()
+    return [decisions[begin:end] for begin, end in zip(offsets, offsets[1:])]
+
+
+def save_checkpoint(
+    path: str,
+    advisor: MonteCarloAdvisor,
+    baseline: AdaptiveBenchmarkingResult | list[int],
+    samples_per_run: int = 1,
+):
+    arrays = {
+        TREE_PREFIX + name: array for name, array in advisor.tree.to_arrays().items()
+    }
+    arrays |= pack_paths([run[0] for run in advisor.all_runs], "runs")
+    arrays["runs_scores"] = np.array([run[1] for run in advisor.all_runs])
+    arrays |= pack_paths([advisor.default_path], "default")
+    arrays |= pack_paths(list(advisor.path_scores), "memo")
+    arrays["memo_scores"] = np.array(
+        list(advisor.path_scores.values()), dtype=np.float64
+    ).reshape(-1, 2)
+    arrays |= pack_paths(list(advisor.invalid_paths), "invalid")
+
+    if isinstance(baseline, AdaptiveBenchmarkingResult):
+        arrays["baseline_runtimes"] = baseline.runtimes
+        arrays["baseline_stats"] = np.array(
+            [baseline.median, baseline.ci, baseline.converged]
+        )
+    else:
+        arrays["baseline_runtimes"] = np.array(baseline)
+    arrays["baseline_samples_per_run"] = np.array(samples_per_run)
+
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    atomic_write(path, buffer.getvalue())
+    logger.info(f"Saved checkpoint after {len(advisor.all_runs)} runs to {path}")
+
+
+def load_checkpoint(
+    path: str, advisor: MonteCarloAdvisor, samples_per_run: int = 1
+) -> AdaptiveBenchmarkingResult | list[int]:
+    """
+    Restore `advisor` from the checkpoint at `path` and return the baseline.
+    Batched samples are biased against single ones (see profiler/mc_profiler.c),
+    so the checkpoint must have been measured with the same `samples_per_run`.
+    """
+    with np.load(path) as arrays:
+        measured = 1
+        if "baseline_samples_per_run" in arrays.files:
+            measured = int(arrays["baseline_samples_per_run"])
+        if measured != samples_per_run:
+            raise MonteCarloError(
+                f"{path} was measured with {measured} samples per run, "
+                f"not {samples_per_run}"
+            )
+        advisor.tree = SearchTree.from_arrays(
+            {
+                name[len(TREE_PREFIX) :]: arrays[name]
+                for name in arrays.files
+                if name.startswith(TREE_PREFIX)
+            }
+        )
+        advisor.root = advisor.tree.root
+        advisor.current = advisor.root
+
+        advisor.default_path = unpack_paths(arrays, "default")[0]
+        advisor.all_runs = []
+        advisor.best_run_index = -1
+        advisor.top_runs = []
+        advisor.max_speedup_after_n_iterations = []
+        for run, score in zip(
+            unpack_paths(arrays, "runs"), arrays["runs_scores"].tolist()
+        ):
+            advisor.record_run(run, score)
+        advisor.path_scores = {
+            tuple(p): (score, int(measurements))
+            for p, (score, measurements) in zip(
+                unpack_paths(arrays, "memo"), arrays["memo_scores"].tolist()
+            )
+        }
+        advisor.invalid_paths = set(map(tuple, unpack_paths(arrays, "invalid")))
+
+        if "baseline_stats" in arrays.files:
+            median, ci, converged = arrays["baseline_stats"].tolist()
+            baseline = AdaptiveBenchmarkingResult(
+                arrays["baseline_runtimes"], median, ci, bool(converged)
+            )
+        else:
+            baseline = arrays["baseline_runtimes"].tolist()
+
+    logger.info(f"Resumed from {path} after {len(advisor.all_runs)} runs")
+    return baseline
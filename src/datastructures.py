@@ -18,6 +18,10 @@ class AdaptiveBenchmarkingResult:
     median: float
     ci: float
     converged: bool
+    # sampling stopped early because the candidate was clearly too slow
+    partial: bool = False
+    # number of discarded warmup runs before the samples were taken
+    warmups: int = 0
 
     def is_zero_rt(self):
         return (
@@ -0,0 +1,184 @@
+import hashlib
+import logging
+import os
+import pickle
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Optional, Sequence
+
+from datastructures import AdaptiveBenchmarkingResult
+from utils import atomic_copy, atomic_write
+
+logger = logging.getLogger(__name__)
+
+
+def hash_module(path: str) -> str:
+    """Content hash of an (optimized) bitcode module."""
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+class ScoreCache:
+    """
+    Benchmarking results keyed by the measured channel and the hash of the
+    optimized module.
+
+    Different decision paths often lead to the same module, which then does not
+    need to be linked and benchmarked again. The cache is persisted to `path`
+    every `save_interval` insertions and on `flush`, and keeps at most
+    `max_entries` results, evicting the least recently used ones. It can be
+    shared by threads.
+    """
+
+    def __init__(
+        self, path: str, max_entries: int = 10000, save_interval: int = 16
+    ) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.save_interval = save_interval
+        self.entries: OrderedDict[str, AdaptiveBenchmarkingResult] = OrderedDict()
+        self.unsaved = 0  # insertions since the last save
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()  # the latest snapshot is written last
+        self.load()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as f:
+                self.entries = pickle.load(f)
+            logger.info(f"Loaded {len(self.entries)} cached scores from {self.path}")
+        except FileNotFoundError:
+            pass
+        except (pickle.UnpicklingError, EOFError) as e:
+            logger.warning(f"Ignoring corrupt score cache {self.path}: {e}")
+        self.evict()
+
+    def save(self):
+        with self.save_lock:
+            with self.lock:
+                data = pickle.dumps(self.entries)
+                self.unsaved = 0
+            atomic_write(self.path, data)
+
+    def flush(self):
+        """Save the insertions since the last save, e.g. at a checkpoint or on exit."""
+        if self.unsaved > 0:
+            self.save()
+
+    def evict(self):
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[AdaptiveBenchmarkingResult]:
+        with self.lock:
+            result = self.entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return result
+
+    def put(self, key: str, result: AdaptiveBenchmarkingResult):
+        with self.lock:
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            self.evict()
+            self.unsaved += 1
+            due = self.unsaved >= self.save_interval
+        if due:
+            self.save()
+
+
+class ObjectCache:
+    """
+    Object files compiled by llc, keyed by the hash of the optimized module.
+
+    The store is a plain directory so that concurrent runs on the same machine
+    can share it: entries are written to a temporary file and renamed into
+    place, so readers only ever see complete objects. The modification time of
+    an entry marks its last use, and the least recently used entries are
+    removed once the store grows beyond `max_bytes`. The size of the store is
+    counted as entries are added and only rescanned when it is exceeded.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int,
+        compiler: str = "llc",
+        flags: Sequence[str] = (),
+    ) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+        # objects from a different llc binary or flags must not be mixed up
+        compiler_path = shutil.which(compiler) or compiler
+        try:
+            compiler_id = f"{compiler_path}:{os.stat(compiler_path).st_mtime_ns}"
+        except FileNotFoundError:
+            compiler_id = compiler_path
+        compiler_id = " ".join([compiler_id] + list(flags))
+        self.compiler_hash = hashlib.sha256(compiler_id.encode()).hexdigest()[:16]
+        self.total = sum(size for _, size, _ in self.entries())
+
+    def entry(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}-{self.compiler_hash}.o")
+
+    def entries(self) -> list[tuple[float, int, str]]:
+        """Last use, size and path of every object in the store."""
+        entries = []
+        for e in os.scandir(self.directory):
+            if not e.name.endswith(".o"):
+                continue
+            try:
+                stat = e.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, e.path))
+        return entries
+
+    def fetch(self, key: str, destination: str) -> bool:
+        """Copy the cached object for `key` to `destination`, if there is one."""
+        entry = self.entry(key)
+        try:
+            shutil.copyfile(entry, destination)
+            os.utime(entry)
+        except FileNotFoundError:  # not cached, or evicted by another run
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def store(self, key: str, source: str):
+        entry = self.entry(key)
+        try:
+            replaced = os.path.getsize(entry)
+        except FileNotFoundError:
+            replaced = 0
+        atomic_copy(source, entry)
+        self.total += os.path.getsize(entry) - replaced
+        if self.total > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        # rescanned, other runs sharing the store add and evict entries too
+        entries = self.entries()
+        self.total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if self.total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:  # another run evicted it first
+                pass
+            self.total -= size
@@ -1,22 +1,35 @@
 import argparse
 import logging
+import multiprocessing
+import multiprocessing.connection
 import os
+import shutil
+import subprocess
+import threading
+from contextlib import AbstractContextManager, nullcontext
 from datetime import datetime
-from typing import Set
+from typing import Callable, Optional, Set
 
+import numpy as np
 import psutil
 from matplotlib.pyplot import plot
 
+import checkpoint
 import plot_main
 import utils
 from advisors.inline import inline_mc_advisor
 from advisors.loop_unroll import loop_unroll_mc_advisor
+from advisors.mc_advisor import MonteCarloAdvisor
 from advisors.merged.merged_mc_advisor import MergedMonteCarloAdvisor
 from datastructures import AdaptiveBenchmarkingResult
+from module_cache import ObjectCache, ScoreCache, hash_module
+from toolchain import Toolchain, resolve_make_variables
 
 logger = logging.getLogger(__name__)
 datefmt = "%Y-%m-%d %H:%M:%S"
 fmt = "%(asctime)s.%(msecs)03d|%(levelname)s|%(name)s|%(funcName)s(): %(message)s"
+# left out when copying an input into the directory of a root parallel worker
+BUILD_ARTIFACTS = (".o", ".bc", ".out", ".in", ".ll", ".txt", ".pkl", ".ckpt")
 
 
 def parse_args_and_run():
@@ -70,6 +83,35 @@ def parse_args_and_run():
         default=15,
         help="Number of warumup runs to discard before benchmarking.",
     )
+    parser.add_argument(
+        "--adaptive-warmup",
+        default=False,
+        action="store_true",
+        help="Stop warming up once the runtimes are stable, with --warmup_runs as the maximum. Stable samples count as measurements.",
+    )
+    parser.add_argument(
+        "--direct-build",
+        default=False,
+        action="store_true",
+        help="Resolve the llc, link and run commands from the Makefile once and call them directly instead of make.",
+    )
+    parser.add_argument(
+        "--samples-per-run",
+        type=int,
+        default=1,
+        help="Runtime samples measured per launch of the benchmark. Values above 1 repeat the profiled region in forked copies of the process, whose samples are not comparable to single ones, so a checkpoint can only be resumed with the same value.",
+    )
+    parser.add_argument(
+        "--paired",
+        action="store_true",
+        help="Alternate baseline and candidate runs on the same cores and score candidates by the median of the paired runtime ratios, so that frequency or thermal drift during the search cancels out.",
+    )
+    parser.add_argument(
+        "--score-channel",
+        choices=utils.SCORE_CHANNELS,
+        default="time",
+        help="Measurement to score candidates by. The hardware counters are read with perf_event_open in the profiled region, falling back to time if they are unavailable.",
+    )
     parser.add_argument(
         "-i",
         "--initial-samples",
@@ -102,6 +144,104 @@ def parse_args_and_run():
         type=str,
         help="Model to use to guide the unroll advisor",
     )
+    parser.add_argument(
+        "--widening-exponent",
+        type=float,
+        default=0.5,
+        help="A loop unroll node with n visits may have ceil(n^exponent) children. Large values expand all unroll factors before using UCT.",
+    )
+    parser.add_argument(
+        "--racing",
+        default=False,
+        action="store_true",
+        help="Stop benchmarking a candidate once it is clearly slower than the best one so far.",
+    )
+    parser.add_argument(
+        "--top-k",
+        type=int,
+        default=10,
+        help="Number of best configurations to keep track of and report.",
+    )
+    parser.add_argument(
+        "--path-refinements",
+        type=int,
+        default=0,
+        help="Number of times a repeated decision path is measured again before its score is reused.",
+    )
+    parser.add_argument(
+        "--refine-samples",
+        type=int,
+        default=5,
+        help="Number of runtime samples taken when refining the score of a repeated path.",
+    )
+    parser.add_argument(
+        "--score-cache",
+        type=str,
+        help="File to persist benchmarking results of optimized modules in, which enables the score cache. Cached runtimes are divided by the baseline of the current run, so only share the file between runs on the same machine, cores and benchmark settings.",
+    )
+    parser.add_argument(
+        "--score-cache-size",
+        type=int,
+        default=10000,
+        help="Maximum number of modules kept in the score cache, 0 disables it.",
+    )
+    parser.add_argument(
+        "--object-cache",
+        type=str,
+        help="Directory of compiled module objects, which enables the object cache. It can be shared between runs on this machine, e.g. ~/.cache/monte_carlo_advisor/objects.",
+    )
+    parser.add_argument(
+        "--object-cache-size",
+        type=int,
+        default=4096,
+        help="Maximum size of the object cache in MiB, 0 disables the cache.",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        help="File to periodically save the search state to. Defaults to <plot-directory>/<input>/<input>.ckpt.",
+    )
+    parser.add_argument(
+        "--checkpoint-interval",
+        type=int,
+        default=10,
+        help="Number of iterations between checkpoints.",
+    )
+    parser.add_argument(
+        "--resume",
+        default=False,
+        action="store_true",
+        help="Continue from the last checkpoint instead of starting a new search.",
+    )
+    parser.add_argument(
+        "--root-parallel",
+        default=False,
+        action="store_true",
+        help="Run an independent search on every core given with --core and merge their results.",
+    )
+    parser.add_argument(
+        "--tree-parallel",
+        default=False,
+        action="store_true",
+        help="Search a single tree with one compile and benchmark pipeline per core given with --core.",
+    )
+    parser.add_argument(
+        "--pipeline-depth",
+        type=int,
+        default=1,
+        help="Number of candidates in flight per benchmark core. With more than one, the next candidate is selected and compiled while the current one is benchmarked.",
+    )
+    parser.add_argument(
+        "--sync-period",
+        type=float,
+        default=300,
+        help="Seconds between merges of the root parallel searches.",
+    )
+    parser.add_argument(
+        "--work-directory",
+        type=str,
+        help="Directory for the inputs of parallel workers and pipelines. Defaults to <input dir>/mc-workers.",
+    )
     parser.add_argument(
         "--plot-directory",
         type=str,
@@ -114,10 +254,10 @@ def parse_args_and_run():
 
 
 def main(args):
-    if args.debug:
-        logging.basicConfig(level=logging.DEBUG, format=fmt, datefmt=datefmt)
-    else:
-        logging.basicConfig(level=logging.INFO, format=fmt, datefmt=datefmt)
+    configure_logging(args.debug)
+    if args.score_channel != "time":
+        # inherited by every benchmark run, see runtime_generator
+        os.environ["MC_PROFILING_COUNTERS"] = args.score_channel
 
     MANAGER_PHYSICAL_CORES = 8
     physical_to_logical, _ = utils.get_core_maps()
@@ -139,77 +279,404 @@ def main(args):
     # except:
     #     raise RuntimeError(f"Core {args.core} is out of range")
 
-    benchmark_cores = sum([physical_to_logical[i] for i in args.core], [])
+    if args.root_parallel and len(args.core) > 1:
+        run_root_parallel(args)
+        return
+
+    pipeline_cores = []
+    if args.tree_parallel and len(args.core) > 1:
+        benchmark_cores = physical_to_logical[args.core[0]]
+        pipeline_cores = [physical_to_logical[i] for i in args.core[1:]]
+    else:
+        benchmark_cores = sum([physical_to_logical[i] for i in args.core], [])
 
     logger.info(f"Benchmark core is {benchmark_cores}")
     logger.info(f"Script started with arguments: {args}")
-    input_file = args.input_file
-    input_dir = os.path.dirname(input_file)
-    input_name = os.path.basename(input_file)
-    os.environ["INPUT"] = input_file
+    input_name = os.path.basename(args.input_file)
+    run_search(
+        args,
+        args.input_file,
+        input_name,
+        benchmark_cores,
+        args.checkpoint or default_checkpoint_path(args, input_name),
+        pipeline_cores=pipeline_cores,
+    )
+    logger.info("Succesfully completed Monte Carlo Advising")
+
+
+def configure_logging(debug: bool):
+    if debug:
+        logging.basicConfig(level=logging.DEBUG, format=fmt, datefmt=datefmt)
+    else:
+        logging.basicConfig(level=logging.INFO, format=fmt, datefmt=datefmt)
+
+
+def default_checkpoint_path(args, input_name: str) -> str:
+    return f"{args.plot_directory}/{input_name}/{input_name}.ckpt"
 
+
+def make_advisor(args, channel_name: str) -> MonteCarloAdvisor:
+    """Create the advisor selected on the command line."""
     match (args.inline_advisor, args.loop_unroll_advisor):
         case (True, True):
             advisor = MergedMonteCarloAdvisor(
-                input_name,
+                channel_name,
                 unroll_model_path=args.loop_unroll_advisor_model,
             )
         case (True, False):
-            advisor = inline_mc_advisor.InlineMonteCarloAdvisor(input_name)
+            advisor = inline_mc_advisor.InlineMonteCarloAdvisor(channel_name)
         case (False, True):
             advisor = loop_unroll_mc_advisor.LoopUnrollMonteCarloAdvisor(
-                input_name, model_path=args.loop_unroll_advisor_model
+                channel_name, model_path=args.loop_unroll_advisor_model
             )
         case _:
             raise Exception(
                 "You need to specify at least one advisor. See '--help' for more information."
             )
 
+    advisor.top_k = args.top_k
+    advisor.max_refinements = args.path_refinements
+    unroll_advisor = getattr(advisor, "loop_unroll_advisor", advisor)
+    if isinstance(unroll_advisor, loop_unroll_mc_advisor.LoopUnrollMonteCarloAdvisor):
+        unroll_advisor.widening_exponent = args.widening_exponent
+    return advisor
+
+
+def run_search(
+    args,
+    input_file: str,
+    plot_name: str,
+    benchmark_cores: list[int],
+    checkpoint_path: str,
+    channel_name: Optional[str] = None,
+    pipeline_cores: list[list[int]] = [],
+) -> MonteCarloAdvisor:
+    """
+    Run a complete Monte Carlo search on `input_file`. Every entry of
+    `pipeline_cores` adds a pipeline that searches the same tree in parallel.
+    """
+    input_dir = os.path.dirname(input_file)
+    input_name = os.path.basename(input_file)
+    os.environ["INPUT"] = input_file
+
+    advisor = make_advisor(args, channel_name or input_name)
+
     start = datetime.now().strftime("%Y%m%d_%H%M%S")
-    plotter = plot_main.Plotter(input_name, args, advisor, start)
-    make_clean()
-    get_input_module()
+    plotter = plot_main.Plotter(plot_name, args, advisor, start)
 
-    logger.info("Starting baseline benchmarking")
-    baseline = get_baseline_runtime(
-        args.warmup_runs,
-        args.initial_samples,
-        args.max_samples,
-        set(benchmark_cores),
-        args.min_run,
-        plotter,
-    )
-    logger.info("Completed baseline benchmarking")
+    resumed = args.resume and os.path.exists(checkpoint_path)
+    if resumed:
+        baseline = checkpoint.load_checkpoint(
+            checkpoint_path, advisor, args.samples_per_run
+        )
+    else:
+        if args.resume:
+            logger.warning(f"No checkpoint at {checkpoint_path}, starting from scratch")
+        make_clean()
+    get_input_module()
+    toolchain = Toolchain.from_makefile() if args.direct_build else None
 
-    logger.info("Starting Monte Carlo Tree runs")
-    if args.min_run:
-        assert baseline is list[float]
-        scoring_function = lambda: get_min_score(
-            baseline,
+    if not resumed:
+        logger.info("Starting baseline benchmarking")
+        baseline = get_baseline_runtime(
             args.warmup_runs,
             args.initial_samples,
-            args.timeout,
+            args.max_samples,
             set(benchmark_cores),
+            args.min_run,
             plotter,
+            args.adaptive_warmup,
+            args.samples_per_run,
+            toolchain,
         )
-    else:
-        assert baseline is AdaptiveBenchmarkingResult
-        scoring_function = lambda: get_median_score(
-            baseline,
+        logger.info("Completed baseline benchmarking")
+
+    scoring_baseline = baseline
+    if args.paired and not args.min_run:
+        logger.info("Measuring the spread of paired baseline runs")
+        scoring_baseline = get_relative_baseline(
             args.warmup_runs,
             args.initial_samples,
             args.max_samples,
-            args.timeout,
             set(benchmark_cores),
+            args.samples_per_run,
+            toolchain,
+        )
+
+    score_cache = None
+    if args.score_cache and args.score_cache_size > 0:
+        score_cache = ScoreCache(args.score_cache, args.score_cache_size)
+
+    object_cache = None
+    if args.object_cache and args.object_cache_size > 0:
+        llc_flags = resolve_make_variables(("LLC_FLAGS",))["LLC_FLAGS"].split()
+        object_cache = ObjectCache(
+            args.object_cache, args.object_cache_size * 2**20, flags=llc_flags
+        )
+
+    best_speedup = None
+    if args.racing:
+        best_speedup = lambda: advisor.get_max_run()[1]
+    pipelines = []
+    for cores in [benchmark_cores] + pipeline_cores:
+        # a candidate is compiled while the previous one is benchmarked
+        benchmark_lock = threading.Lock() if args.pipeline_depth > 1 else nullcontext()
+        for _ in range(args.pipeline_depth):
+            k = len(pipelines)
+            if k == 0:
+                pipeline_advisor, pipeline_dir, env_vars = advisor, input_dir + "/", None
+                pipeline_toolchain = toolchain
+            else:
+                pipeline_input = prepare_worker_directory(
+                    input_file, os.path.join(work_directory(args), f"pipeline{k}")
+                )
+                env_vars = os.environ | {"INPUT": pipeline_input}
+                get_input_module(env_vars)
+                pipeline_dir = os.path.dirname(pipeline_input) + "/"
+                pipeline_advisor = make_advisor(args, f"{input_name}.pipeline{k}")
+                pipeline_toolchain = (
+                    Toolchain.from_makefile(env_vars) if args.direct_build else None
+                )
+            pipelines.append(
+                (pipeline_advisor, pipeline_dir)
+                + scoring_functions(
+                    args,
+                    scoring_baseline,
+                    cores,
+                    pipeline_dir,
+                    plotter,
+                    score_cache,
+                    object_cache,
+                    env_vars,
+                    benchmark_lock,
+                    best_speedup,
+                    pipeline_toolchain,
+                )
+            )
+    if len(pipelines) > 1:  # built once, so the pipelines do not race on it
+        utils.get_cmd_output(["make", "profiler_obj"])
+
+    logger.info("Starting Monte Carlo Tree runs")
+
+    def checkpoint_function():
+        checkpoint.save_checkpoint(
+            checkpoint_path, advisor, baseline, args.samples_per_run
+        )
+        if score_cache is not None:
+            score_cache.flush()
+
+    try:
+        if len(pipelines) > 1:
+            advisor.run_tree_parallel(
+                pipelines,
+                args.number_of_runs,
+                args.timeout,
+                checkpoint_function=checkpoint_function,
+                checkpoint_interval=args.checkpoint_interval,
+            )
+        else:
+            advisor.run_monte_carlo(
+                args.number_of_runs,
+                input_dir + "/",
+                args.timeout,
+                pipelines[0][2],
+                pipelines[0][3],
+                checkpoint_function=checkpoint_function,
+                checkpoint_interval=args.checkpoint_interval,
+            )
+    finally:
+        if score_cache is not None:
+            score_cache.flush()
+    if score_cache:
+        logger.info(
+            f"Score cache: {score_cache.hits} hits, {score_cache.misses} misses"
+        )
+    if object_cache:
+        logger.info(
+            f"Object cache: {object_cache.hits} hits, {object_cache.misses} misses"
+        )
+    plotter.log_results()
+    plotter.plot_speedup()
+    del os.environ["INPUT"]  # NOTE: makes no difference apparently?
+    return advisor
+
+
+def scoring_functions(
+    args,
+    baseline: AdaptiveBenchmarkingResult | list[int],
+    cores: list[int],
+    path: str,
+    plotter: plot_main.Plotter,
+    score_cache: Optional[ScoreCache],
+    object_cache: Optional[ObjectCache],
+    env_vars: Optional[dict[str, str]] = None,
+    benchmark_lock: AbstractContextManager = nullcontext(),
+    best_speedup: Optional[Callable[[], float]] = None,
+    toolchain: Optional[Toolchain] = None,
+) -> tuple[Callable[[], float], Optional[Callable[[], float]]]:
+    """The scoring and refine functions for modules built in `path`."""
+    if args.min_run:
+        assert isinstance(baseline, list)
+        scoring_function = lambda: get_min_score(
+            baseline,
+            args.warmup_runs,
+            args.initial_samples,
+            args.timeout,
+            set(cores),
             plotter,
+            path,
+            object_cache,
+            env_vars,
+            benchmark_lock,
+            args.samples_per_run,
+            toolchain,
         )
+        return scoring_function, None
 
-    advisor.run_monte_carlo(
-        args.number_of_runs, input_dir + "/", args.timeout, scoring_function
+    assert isinstance(baseline, AdaptiveBenchmarkingResult)
+    scoring_function = lambda: get_median_score(
+        baseline,
+        args.warmup_runs,
+        args.initial_samples,
+        args.max_samples,
+        args.timeout,
+        set(cores),
+        plotter,
+        path,
+        score_cache,
+        object_cache,
+        env_vars,
+        benchmark_lock,
+        best_speedup,
+        args.adaptive_warmup,
+        args.samples_per_run,
+        toolchain,
+        args.paired,
     )
+    refine_function = lambda: get_refined_score(
+        baseline,
+        args.refine_samples,
+        args.timeout,
+        set(cores),
+        path,
+        object_cache,
+        env_vars,
+        benchmark_lock,
+        args.samples_per_run,
+        toolchain,
+        args.paired,
+    )
+    return scoring_function, refine_function
+
+
+def work_directory(args) -> str:
+    return args.work_directory or os.path.join(
+        os.path.dirname(args.input_file), "mc-workers"
+    )
+
+
+def prepare_worker_directory(input_file: str, worker_dir: str) -> str:
+    """
+    Copy the sources next to `input_file` into `worker_dir`, so that every
+    worker builds into its own directory. Returns the input path of the worker.
+    """
+    os.makedirs(worker_dir, exist_ok=True)
+    for entry in os.scandir(os.path.dirname(input_file) or "."):
+        if entry.is_file() and not entry.name.endswith(BUILD_ARTIFACTS):
+            shutil.copy2(entry.path, worker_dir)
+    return os.path.join(worker_dir, os.path.basename(input_file))
+
+
+def search_worker(args, worker_id: int, physical_core: int, input_file: str):
+    """Entry point of a root parallel worker process."""
+    configure_logging(args.debug)
+    physical_to_logical, _ = utils.get_core_maps()
+    input_name = os.path.basename(args.input_file)
+    run_search(
+        args,
+        input_file,
+        f"{input_name}_worker{worker_id}",
+        physical_to_logical[physical_core],
+        input_file + ".ckpt",
+        channel_name=f"{input_name}.worker{worker_id}",
+    )
+
+
+def merge_worker_checkpoints(
+    args, checkpoint_paths: list[str], merged_path: str
+) -> Optional[MonteCarloAdvisor]:
+    """Merge the latest checkpoints of all workers into a single checkpoint."""
+    input_name = os.path.basename(args.input_file)
+    workers = []
+    baseline = None
+    for path in checkpoint_paths:
+        if not os.path.exists(path):
+            continue
+        worker = make_advisor(args, input_name)
+        worker_baseline = checkpoint.load_checkpoint(path, worker, args.samples_per_run)
+        baseline = baseline or worker_baseline
+        workers.append(worker)
+    if not workers:
+        return None
+
+    advisor = make_advisor(args, input_name)
+    advisor.merge(workers)
+    checkpoint.save_checkpoint(merged_path, advisor, baseline, args.samples_per_run)
+    logger.info(
+        f"Merged {len(workers)} workers, best run so far: {advisor.get_max_run()}"
+    )
+    return advisor
+
+
+def run_root_parallel(args):
+    """
+    Run one independent search per physical core in `args.core` and
+    periodically merge their trees and run histories.
+    """
+    input_name = os.path.basename(args.input_file)
+    logger.info(f"Script started with arguments: {args}")
+
+    # built once up front, so the workers do not race on the shared object
+    os.environ["INPUT"] = args.input_file
+    utils.get_cmd_output(["make", "profiler_obj"])
+
+    context = multiprocessing.get_context("spawn")
+    workers = []
+    checkpoint_paths = []
+    for worker_id, core in enumerate(args.core):
+        worker_input = prepare_worker_directory(
+            args.input_file, os.path.join(work_directory(args), f"worker{worker_id}")
+        )
+        checkpoint_paths.append(worker_input + ".ckpt")
+        worker = context.Process(
+            target=search_worker,
+            args=(args, worker_id, core, worker_input),
+            name=f"worker{worker_id}",
+        )
+        worker.start()
+        workers.append(worker)
+        logger.info(f"Started worker {worker_id} on physical core {core}")
+
+    start = datetime.now().strftime("%Y%m%d_%H%M%S")
+    merged_path = args.checkpoint or default_checkpoint_path(args, input_name)
+    while any(worker.is_alive() for worker in workers):
+        multiprocessing.connection.wait(
+            [worker.sentinel for worker in workers if worker.is_alive()],
+            timeout=args.sync_period,
+        )
+        merge_worker_checkpoints(args, checkpoint_paths, merged_path)
+
+    for worker in workers:
+        worker.join()
+        if worker.exitcode != 0:
+            logger.error(f"{worker.name} exited with code {worker.exitcode}")
+
+    advisor = merge_worker_checkpoints(args, checkpoint_paths, merged_path)
+    if advisor is None:
+        raise RuntimeError("None of the workers produced a checkpoint")
+    plotter = plot_main.Plotter(input_name, args, advisor, start)
     plotter.log_results()
     plotter.plot_speedup()
-    del os.environ["INPUT"]  # NOTE: makes no difference apparently?
     logger.info("Succesfully completed Monte Carlo Advising")
 
 
@@ -218,18 +685,74 @@ def make_clean():
     utils.get_cmd_output(cmd)
 
 
-def get_input_module():
+def get_input_module(env_vars: Optional[dict[str, str]] = None):
     cmd = ["make", "mod-pre-mc.bc"]
-    utils.get_cmd_output(cmd)
+    utils.get_cmd_output(cmd, env_vars=env_vars)
+
 
+def score_channel(env_vars: Optional[dict[str, str]] = None) -> str:
+    """The channel requested for benchmark runs with `env_vars`, see main."""
+    return (env_vars or os.environ).get("MC_PROFILING_COUNTERS", "time")
 
-def runtime_generator(cmd: list[str], cores: set[int]):
+
+def runtime_generator(
+    cmd: list[str],
+    cores: set[int],
+    env_vars: Optional[dict[str, str]] = None,
+    samples_per_run: int = 1,
+):
+    """
+    Yield runtime samples of `cmd`. With `samples_per_run` > 1, every run
+    measures that many samples in one process (see profiler/mc_profiler.c).
+    If MC_PROFILING_COUNTERS names a hardware counter, its counts are yielded
+    instead of the durations.
+
+    The profiler writes its measurements to a memfd passed as MC_PROFILING_FD,
+    so the output of the benchmark is discarded instead of piped and parsed.
+    """
     logger.debug(cmd)
-    while True:
-        outs = utils.get_cmd_output(
-            cmd, pre_exec_function=lambda: os.sched_setaffinity(0, cores)
-        )
-        yield utils.readout_mc_inline_timer(outs.decode())
+    channel = score_channel(env_vars)
+    result_fd = os.memfd_create("mc_profiling")
+    env_vars = (env_vars or dict(os.environ)) | {"MC_PROFILING_FD": str(result_fd)}
+    if samples_per_run > 1:
+        env_vars["MC_PROFILING_SAMPLES"] = str(samples_per_run)
+    try:
+        while True:
+            os.ftruncate(result_fd, 0)
+            utils.get_cmd_output(
+                cmd,
+                pre_exec_function=lambda: os.sched_setaffinity(0, cores),
+                env_vars=env_vars,
+                stdout=subprocess.DEVNULL,
+                pass_fds=(result_fd,),
+            )
+            yield from utils.readout_mc_samples(
+                utils.readout_mc_result(result_fd), channel
+            )
+    finally:
+        os.close(result_fd)
+
+
+def paired_runtime_generator(
+    cmd: list[str],
+    baseline_cmd: list[str],
+    cores: set[int],
+    env_vars: Optional[dict[str, str]] = None,
+    samples_per_run: int = 1,
+):
+    """
+    Yield runtimes of `cmd` relative to `baseline_cmd`, each measured right
+    after a baseline sample on the same cores.
+    """
+    baseline = runtime_generator(baseline_cmd, cores, env_vars, samples_per_run)
+    candidate = runtime_generator(cmd, cores, env_vars, samples_per_run)
+    try:
+        while True:
+            baseline_runtime = next(baseline)
+            yield next(candidate) / baseline_runtime
+    finally:
+        baseline.close()
+        candidate.close()
 
 
 def get_baseline_runtime(
@@ -239,25 +762,115 @@ def get_baseline_runtime(
     cores: set[int],
     use_min_run: bool,
     plotter: plot_main.Plotter,
+    adaptive_warmup: bool = False,
+    samples_per_run: int = 1,
+    toolchain: Optional[Toolchain] = None,
 ) -> AdaptiveBenchmarkingResult | list[int]:
 
-    cmd = ["make", "run_baseline"]
+    cmd = baseline_command(toolchain)
     if use_min_run:
         baseline_runtimes = utils.get_fixed_run_benchmark(
-            runtime_generator(cmd, cores), warmup_runs, initial_samples
+            runtime_generator(cmd, cores, samples_per_run=samples_per_run),
+            warmup_runs,
+            initial_samples,
         )
         plotter.runtime_histogram(baseline_runtimes)
     else:
         baseline_runtimes = utils.adaptive_benchmark(
-            runtime_generator(cmd, cores),
+            runtime_generator(cmd, cores, samples_per_run=samples_per_run),
             warmup_runs=warmup_runs,
             initial_samples=initial_samples,
             max_samples=max_samples,
+            adaptive_warmup=adaptive_warmup,
         )
         plotter.runtime_histogram(list(baseline_runtimes.runtimes))
     return baseline_runtimes
 
 
+def get_relative_baseline(
+    warmup_runs: int,
+    initial_samples: int,
+    max_samples: int,
+    cores: set[int],
+    samples_per_run: int = 1,
+    toolchain: Optional[Toolchain] = None,
+) -> AdaptiveBenchmarkingResult:
+    """
+    The baseline of paired runtime ratios. Its median is 1 by definition, its
+    ci is that of the ratios of the baseline paired with itself, so racing keeps
+    the tolerance for the noise of paired measurements.
+    """
+    cmd = baseline_command(toolchain)
+    ratios = utils.adaptive_benchmark(
+        paired_runtime_generator(cmd, cmd, cores, samples_per_run=samples_per_run),
+        warmup_runs=warmup_runs,
+        initial_samples=initial_samples,
+        max_samples=max_samples,
+    )
+    logger.info(f"Paired baseline ratios: median {ratios.median}, ci {ratios.ci}")
+    return AdaptiveBenchmarkingResult(ratios.runtimes, 1.0, ratios.ci, ratios.converged)
+
+
+def build_module_obj(
+    path: str,
+    timeout: float,
+    object_cache: Optional[ObjectCache],
+    module_hash: Optional[str],
+    env_vars: Optional[dict[str, str]] = None,
+    toolchain: Optional[Toolchain] = None,
+):
+    """Compile the optimized module, reusing a cached object if there is one."""
+    module_obj = toolchain.module_obj if toolchain else path + "mod-post-mc.o"
+    if object_cache is not None and module_hash:
+        # the copy is newer than the bitcode, so make considers it up to date
+        if object_cache.fetch(module_hash, module_obj):
+            logger.debug(f"Reusing cached object for module {module_hash[:12]}")
+            return
+    if toolchain:
+        toolchain.build_module_obj(timeout)
+    else:
+        cmd = ["make", "module_obj"]
+        utils.get_cmd_output(cmd, timeout=timeout, env_vars=env_vars)
+    if object_cache is not None and module_hash:
+        object_cache.store(module_hash, module_obj)
+
+
+def link_module(
+    timeout: float,
+    env_vars: Optional[dict[str, str]] = None,
+    toolchain: Optional[Toolchain] = None,
+):
+    """Link the benchmark binary, so that `make run` only needs to run it."""
+    if toolchain:
+        toolchain.link(timeout)
+    else:
+        utils.get_cmd_output(["make", "all"], timeout=timeout, env_vars=env_vars)
+
+
+def run_command(toolchain: Optional[Toolchain]) -> list[str]:
+    return toolchain.run_command() if toolchain else ["make", "run"]
+
+
+def baseline_command(toolchain: Optional[Toolchain]) -> list[str]:
+    return toolchain.baseline_command() if toolchain else ["make", "run_baseline"]
+
+
+def candidate_runtimes(
+    cores: set[int],
+    env_vars: Optional[dict[str, str]],
+    samples_per_run: int,
+    toolchain: Optional[Toolchain],
+    paired: bool,
+):
+    """The runtime samples of the linked candidate, see runtime_generator."""
+    cmd = run_command(toolchain)
+    if paired:
+        return paired_runtime_generator(
+            cmd, baseline_command(toolchain), cores, env_vars, samples_per_run
+        )
+    return runtime_generator(cmd, cores, env_vars, samples_per_run)
+
+
 def get_median_score(
     baseline: utils.AdaptiveBenchmarkingResult,
     warmup_runs: int,
@@ -266,21 +879,97 @@ def get_median_score(
     timeout: float,
     cores: set[int],
     plotter: plot_main.Plotter,
+    path: str = "",
+    score_cache: Optional[ScoreCache] = None,
+    object_cache: Optional[ObjectCache] = None,
+    env_vars: Optional[dict[str, str]] = None,
+    benchmark_lock: AbstractContextManager = nullcontext(),
+    best_speedup: Optional[Callable[[], float]] = None,
+    adaptive_warmup: bool = False,
+    samples_per_run: int = 1,
+    toolchain: Optional[Toolchain] = None,
+    paired: bool = False,
 ):
-    cmd = ["make", "module_obj"]
-    utils.get_cmd_output(cmd, timeout=timeout)
-    cmd = ["make", "run"]
-    runtimes = utils.adaptive_benchmark(
-        runtime_generator(cmd, cores),
-        warmup_runs=warmup_runs,
-        initial_samples=initial_samples,
-        max_samples=max_samples,
-    )
+    """
+    Speedup of the optimized module over the baseline. With `best_speedup`,
+    candidates that are clearly slower than the current best are rejected early.
+    With `paired`, the runtimes are measured relative to interleaved baseline runs
+    and `baseline` is the relative baseline, see get_relative_baseline.
+    """
+    module_hash = None
+    if score_cache is not None or object_cache is not None:
+        module_hash = hash_module(path + "mod-post-mc.bc")
+    channel = score_channel(env_vars)
+
+    def cache_key() -> str:
+        # the channel can fall back to time once the first run was measured, and
+        # batched samples are not comparable to single ones
+        key = f"{utils.measured_channel(channel)}-{samples_per_run}-{module_hash}"
+        return f"paired-{key}" if paired else key
+
+    if score_cache is not None and module_hash:
+        runtimes = score_cache.get(cache_key())
+        if runtimes is not None:
+            logger.info(f"Module {module_hash[:12]} already benchmarked, reusing result")
+            return baseline.median / runtimes.median
+
+    build_module_obj(path, timeout, object_cache, module_hash, env_vars, toolchain)
+    link_module(timeout, env_vars, toolchain)
+    with benchmark_lock:
+        runtimes = utils.adaptive_benchmark(
+            candidate_runtimes(cores, env_vars, samples_per_run, toolchain, paired),
+            warmup_runs=warmup_runs,
+            initial_samples=initial_samples,
+            max_samples=max_samples,
+            race_baseline=baseline if best_speedup else None,
+            race_best_speedup=best_speedup() if best_speedup else 1.0,
+            adaptive_warmup=adaptive_warmup,
+        )
     plotter.runtime_histogram(list(runtimes.runtimes))
+    if (
+        score_cache is not None
+        and module_hash
+        and not runtimes.is_invalid()
+        and not runtimes.partial
+    ):
+        score_cache.put(cache_key(), runtimes)
+    if runtimes.partial:
+        # not exact, so penalized with the slow end of its interval
+        return utils.PartialScore(
+            baseline.median / (runtimes.median * (1 + runtimes.ci / 2))
+        )
     return baseline.median / runtimes.median
     # return utils.get_speedup_factor(baseline, runtimes)
 
 
+def get_refined_score(
+    baseline: utils.AdaptiveBenchmarkingResult,
+    samples: int,
+    timeout: float,
+    cores: set[int],
+    path: str = "",
+    object_cache: Optional[ObjectCache] = None,
+    env_vars: Optional[dict[str, str]] = None,
+    benchmark_lock: AbstractContextManager = nullcontext(),
+    samples_per_run: int = 1,
+    toolchain: Optional[Toolchain] = None,
+    paired: bool = False,
+) -> float:
+    """A quick score estimate from a few extra samples of an already measured module."""
+    module_hash = None
+    if object_cache is not None:
+        module_hash = hash_module(path + "mod-post-mc.bc")
+    build_module_obj(path, timeout, object_cache, module_hash, env_vars, toolchain)
+    link_module(timeout, env_vars, toolchain)
+    with benchmark_lock:
+        runtimes = utils.get_fixed_run_benchmark(
+            candidate_runtimes(cores, env_vars, samples_per_run, toolchain, paired),
+            warmup_runs=1,
+            initial_samples=samples,
+        )
+    return baseline.median / float(np.median(runtimes))
+
+
 def get_min_score(
     baseline: list[int],
     warmup_runs: int,
@@ -288,16 +977,26 @@ def get_min_score(
     timeout: float,
     cores: set[int],
     plotter: plot_main.Plotter,
+    path: str = "",
+    object_cache: Optional[ObjectCache] = None,
+    env_vars: Optional[dict[str, str]] = None,
+    benchmark_lock: AbstractContextManager = nullcontext(),
+    samples_per_run: int = 1,
+    toolchain: Optional[Toolchain] = None,
 ) -> float:
-    cmd = ["make", "module_obj"]
-    utils.get_cmd_output(cmd, timeout=timeout)
-    cmd = ["make", "run"]
-
-    runtimes = utils.get_fixed_run_benchmark(
-        runtime_generator(cmd, cores),
-        warmup_runs=warmup_runs,
-        initial_samples=initial_samples,
-    )
+    module_hash = None
+    if object_cache is not None:
+        module_hash = hash_module(path + "mod-post-mc.bc")
+    build_module_obj(path, timeout, object_cache, module_hash, env_vars, toolchain)
+    link_module(timeout, env_vars, toolchain)
+    cmd = run_command(toolchain)
+
+    with benchmark_lock:
+        runtimes = utils.get_fixed_run_benchmark(
+            runtime_generator(cmd, cores, env_vars, samples_per_run),
+            warmup_runs=warmup_runs,
+            initial_samples=initial_samples,
+        )
     assert len(baseline) == len(runtimes)
     plotter.runtime_histogram(runtimes)
     return min(baseline) / min(runtimes)
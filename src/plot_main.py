@@ -1,5 +1,6 @@
 import logging
 import os
+import threading
 from datetime import datetime
 
 import matplotlib.pyplot as plt
@@ -24,6 +25,7 @@ class Plotter:
             f"{self.path_dir}/benchmark_histograms/{self.name}_{self.start_time}.pdf"
         )
         self.all_runtimes = []
+        self.lock = threading.Lock()  # pipelines of a tree parallel search share a plotter
 
     def plot_speedup(self):
         speedup = self.advisor.max_speedup_after_n_iterations
@@ -61,15 +63,23 @@ class Plotter:
                 )
             f.write(str(self.advisor) + "\n")
             f.write(f"Best run: {self.advisor.get_max_run()}\n")
+            for rank, run in enumerate(self.advisor.get_top_runs(), start=1):
+                f.write(f"Top {rank}: {run}\n")
             self.plot_all_runtimes()
             self.pdf.close()
             # f.write(f"Best state: {self.advisor.get_max_state()}\n")
 
     def runtime_histogram(self, runtimes: list[int] | None = None):
+        with self.lock:
+            self._runtime_histogram(runtimes)
+
+    def _runtime_histogram(self, runtimes: list[int] | None = None):
         if runtimes:
             self.all_runtimes += runtimes
         else:
             runtimes = self.all_runtimes
+        if not runtimes:  # e.g. the merged results of a root parallel search
+            return
         fig, ax = plt.subplots()
 
         # 1) draw the histogram and grab counts/bins
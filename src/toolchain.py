@@ -0,0 +1,85 @@
+"""
+Direct build and run commands for the measurement loop, resolved once from the
+Makefile so that compiling and running a candidate does not go through make.
+"""
+
+import logging
+import os
+from typing import Optional
+
+import utils
+
+logger = logging.getLogger(__name__)
+
+# Makefile variables the commands are built from
+MAKE_VARIABLES = (
+    "CC",
+    "EXTRA_FLAGS",
+    "EXTRA_OBJS",
+    "LLC_FLAGS",
+    "MAIN_OBJ",
+    "PROF_OBJ",
+    "MODULE_POST_BC",
+    "MODULE_OBJ",
+    "OUT",
+    "BASELINE_OUT",
+)
+
+
+def resolve_make_variables(
+    names=MAKE_VARIABLES, env_vars: Optional[dict[str, str]] = None
+) -> dict[str, str]:
+    """Evaluate Makefile variables for the input in `env_vars` (or $INPUT)."""
+    cmd = ["make", "--no-print-directory", "-s"] + [f"print-{name}" for name in names]
+    values = utils.get_cmd_output(cmd, env_vars=env_vars).decode().split("\n")
+    return dict(zip(names, values))
+
+
+class Toolchain:
+    """
+    The llc, link and run commands of the Makefile for one input. The main and
+    profiler objects and the baseline are built once with make, after that only
+    the optimized module is compiled and linked.
+    """
+
+    def __init__(self, variables: dict[str, str]) -> None:
+        self.cc = variables["CC"]
+        self.extra_flags = variables["EXTRA_FLAGS"].split()
+        self.extra_objs = variables["EXTRA_OBJS"].split()
+        self.llc_flags = variables["LLC_FLAGS"].split()
+        self.main_obj = variables["MAIN_OBJ"]
+        self.prof_obj = variables["PROF_OBJ"]
+        self.module_post_bc = variables["MODULE_POST_BC"]
+        self.module_obj = variables["MODULE_OBJ"]
+        self.out = os.path.abspath(variables["OUT"])
+        self.baseline_target = variables["BASELINE_OUT"]
+        self.baseline_out = os.path.abspath(self.baseline_target)
+
+    @staticmethod
+    def from_makefile(env_vars: Optional[dict[str, str]] = None) -> "Toolchain":
+        toolchain = Toolchain(resolve_make_variables(env_vars=env_vars))
+        utils.get_cmd_output(
+            ["make", toolchain.main_obj, toolchain.prof_obj, toolchain.baseline_target],
+            env_vars=env_vars,
+        )
+        logger.info(f"Building {toolchain.out} without make")
+        return toolchain
+
+    def llc_command(self) -> list[str]:
+        return ["llc"] + self.llc_flags + [self.module_post_bc, "-o", self.module_obj]
+
+    def link_command(self) -> list[str]:
+        objects = [self.main_obj, self.prof_obj, self.module_obj] + self.extra_objs
+        return [self.cc] + self.extra_flags + objects + ["-o", self.out]
+
+    def run_command(self) -> list[str]:
+        return [self.out]
+
+    def baseline_command(self) -> list[str]:
+        return [self.baseline_out]
+
+    def build_module_obj(self, timeout: Optional[float] = None):
+        utils.get_cmd_output(self.llc_command(), timeout=timeout)
+
+    def link(self, timeout: Optional[float] = None):
+        utils.get_cmd_output(self.link_command(), timeout=timeout)
@@ -0,0 +1,72 @@
+"""Micro-benchmark for UCT child selection on a fully expanded loop unroll node."""
+
+import argparse
+import random
+import timeit
+
+from advisors.mc_advisor import MonteCarloAdvisor, State
+
+
+class BenchmarkAdvisor(MonteCarloAdvisor[int]):
+    def opt_args(self) -> list[str]:
+        return []
+
+    def get_rollout_decision(self, tv, heuristic) -> int:
+        return 1
+
+    def get_next_state(self, state: State[int], tv, heuristic) -> State[int]:
+        return self.select_uct_child(state)
+
+    def get_default_decision(self, advisor_type: str, tv, heuristic) -> int:
+        return 1
+
+    def set_state_as_fully_explored(self, state: State[int]):
+        state.subtree_is_fully_explored = True
+
+
+def build_node(advisor: MonteCarloAdvisor, branching_factor: int) -> State[int]:
+    node = advisor.root
+    node.visits = 0
+    for factor in range(1, branching_factor + 1):
+        visits = random.randint(1, 50)
+        speedup_sum = sum(random.uniform(0.8, 1.2) for _ in range(visits))
+        node.add_child(factor, speedup_sum / visits, speedup_sum, visits)
+        node.visits += visits
+    for child in random.sample(node.children, branching_factor // 8):
+        child.subtree_is_fully_explored = True
+    return node
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--branching-factor", type=int, default=32)
+    parser.add_argument("-n", "--number", type=int, default=10000)
+    args = parser.parse_args()
+
+    random.seed(0)
+    advisor = BenchmarkAdvisor("benchmark")
+    node = build_node(advisor, args.branching_factor)
+
+    def generator_selection():
+        return max(
+            (c for c in node.children if not c.subtree_is_fully_explored),
+            key=advisor.uct,
+        )
+
+    def vectorized_selection():
+        return advisor.select_uct_child(node)
+
+    assert generator_selection() == vectorized_selection()
+    for name, selection in [
+        ("generator", generator_selection),
+        ("vectorized", vectorized_selection),
+    ]:
+        seconds = min(timeit.repeat(selection, number=args.number, repeat=5))
+        print(
+            f"{name:<12} {seconds / args.number * 1e6:8.2f} us per selection "
+            f"({args.branching_factor} children)"
+        )
+
+
+if __name__ == "__main__":
+    main()
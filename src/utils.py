@@ -1,10 +1,16 @@
 import argparse
+import bisect
 import io
 import logging
 import math
+import os
 import re
+import shutil
+import struct
 import subprocess
+import tempfile
 from pathlib import Path
+from typing import Optional
 
 import numpy as np
 import psutil
@@ -14,6 +20,15 @@ from datastructures import *
 
 logger = logging.getLogger(__name__)
 
+# record of all samples of a run with MC_PROFILING_SAMPLES, see profiler/mc_profiler.c
+MC_SAMPLES_MAGIC = b"MC_SAMPLES\0"
+MC_INVALID_SAMPLE = 2**64 - 1
+
+# measurements a run can be scored by, in the channel order of the profiler
+# records. Setting MC_PROFILING_COUNTERS to one of the counters makes the
+# profiler read them with perf_event_open.
+SCORE_CHANNELS = ("time", "cycles", "instructions", "cache-misses")
+
 LOOP_UNROLL_ERROR_CODE = -999
 TIMEOUT_ERROR_CODE = -111
 
@@ -26,6 +41,13 @@ class MonteCarloError(Exception):
     pass
 
 
+class PartialScore(float):
+    """
+    The score of a candidate whose benchmark was stopped early by racing. It is
+    an estimate, not a measurement to reuse for the path.
+    """
+
+
 class UnknownAdvisorError(Exception):
     def __init__(self) -> None:
         super().__init__(
@@ -81,7 +103,13 @@ def get_next_free_physical_core(start=2):
 
 
 def get_cmd_output(
-    cmd, stdin=None, timeout=None, pre_exec_function=None, env_vars=None
+    cmd,
+    stdin=None,
+    timeout=None,
+    pre_exec_function=None,
+    env_vars=None,
+    stdout=subprocess.PIPE,
+    pass_fds=(),
 ):
     logger.debug(f"Running cmd: {' '.join(cmd)}")
 
@@ -90,11 +118,12 @@ def get_cmd_output(
 
     with subprocess.Popen(
         cmd,
-        stdout=subprocess.PIPE,
+        stdout=stdout,
         stderr=subprocess.PIPE,
         stdin=(subprocess.PIPE if stdin is not None else None),
         preexec_fn=pre_exec_function,
         env=env_vars,
+        pass_fds=pass_fds,
     ) as proc:
         try:
             outs, errs = proc.communicate(input=stdin, timeout=timeout)
@@ -146,10 +175,37 @@ def get_cmd_output(
             exit(status)
 
         logger.debug("Finished.")
-        logger.debug(f"Output: {outs.decode()}")
+        if outs is not None:
+            logger.debug(f"Output: {outs.decode(errors='replace')}")
         return outs
 
 
+def atomic_write(path: str, data: bytes):
+    """Write `data` to `path` so that readers never see a partially written file."""
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def atomic_copy(source: str, path: str):
+    """Copy `source` to `path` so that readers never see a partially written file."""
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    os.close(fd)
+    try:
+        shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
 def terminate(process: subprocess.Popen[bytes]):
     process.terminate()
     clean_up_process(process)
@@ -197,10 +253,56 @@ def readout_mc_inline_timer(input: str) -> int:
         return f
 
 
+# channels the profiler could not measure in this process, scored by time instead
+UNAVAILABLE_CHANNELS: set[str] = set()
+
+
+def warn_counters_unavailable(channel: str):
+    if channel not in UNAVAILABLE_CHANNELS:
+        UNAVAILABLE_CHANNELS.add(channel)
+        logger.warning(
+            f"Hardware counters unavailable, scoring by time instead of {channel}"
+        )
+
+
+def measured_channel(channel: str) -> str:
+    """The channel that is actually measured when `channel` is requested."""
+    return "time" if channel in UNAVAILABLE_CHANNELS else channel
+
+
+def readout_mc_result(fd: int) -> bytes:
+    """The record the profiler wrote to the MC_PROFILING_FD file `fd`."""
+    return os.pread(fd, os.fstat(fd).st_size, 0)
+
+
+def readout_mc_samples(output: bytes, channel: str = "time") -> list[int]:
+    """
+    The `channel` values in the MC_SAMPLES record of a run with
+    MC_PROFILING_SAMPLES set. Without counters, the durations are returned.
+    """
+    start = output.rfind(MC_SAMPLES_MAGIC)
+    if start < 0:
+        raise Exception(
+            "No samples found. Is the benchmark linked with the current profiler?"
+        )
+    start += len(MC_SAMPLES_MAGIC)
+    count, channels = struct.unpack_from("=II", output, start)
+    values = np.frombuffer(
+        output, dtype="=u8", count=count * channels, offset=start + 8
+    ).reshape(count, channels)
+    if (values[:, 0] == MC_INVALID_SAMPLE).any():
+        raise Exception("Invalid sample, are the profiling calls balanced?")
+    column = SCORE_CHANNELS.index(channel)
+    if column >= channels:
+        warn_counters_unavailable(channel)
+        column = 0
+    return values[:, column].tolist()
+
+
 def get_benchmarking_median_ci(samples, confidence=0.95) -> tuple[float, float]:
     """
     Compute a nonparametric (distribution-free) confidence interval for the median.
-    Returns a tuple: (median, lower_bound, upper_bound).
+    Returns a tuple: (median, relative width of the interval).
 
     Parameters
     ----------
@@ -209,10 +311,22 @@ def get_benchmarking_median_ci(samples, confidence=0.95) -> tuple[float, float]:
     p : float, optional
         Desired confidence level (default 0.95).
     """
+    median, lower, upper = get_benchmarking_median_bounds(samples, confidence)
+    if len(samples) < 2:
+        return median, np.inf
+    interval = upper - lower
+    relative_ci_width = interval / median
+    return median, relative_ci_width
+
+
+def get_benchmarking_median_bounds(
+    samples, confidence=0.95
+) -> tuple[float, float, float]:
+    """The median of `samples` and the bounds of its confidence interval."""
     if len(samples) == 0:
-        return np.nan, np.inf
+        return np.nan, -np.inf, np.inf
     if len(samples) == 1:
-        return samples[0], np.inf
+        return samples[0], -np.inf, np.inf
 
     samples = np.sort(np.asarray(samples))
     n = samples.size
@@ -230,9 +344,66 @@ def get_benchmarking_median_ci(samples, confidence=0.95) -> tuple[float, float]:
     # convert to zero-based indices
     lower = samples[lower_rank - 1]
     upper = samples[upper_rank - 1]
-    interval = upper - lower
-    relative_ci_width = interval / median
-    return median, relative_ci_width
+    return median, lower, upper
+
+
+class MedianEstimator:
+    """
+    Streaming version of `get_benchmarking_median_bounds` for a growing
+    sample. The samples are kept sorted by bisect insertion, so the median
+    and the rank-based interval are lookups instead of a sort per sample.
+    """
+
+    def __init__(self, confidence=0.95, samples=()) -> None:
+        self.z = stats.norm.ppf((1 + confidence) / 2)
+        self.samples: list[float] = []  # in the order they were taken
+        self.sorted_samples: list[float] = []
+        for sample in samples:
+            self.add(sample)
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def add(self, sample: float):
+        self.samples.append(sample)
+        bisect.insort(self.sorted_samples, sample)
+
+    def median(self) -> float:
+        n = len(self.sorted_samples)
+        if n == 0:
+            return np.nan
+        if n % 2 == 1:
+            return self.sorted_samples[n // 2]
+        return (self.sorted_samples[n // 2 - 1] + self.sorted_samples[n // 2]) / 2
+
+    def bounds(self) -> tuple[float, float, float]:
+        """The median and the bounds of its confidence interval."""
+        n = len(self.sorted_samples)
+        if n < 2:
+            return self.median(), -np.inf, np.inf
+        lower_rank = max(math.floor((n - self.z * math.sqrt(n)) / 2), 1)
+        upper_rank = min(math.ceil(1 + (n + self.z * math.sqrt(n)) / 2), n)
+        lower = self.sorted_samples[lower_rank - 1]
+        upper = self.sorted_samples[upper_rank - 1]
+        return self.median(), lower, upper
+
+    def relative_ci_width(self) -> float:
+        if len(self.samples) < 2:
+            return np.inf
+        median, lower, upper = self.bounds()
+        return (upper - lower) / median
+
+    def result(
+        self, converged: bool, partial: bool = False, warmups: int = 0
+    ) -> AdaptiveBenchmarkingResult:
+        return AdaptiveBenchmarkingResult(
+            np.array(self.samples, dtype=float),
+            self.median(),
+            self.relative_ci_width(),
+            converged,
+            partial,
+            warmups,
+        )
 
 
 def adaptive_benchmark(
@@ -244,6 +415,9 @@ def adaptive_benchmark(
     confidence=0.95,
     relative_ci_threshold=0.05,
     fail_on_non_convergence=False,
+    race_baseline: Optional[AdaptiveBenchmarkingResult] = None,
+    race_best_speedup: float = 1.0,
+    adaptive_warmup: bool = False,
 ) -> AdaptiveBenchmarkingResult:
     """
     Adaptive benchmarking loop to estimate mean runtime with confidence.
@@ -255,6 +429,11 @@ def adaptive_benchmark(
         max_samples: Max number of samples to avoid infinite loop.
         confidence: Desired confidence level (e.g., 0.95 for 95% CI).
         relative_ci_threshold: Target relative CI width (e.g., 0.05 means CI width < 5% of mean).
+        race_baseline: If given, stop as soon as the candidate is clearly slower
+            than the baseline sped up by `race_best_speedup`, i.e. the current
+            best. The result is then flagged as partial.
+        adaptive_warmup: Only discard samples until the runtimes are stable,
+            with `warmup_runs` as the maximum (see `detect_warmup`).
 
     Returns:
         AdaptiveBenchmarkingResult
@@ -263,59 +442,121 @@ def adaptive_benchmark(
 
     logger.info("Starting adaptive benchmarking")
 
-    samples = np.array([], dtype=float)
+    estimator = MedianEstimator(confidence)
     n = 0
-
-    if warmup_runs > 0:
+    warmups = warmup_runs
+
+    if adaptive_warmup:
+        stable, warmups = detect_warmup(iterator, warmup_runs)
+        estimator = MedianEstimator(confidence, stable)
+        n = len(estimator)
+        if n > 0 and estimator.samples[0] == 0:
+            logger.debug("Got zero")
+            return get_zero_rt_abr()
+    elif warmup_runs > 0:
         logger.debug("Starting warmup runs")
         for _ in range(warmup_runs):
             next(iterator)
-    while len(samples) < initial_samples and n < max_initial_samples:
+    while len(estimator) < initial_samples and n < max_initial_samples:
         new_sample = next(iterator)
         if new_sample is not None:
             new_sample = float(new_sample)
-            samples = np.append(samples, new_sample)
+            estimator.add(new_sample)
             if n == 0 and new_sample == 0:
                 logger.debug("Got zero")
                 return get_zero_rt_abr()
             logger.debug(
-                f"Obtained sample {new_sample}, len {len(samples)}, iteration {n}"
+                f"Obtained sample {new_sample}, len {len(estimator)}, iteration {n}"
             )
         n += 1
 
-    if len(samples) < initial_samples:
+    if len(estimator) < initial_samples:
         logger.error("Too many replay failures")
-        median, relative_ci_width = get_benchmarking_median_ci(samples, confidence)
-        return AdaptiveBenchmarkingResult(samples, median, relative_ci_width, False)
+        return estimator.result(False, warmups=warmups)
 
     assert n < max_samples
 
+    race_limit = np.inf
+    if race_baseline is not None:
+        # upper end of the baseline interval, so only clear losers are rejected.
+        # The ci is the relative width of the whole interval.
+        race_limit = (
+            race_baseline.median
+            * (1 + race_baseline.ci / 2)
+            / max(race_best_speedup, 1.0)
+        )
+
     median = 0.0
     relative_ci_width = 0.0
     while n < max_samples:
-        median, relative_ci_width = get_benchmarking_median_ci(samples, confidence)
+        median, lower, upper = estimator.bounds()
+        relative_ci_width = (upper - lower) / median
 
         if relative_ci_width < relative_ci_threshold:
             logger.debug(f"Converged: median {median}, ci {relative_ci_width}")
-            return AdaptiveBenchmarkingResult(samples, median, relative_ci_width, True)
+            return estimator.result(True, warmups=warmups)
+
+        if lower > race_limit:
+            logger.info(
+                f"Rejected after {len(estimator)} samples: median {median}, lower bound {lower} > {race_limit}"
+            )
+            return estimator.result(False, True, warmups)
 
         new_sample = None
         while new_sample is None and n < max_samples:
             new_sample = next(iterator)
             logger.debug(
-                f"Obtained sample {new_sample}, len {len(samples)}, iteration {n}"
+                f"Obtained sample {new_sample}, len {len(estimator)}, iteration {n}"
             )
             n += 1
         if new_sample is not None:
-
-            samples = np.append(samples, float(new_sample))
+            estimator.add(float(new_sample))
 
     logger.error(f"Did not converge: median {median}, ci {relative_ci_width}")
 
     if fail_on_non_convergence:
         return get_invalid_abr()
     else:
-        return AdaptiveBenchmarkingResult(samples, median, relative_ci_width, False)
+        return estimator.result(False, warmups=warmups)
+
+
+def detect_warmup(
+    iterator, max_warmup_runs: int, window: int = 5, tolerance: float = 0.02
+) -> tuple[list[float], int]:
+    """
+    Discard runtime samples until they reach a steady state, i.e. until the
+    mean of a window of `window` samples is within `tolerance` (relative) of
+    the median of the following window. Returns the stable samples, which can be kept as
+    measurements, and the number of discarded samples (at most `max_warmup_runs`).
+
+    If the runtimes do not settle within `max_warmup_runs`, this falls back to a
+    fixed warmup: exactly `max_warmup_runs` samples are discarded and the
+    samples after them are returned, with a warning.
+    """
+    samples: list[float] = []
+    warmups = 0
+    while True:
+        if warmups >= max_warmup_runs:
+            if max_warmup_runs > 0:
+                logger.warning(
+                    f"Runtimes not stable after {warmups} warmup runs, "
+                    "keeping the samples after them"
+                )
+            return samples, warmups
+        sample = next(iterator)
+        if sample is None:
+            warmups += 1
+            continue
+        samples.append(float(sample))
+        if len(samples) < 2 * window:
+            continue
+        first = np.mean(samples[:window])  # the mean still shows a trend in the window
+        last = np.median(samples[window:])
+        if abs(first - last) <= tolerance * last:
+            logger.info(f"Runtimes stable after {warmups} warmup runs")
+            return samples, warmups
+        samples.pop(0)  # the oldest sample, so the rest follow the warmup runs
+        warmups += 1
 
 
 def get_fixed_run_benchmark(
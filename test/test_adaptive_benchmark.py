@@ -0,0 +1,119 @@
+import itertools
+import unittest
+
+import numpy as np
+
+from datastructures import AdaptiveBenchmarkingResult
+from utils import (
+    MedianEstimator,
+    adaptive_benchmark,
+    detect_warmup,
+    get_benchmarking_median_bounds,
+)
+
+
+def noisy_runtimes(center: float):
+    return itertools.cycle([center - 50, center + 50])
+
+
+class TestAdaptiveBenchmark(unittest.TestCase):
+    baseline = AdaptiveBenchmarkingResult(np.array([100.0]), 100.0, 0.01, True)
+
+    def test_slow_candidate_is_rejected(self):
+        result = adaptive_benchmark(
+            noisy_runtimes(200),
+            warmup_runs=0,
+            initial_samples=10,
+            max_samples=100,
+            race_baseline=self.baseline,
+        )
+        self.assertTrue(result.partial)
+        self.assertFalse(result.converged)
+        self.assertEqual(len(result.runtimes), 10)
+
+    def test_race_against_best(self):
+        result = adaptive_benchmark(
+            noisy_runtimes(140),
+            warmup_runs=0,
+            initial_samples=10,
+            max_samples=100,
+            race_baseline=self.baseline,
+            race_best_speedup=1.5,
+        )
+        self.assertTrue(result.partial)
+
+    def test_race_limit_uses_half_the_baseline_interval(self):
+        wide_baseline = AdaptiveBenchmarkingResult(np.array([100.0]), 100.0, 0.4, True)
+        result = adaptive_benchmark(
+            itertools.cycle([129.0, 131.0]),
+            warmup_runs=0,
+            initial_samples=10,
+            max_samples=100,
+            relative_ci_threshold=0.001,
+            race_baseline=wide_baseline,
+        )
+        self.assertTrue(result.partial)
+
+    def test_competitive_candidate_is_measured_fully(self):
+        result = adaptive_benchmark(
+            noisy_runtimes(100),
+            warmup_runs=0,
+            initial_samples=10,
+            max_samples=40,
+            race_baseline=self.baseline,
+        )
+        self.assertFalse(result.partial)
+        self.assertGreater(len(result.runtimes), 10)
+
+    def test_warmup_stops_at_steady_state(self):
+        runtimes = itertools.chain([300.0, 250, 200, 150], itertools.repeat(100.0))
+        stable, warmups = detect_warmup(runtimes, max_warmup_runs=15)
+        self.assertEqual(warmups, 4)
+        self.assertEqual(stable, [100.0] * 10)
+
+    def test_warmup_is_bounded(self):
+        with self.assertLogs("utils", "WARNING"):
+            stable, warmups = detect_warmup(
+                itertools.count(100.0, 10.0), max_warmup_runs=3
+            )
+        self.assertEqual(warmups, 3)
+        # the samples after the warmup runs, as with a fixed warmup
+        self.assertEqual(stable, [130.0 + 10 * i for i in range(9)])
+
+    def test_adaptive_warmup_records_warmups(self):
+        runtimes = itertools.chain([300.0, 200], itertools.repeat(100.0))
+        result = adaptive_benchmark(
+            runtimes,
+            warmup_runs=15,
+            initial_samples=10,
+            max_samples=100,
+            adaptive_warmup=True,
+        )
+        self.assertTrue(result.converged)
+        self.assertEqual(result.warmups, 2)
+        self.assertEqual(len(result.runtimes), 10)
+
+
+class TestMedianEstimator(unittest.TestCase):
+    def test_matches_batch_bounds(self):
+        rng = np.random.default_rng(0)
+        estimator = MedianEstimator(0.95)
+        samples = []
+        for sample in rng.lognormal(size=60):
+            estimator.add(float(sample))
+            samples.append(float(sample))
+            self.assertEqual(
+                estimator.bounds(), get_benchmarking_median_bounds(samples, 0.95)
+            )
+        self.assertEqual(estimator.samples, samples)
+
+    def test_result(self):
+        result = MedianEstimator(samples=[3.0, 1.0, 2.0, 4.0]).result(True)
+        self.assertEqual(result.runtimes.tolist(), [3.0, 1.0, 2.0, 4.0])
+        self.assertEqual(result.median, 2.5)
+        self.assertTrue(result.converged)
+        self.assertEqual(MedianEstimator(samples=[1.0]).result(False).ci, np.inf)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from advisors.mc_advisor import MonteCarloAdvisor, State
+from checkpoint import load_checkpoint, save_checkpoint
+from datastructures import AdaptiveBenchmarkingResult
+from utils import MonteCarloError
+
+
+class DummyAdvisor(MonteCarloAdvisor[int]):
+    def opt_args(self) -> list[str]:
+        return []
+
+    def get_rollout_decision(self, tv, heuristic) -> int:
+        return 0
+
+    def get_next_state(self, state: State[int], tv, heuristic) -> State[int]:
+        return state
+
+    def get_default_decision(self, advisor_type, tv, heuristic) -> int:
+        return 0
+
+    def set_state_as_fully_explored(self, state: State[int]):
+        state.subtree_is_fully_explored = True
+
+
+class TestCheckpoint(unittest.TestCase):
+    def test_round_trip(self):
+        adv = DummyAdvisor("test")
+        adv.top_k = 2
+        inline = adv.root.add_child(True, 1.0, 1.0, 1)
+        unroll = inline.add_child(8, 1.3, 2.6, 2)
+        inline.add_child(2, 0.7, 0.7, 1).subtree_is_fully_explored = True
+        adv.default_path = [True, 8]
+        for path, score in [([True, 8], 1.0), ([True, 2], 0.7), ([True, 8, 1], 1.6)]:
+            adv.record_run(path, score)
+            adv.path_scores[tuple(path)] = (score, 1)
+        adv.invalid_paths.add((False,))
+        baseline = AdaptiveBenchmarkingResult(np.array([10.0, 11.0]), 10.5, 0.1, True)
+
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "run.ckpt")
+            save_checkpoint(path, adv, baseline)
+            resumed = DummyAdvisor("test")
+            resumed.top_k = 2
+            restored_baseline = load_checkpoint(path, resumed)
+
+        self.assertEqual(restored_baseline.median, 10.5)
+        np.testing.assert_array_equal(restored_baseline.runtimes, baseline.runtimes)
+        self.assertEqual(resumed.root.repr_subtree(), adv.root.repr_subtree())
+        self.assertEqual(resumed.root[True][8].visits, unroll.visits)
+        self.assertTrue(resumed.root[True][2].subtree_is_fully_explored)
+        self.assertIs(type(resumed.root[True].decision), bool)
+        self.assertEqual(resumed.all_runs, adv.all_runs)
+        self.assertEqual(resumed.get_top_runs(), adv.get_top_runs())
+        self.assertEqual(
+            resumed.max_speedup_after_n_iterations, adv.max_speedup_after_n_iterations
+        )
+        self.assertEqual(resumed.path_scores, adv.path_scores)
+        self.assertEqual(resumed.invalid_paths, adv.invalid_paths)
+        self.assertEqual(resumed.default_path, [True, 8])
+        self.assertEqual(resumed.get_max_state().decisions, [True, 8])
+
+        resumed.root[True].add_child(4)
+        self.assertEqual(resumed.root[True].num_children(), 3)
+
+    def test_samples_per_run_must_match(self):
+        baseline = AdaptiveBenchmarkingResult(np.array([10.0]), 10.0, 0.1, True)
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "run.ckpt")
+            adv = DummyAdvisor("test")
+            adv.default_path = []
+            save_checkpoint(path, adv, baseline, samples_per_run=8)
+            load_checkpoint(path, DummyAdvisor("test"), samples_per_run=8)
+            with self.assertRaises(MonteCarloError):
+                load_checkpoint(path, DummyAdvisor("test"))
+
+
+if __name__ == "__main__":
+    unittest.main()
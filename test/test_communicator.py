@@ -0,0 +1,121 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from advisors.mc_runner import ChannelCommunicator, set_blocking, set_nonblocking
+from advisors.merged.merged_runner import MergedCompilerCommunicator
+
+
+class EchoCommunicator(ChannelCommunicator):
+    def exchange(self, compiler_proc, tc, fc, advice, *callbacks):
+        set_nonblocking(fc)
+        while (yield) == "yes":
+            set_blocking(fc)
+            advice(self.channel_base, [fc.readline()], None)
+            set_nonblocking(fc)
+
+
+class FailingCommunicator(ChannelCommunicator):
+    def exchange(self, compiler_proc, tc, fc, advice, *callbacks):
+        yield
+        raise ValueError()
+
+
+def fake_compiler(channel: str, lines: bytes, linger: float = 0.0):
+    """A process that writes `lines` to `channel` once it exists."""
+    script = (
+        "import os, sys, time\n"
+        "while not os.path.exists(sys.argv[1]): time.sleep(0.01)\n"
+        "with open(sys.argv[1], 'wb') as f: f.write(sys.argv[2].encode())\n"
+        "time.sleep(float(sys.argv[3]))\n"
+    )
+    return subprocess.Popen(
+        [sys.executable, "-c", script, channel, lines.decode(), str(linger)],
+        stdout=subprocess.PIPE,
+    )
+
+
+class TestCommunicator(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.base = os.path.join(self.directory.name, "input")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_exchange_until_exit(self):
+        comm = EchoCommunicator(self.base, False)
+        advice = []
+        with fake_compiler(comm.from_compiler, b"a\nb\n") as proc:
+            comm.communicate_with_proc(proc, lambda *args: advice.append(args[1]))
+        comm.clean_up_pipes()
+        self.assertEqual(advice, [[b"a\n"], [b"b\n"]])
+
+    def test_exchange_is_abstract(self):
+        class Incomplete(ChannelCommunicator):
+            pass
+
+        with self.assertRaises(TypeError):
+            Incomplete(self.base, False)
+
+    def test_error_cancels_other_channels(self):
+        merged = MergedCompilerCommunicator(self.base, False)
+        failing = FailingCommunicator(self.base, False)
+        waiting = EchoCommunicator(self.base, False)
+        merged.channels = [waiting, failing]
+        with fake_compiler(failing.from_compiler, b"x\n", linger=10) as proc:
+            start = time.monotonic()
+            with self.assertRaises(ValueError):
+                merged.communicate_with_proc(proc, lambda *args: 0, timeout=5)
+            self.assertLess(time.monotonic() - start, 2)
+            proc.kill()
+        merged.clean_up_pipes()
+        self.assertFalse(os.path.exists(waiting.from_compiler))
+
+    def test_timeout(self):
+        merged = MergedCompilerCommunicator(self.base, False)
+        merged.channels = [EchoCommunicator(self.base, False)]
+        with subprocess.Popen(["sleep", "10"], stdout=subprocess.PIPE) as proc:
+            with self.assertRaises(TimeoutError):
+                merged.communicate_with_proc(proc, lambda *args: 0, timeout=0.2)
+            proc.kill()
+        merged.clean_up_pipes()
+
+
+class TestSessions(unittest.TestCase):
+    def test_sessions_do_not_collide(self):
+        a = EchoCommunicator("dir/input.c", False)
+        b = EchoCommunicator("dir/input.c", False)
+        self.assertNotEqual(a.from_compiler, b.from_compiler)
+        self.assertNotEqual(a.output_module, b.output_module)
+        self.assertTrue(os.path.isdir(a.session_directory))
+
+        merged = MergedCompilerCommunicator("input.c", False)
+        for channel in merged.channels:
+            self.assertEqual(channel.session_directory, merged.session_directory)
+
+    def test_session_directory_is_removed(self):
+        comm = EchoCommunicator("input.c", False)
+        directory = comm.session_directory
+        del comm
+        self.assertFalse(os.path.exists(directory))
+
+    def test_output_is_copied_after_compiling(self):
+        comm = EchoCommunicator("input.c", False)
+        write_output = "import sys; open(sys.argv[2], 'wb').write(b'module')"
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "mod-post-mc.bc")
+            comm.compile_module(
+                [sys.executable, "-c", write_output], "in.bc", output, lambda *_: 0
+            )
+            with open(output, "rb") as f:
+                self.assertEqual(f.read(), b"module")
+            self.assertEqual(os.listdir(directory), ["mod-post-mc.bc"])
+        self.assertFalse(os.path.exists(comm.output_module))
+
+
+if __name__ == "__main__":
+    unittest.main()
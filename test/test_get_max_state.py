@@ -28,7 +28,7 @@ class TestGetMaxState(unittest.TestCase):
         adv.root.score = 1.5
         adv.root.visits = 1
         max_state = adv.get_max_state()
-        self.assertIs(max_state, adv.root)
+        self.assertEqual(max_state.index, adv.root.index)
 
     def test_single_level_children(self):
         adv = DummyAdvisor("test")
@@ -36,7 +36,7 @@ class TestGetMaxState(unittest.TestCase):
         c1 = adv.root.add_child(0, score=2.0, speedup_sum=2.0, visits=1)
         c2 = adv.root.add_child(1, score=3.0, speedup_sum=3.0, visits=1)
         max_state = adv.get_max_state()
-        self.assertIs(max_state, c2)
+        self.assertEqual(max_state.index, c2.index)
 
     def test_nested_children(self):
         adv = DummyAdvisor("test")
@@ -45,7 +45,7 @@ class TestGetMaxState(unittest.TestCase):
         gc = c1.add_child(0, score=5.0, speedup_sum=5.0, visits=1)
         c2 = adv.root.add_child(1, score=4.0, speedup_sum=4.0, visits=1)
         max_state = adv.get_max_state()
-        self.assertIs(max_state, gc)
+        self.assertEqual(max_state.index, gc.index)
 
     def test_root_higher_than_children(self):
         adv = DummyAdvisor("test")
@@ -54,7 +54,7 @@ class TestGetMaxState(unittest.TestCase):
         adv.root.visits = 1
         c1 = adv.root.add_child(0, score=2.0, speedup_sum=2.0, visits=1)
         max_state = adv.get_max_state()
-        self.assertIs(max_state, adv.root)
+        self.assertEqual(max_state.index, adv.root.index)
 
     def test_sophia(self):
         adv = DummyAdvisor("test")
@@ -67,7 +67,7 @@ class TestGetMaxState(unittest.TestCase):
         c2 = c1.add_child(0, 2)
         c6 = c1.add_child(0, 6)
         max = adv.get_max_state()
-        self.assertIs(max, c8)
+        self.assertEqual(max.index, c8.index)
 
     def test_sophia_2(self):
         adv = DummyAdvisor("test")
@@ -85,7 +85,31 @@ class TestGetMaxState(unittest.TestCase):
         c9 = c11.add_child(0, 9)
 
         max = adv.get_max_state()
-        self.assertIs(max, c15)
+        self.assertEqual(max.index, c15.index)
+
+    def test_revisit_keeps_max(self):
+        adv = DummyAdvisor("test")
+        leaf = adv.root.add_child(0)
+        adv.current_path = [0]
+        for score in [3.0, 1.0]:
+            adv.current = leaf
+            while adv.current:
+                adv.update_score(score)
+                adv.current = adv.current.parent
+        self.assertEqual(leaf.score, 2.0)
+        self.assertEqual(adv.get_max_state().index, leaf.index)
+        self.assertEqual(adv.tree.best_score, 3.0)
+
+    def test_max_and_top_runs(self):
+        adv = DummyAdvisor("test")
+        adv.top_k = 2
+        for i, score in enumerate([1.0, 1.4, 0.9, 1.2, -999]):
+            adv.record_run([i], score)
+        self.assertEqual(adv.get_max_run(), ([1], 1.4))
+        self.assertEqual(adv.get_top_runs(), [([1], 1.4), ([3], 1.2)])
+        self.assertEqual(
+            adv.max_speedup_after_n_iterations, [1.0, 1.4, 1.4, 1.4, 1.4]
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,44 @@
+import io
+import os
+import subprocess
+import threading
+import time
+import unittest
+
+from advisors.mc_runner import InputWaiter
+
+
+class TestInputWaiter(unittest.TestCase):
+    def setUp(self):
+        read_fd, self.write_fd = os.pipe()
+        os.set_blocking(read_fd, False)
+        self.fc = io.BufferedReader(io.FileIO(read_fd, "rb"))
+
+    def tearDown(self):
+        self.fc.close()
+        os.close(self.write_fd)
+
+    def test_input(self):
+        with subprocess.Popen(["sleep", "10"]) as proc:
+            threading.Timer(0.1, os.write, (self.write_fd, b"x")).start()
+            with InputWaiter(self.fc, proc, timeout=5) as waiter:
+                self.assertEqual(waiter.wait(), "yes")
+            proc.kill()
+
+    def test_exit_without_spinning(self):
+        with subprocess.Popen(["sleep", "0.3"]) as proc:
+            cpu = time.process_time()
+            with InputWaiter(self.fc, proc, timeout=5) as waiter:
+                self.assertEqual(waiter.wait(), "dead")
+            self.assertLess(time.process_time() - cpu, 0.1)
+
+    def test_timeout(self):
+        with subprocess.Popen(["sleep", "10"]) as proc:
+            with InputWaiter(self.fc, proc, timeout=0.1) as waiter:
+                with self.assertRaises(TimeoutError):
+                    waiter.wait()
+            proc.kill()
+
+
+if __name__ == "__main__":
+    unittest.main()
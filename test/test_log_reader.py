@@ -0,0 +1,112 @@
+import io
+import json
+import struct
+import unittest
+
+import numpy as np
+
+from advisors import log_reader
+
+HEADER = {
+    "features": [
+        {"name": "sizes", "port": 0, "shape": [3], "type": "int64_t"},
+        {"name": "weight", "port": 1, "shape": [1], "type": "float"},
+        {"name": "flags", "port": 2, "shape": [2], "type": "uint64_t"},
+    ],
+    "advice": {"name": "advice", "port": 3, "shape": [1], "type": "int64_t"},
+}
+
+
+def observation(i: int, sizes, weight, flags) -> bytes:
+    return (
+        json.dumps({"observation": i}).encode()
+        + b"\n"
+        + struct.pack("=3q", *sizes)
+        + struct.pack("=f", weight)
+        + struct.pack("=2Q", *flags)
+        + b"\n"
+    )
+
+
+def stream(*observations: bytes) -> io.BufferedReader:
+    data = json.dumps(HEADER).encode() + b"\n" + b"".join(observations)
+    return io.BufferedReader(io.BytesIO(data))
+
+
+class TestObservationDecoder(unittest.TestCase):
+    def test_matches_reading_tensor_by_tensor(self):
+        data = observation(0, [1, -2, 3], 0.5, [7, 2**64 - 1])
+        f = stream(data)
+        _, tensor_specs, _, _ = log_reader.read_header(f)
+        decoder = log_reader.ObservationDecoder(tensor_specs)
+        _, _, features, _ = log_reader.read_one_observation(
+            None, f.readline(), f, tensor_specs, None, decoder
+        )
+
+        g = stream(data)
+        log_reader.read_header(g)
+        _, _, expected, _ = log_reader.read_one_observation(
+            None, g.readline(), g, tensor_specs, None
+        )
+        for tv, ev in zip(features, expected):
+            np.testing.assert_array_equal(tv.to_numpy(), ev.to_numpy())
+        self.assertEqual(features[0][1], -2)
+        self.assertEqual(features[2].to_numpy().tolist(), [7, -1])
+
+    def test_buffer_is_reused(self):
+        f = stream(
+            observation(0, [1, 2, 3], 1.0, [0, 0]),
+            observation(1, [4, 5, 6], 2.0, [1, 1]),
+        )
+        _, tensor_specs, _, _ = log_reader.read_header(f)
+        decoder = log_reader.ObservationDecoder(tensor_specs)
+        _, _, first, _ = log_reader.read_one_observation(
+            None, f.readline(), f, tensor_specs, None, decoder
+        )
+        kept = first[0].copy()
+        _, _, second, _ = log_reader.read_one_observation(
+            None, f.readline(), f, tensor_specs, None, decoder
+        )
+        self.assertIs(first[0], second[0])
+        self.assertEqual(second[0].to_numpy().tolist(), [4, 5, 6])
+        self.assertEqual(kept.to_numpy().tolist(), [1, 2, 3])
+
+    def test_truncated_stream(self):
+        f = io.BufferedReader(io.BytesIO(b"\x01\x02"))
+        decoder = log_reader.ObservationDecoder(
+            [log_reader.TensorSpec.from_dict(HEADER["features"][0])]
+        )
+        with self.assertRaises(EOFError):
+            decoder.read(f)
+
+
+class TestAdviceEncoder(unittest.TestCase):
+    def test_encodings(self):
+        int_spec = log_reader.TensorSpec.from_dict(HEADER["advice"])
+        self.assertEqual(
+            log_reader.AdviceEncoder(int_spec).encode(True), struct.pack("=q", 1)
+        )
+        float_spec = log_reader.TensorSpec.from_dict(HEADER["features"][1])
+        self.assertEqual(
+            log_reader.AdviceEncoder(float_spec).encode([2]), struct.pack("=f", 2.0)
+        )
+
+    def test_size_mismatch(self):
+        spec = log_reader.TensorSpec.from_dict(HEADER["advice"])
+        with self.assertRaises(struct.error):
+            log_reader.AdviceEncoder(spec).encode([1, 2])
+
+    def test_writer_flushes_on_demand(self):
+        raw = io.BytesIO()
+        f = io.BufferedWriter(raw)
+        writer = log_reader.AdviceWriter(
+            f, log_reader.TensorSpec.from_dict(HEADER["advice"])
+        )
+        writer.send(4)
+        self.assertEqual(raw.getvalue(), b"")
+        writer.flush()
+        self.assertEqual(raw.getvalue(), struct.pack("=q", 4))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+
+import utils
+from advisors.mc_advisor import MonteCarloAdvisor, State
+
+
+class DummyAdvisor(MonteCarloAdvisor[int]):
+    def opt_args(self) -> list[str]:
+        return []
+
+    def get_rollout_decision(self, tv, heuristic) -> int:
+        return 0
+
+    def get_next_state(self, state: State[int], tv, heuristic) -> State[int]:
+        return state
+
+    def get_default_decision(self, advisor_type, tv, heuristic) -> int:
+        return 0
+
+    def set_state_as_fully_explored(self, state: State[int]):
+        state.subtree_is_fully_explored = True
+
+
+class TestMerge(unittest.TestCase):
+    def test_trees_are_merged_by_decision(self):
+        a = DummyAdvisor("a")
+        a.default_path = [True, 4]
+        a.root.visits, a.root.speedup_sum = 2, 2.5
+        a.root.add_child(True, 1.25, 2.5, 2).add_child(4, 1.5, 1.5, 1)
+        b = DummyAdvisor("b")
+        b.default_path = [True, 8]
+        b.root.visits, b.root.speedup_sum = 2, 3.0
+        b_inline = b.root.add_child(True, 1.0, 1.0, 1)
+        b_inline.add_child(8, 2.0, 2.0, 1).subtree_is_fully_explored = True
+        b.root.add_child(False, 1.0, 1.0, 1)
+
+        merged = DummyAdvisor("merged")
+        merged.merge([a, b])
+
+        self.assertEqual(merged.root.visits, 4)
+        inline = merged.root[True]
+        self.assertEqual(inline.visits, 3)
+        self.assertAlmostEqual(inline.score, 3.5 / 3)
+        self.assertEqual([c.decision for c in inline.children], [4, 8])
+        self.assertTrue(inline[8].subtree_is_fully_explored)
+        self.assertEqual(merged.root[False].visits, 1)
+        self.assertEqual(merged.get_max_state().decisions, [True, 8])
+
+    def test_invalid_nodes_are_not_summed(self):
+        a = DummyAdvisor("a")
+        a.default_path = [True]
+        a.root.visits, a.root.speedup_sum = 1, 1.2
+        a.root.add_child(True, 1.5, 1.5, 1).add_child(4, 1.5, 1.5, 1)
+        b = DummyAdvisor("b")
+        b.default_path = [True]
+        b.root.add_child(True).add_child(4)
+        b.current_path = [True, 4]
+        b.mark_state_as_invalid(b.root[True][4], utils.TIMEOUT_ERROR_CODE)
+
+        merged = DummyAdvisor("merged")
+        merged.merge([a, b])
+
+        invalid = merged.root[True][4]
+        self.assertEqual(invalid.score, utils.TIMEOUT_ERROR_CODE)
+        self.assertEqual(invalid.speedup_sum, utils.TIMEOUT_ERROR_CODE)
+        self.assertEqual(invalid.visits, 1)
+        self.assertTrue(invalid.subtree_is_fully_explored)
+        self.assertEqual(merged.root[True].score, 1.5)
+        self.assertEqual(merged.get_max_state().decisions, [True])
+
+        merged.merge([a])
+        self.assertEqual(invalid.score, utils.TIMEOUT_ERROR_CODE)
+        self.assertEqual(merged.root[True].visits, 2)
+
+    def test_runs_are_interleaved(self):
+        a = DummyAdvisor("a")
+        b = DummyAdvisor("b")
+        for adv, runs in [(a, [([1], 1.0), ([2], 1.2)]), (b, [([1], 1.0)])]:
+            adv.default_path = [1]
+            for path, score in runs:
+                adv.record_run(path, score)
+                adv.path_scores[tuple(path)] = (score, 1)
+        b.path_scores[(1,)] = (2.0, 3)
+        b.invalid_paths.add((3,))
+
+        merged = DummyAdvisor("merged")
+        merged.top_k = 2
+        merged.merge([a, b])
+
+        self.assertEqual(merged.all_runs, [([1], 1.0), ([1], 1.0), ([2], 1.2)])
+        self.assertEqual(merged.max_speedup_after_n_iterations, [1.0, 1.0, 1.2])
+        self.assertEqual(merged.get_max_run(), ([2], 1.2))
+        self.assertEqual(merged.path_scores[(1,)], (1.75, 4))
+        self.assertEqual(merged.invalid_paths, {(3,)})
+        self.assertEqual(merged.default_path, [1])
+
+
+if __name__ == "__main__":
+    unittest.main()
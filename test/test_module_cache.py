@@ -0,0 +1,95 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from datastructures import AdaptiveBenchmarkingResult
+from module_cache import ObjectCache, ScoreCache, hash_module
+
+
+def result(median: float) -> AdaptiveBenchmarkingResult:
+    return AdaptiveBenchmarkingResult(np.array([median]), median, 0.01, True)
+
+
+class TestScoreCache(unittest.TestCase):
+    def test_persists_and_evicts(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "cache.pkl")
+            cache = ScoreCache(path, max_entries=2, save_interval=1)
+            cache.put("a", result(1.0))
+            cache.put("b", result(2.0))
+            self.assertEqual(cache.get("a").median, 1.0)  # "b" is now least recent
+            cache.put("c", result(3.0))
+            self.assertIsNone(cache.get("b"))
+
+            reloaded = ScoreCache(path, max_entries=2)
+            self.assertEqual(len(reloaded), 2)
+            self.assertEqual(reloaded.get("c").median, 3.0)
+
+    def test_saves_in_batches(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "cache.pkl")
+            cache = ScoreCache(path, save_interval=2)
+            cache.put("a", result(1.0))
+            self.assertFalse(os.path.exists(path))
+            cache.put("b", result(2.0))
+            self.assertEqual(len(ScoreCache(path)), 2)
+            cache.put("c", result(3.0))
+            self.assertEqual(len(ScoreCache(path)), 2)
+            cache.flush()
+            self.assertEqual(len(ScoreCache(path)), 3)
+
+    def test_hash_depends_on_content(self):
+        with tempfile.TemporaryDirectory() as d:
+            paths = [os.path.join(d, name) for name in ["x.bc", "y.bc", "z.bc"]]
+            for path, content in zip(paths, [b"module", b"module", b"other"]):
+                with open(path, "wb") as f:
+                    f.write(content)
+            self.assertEqual(hash_module(paths[0]), hash_module(paths[1]))
+            self.assertNotEqual(hash_module(paths[0]), hash_module(paths[2]))
+
+
+class TestObjectCache(unittest.TestCase):
+    def test_fetch_store_and_evict(self):
+        with tempfile.TemporaryDirectory() as d:
+            cache = ObjectCache(os.path.join(d, "objects"), max_bytes=15)
+            source = os.path.join(d, "mod-post-mc.o")
+            destination = os.path.join(d, "copy.o")
+            self.assertFalse(cache.fetch("a", destination))
+
+            for key in ["a", "b"]:
+                with open(source, "wb") as f:
+                    f.write(key.encode() * 10)
+                cache.store(key, source)
+                if key == "a":
+                    os.utime(cache.entry(key), (0, 0))
+
+            # "a" was used least recently and does not fit next to "b"
+            self.assertFalse(cache.fetch("a", destination))
+            self.assertTrue(cache.fetch("b", destination))
+            with open(destination, "rb") as f:
+                self.assertEqual(f.read(), b"b" * 10)
+            self.assertEqual(cache.total, 10)
+
+    def test_size_is_counted_across_instances(self):
+        with tempfile.TemporaryDirectory() as d:
+            directory = os.path.join(d, "objects")
+            source = os.path.join(d, "mod-post-mc.o")
+            with open(source, "wb") as f:
+                f.write(b"a" * 10)
+            ObjectCache(directory, max_bytes=100).store("a", source)
+            cache = ObjectCache(directory, max_bytes=100)
+            self.assertEqual(cache.total, 10)
+            cache.store("a", source)  # replaces the entry
+            self.assertEqual(cache.total, 10)
+
+    def test_key_depends_on_flags(self):
+        with tempfile.TemporaryDirectory() as d:
+            o3 = ObjectCache(d, max_bytes=100, flags=["-O3", "-filetype=obj"])
+            o2 = ObjectCache(d, max_bytes=100, flags=["-O2", "-filetype=obj"])
+            self.assertNotEqual(o3.entry("a"), o2.entry("a"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+
+from advisors.loop_unroll.loop_unroll_mc_advisor import LoopUnrollMonteCarloAdvisor
+
+
+class TestProgressiveWidening(unittest.TestCase):
+    def test_children_grow_with_visits(self):
+        adv = LoopUnrollMonteCarloAdvisor("test")
+        state = adv.root
+        state.visits = 1
+        first = state.add_child(4, 1.0, 1.0, 1)
+
+        self.assertEqual(adv.widening_limit(state), 1)
+        self.assertEqual(adv.get_next_state(state, [], 4).index, first.index)
+
+        state.visits = 4
+        self.assertEqual(adv.widening_limit(state), 2)
+        # unexpanded factors are tried by distance from the heuristic
+        self.assertEqual(adv.get_next_state(state, [], 4).decision, 3)
+        state.visits = 9
+        self.assertEqual(adv.get_next_state(state, [], 4).decision, 5)
+
+    def test_expands_when_children_are_explored(self):
+        adv = LoopUnrollMonteCarloAdvisor("test")
+        state = adv.root
+        state.visits = 1
+        state.add_child(1, 1.0, 1.0, 1).subtree_is_fully_explored = True
+        self.assertEqual(adv.get_next_state(state, [], -1).decision, 2)
+
+    def test_limit_is_capped(self):
+        adv = LoopUnrollMonteCarloAdvisor("test")
+        adv.root.visits = 10**6
+        self.assertEqual(adv.widening_limit(adv.root), adv.MAX_UNROLL_FACTOR)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import struct
+import unittest
+
+from utils import (
+    MC_INVALID_SAMPLE,
+    MC_SAMPLES_MAGIC,
+    measured_channel,
+    readout_mc_result,
+    readout_mc_samples,
+)
+
+
+def record(*samples: int, channels: int = 1) -> bytes:
+    return (
+        MC_SAMPLES_MAGIC
+        + struct.pack("=II", len(samples) // channels, channels)
+        + struct.pack(f"={len(samples)}Q", *samples)
+    )
+
+
+class TestReadoutMcSamples(unittest.TestCase):
+    def test_samples_after_program_output(self):
+        output = b"make output\nresult 42\nMC_TIMER 7\n" + record(5, 6, 7)
+        self.assertEqual(readout_mc_samples(output), [5, 6, 7])
+
+    def test_missing_record(self):
+        with self.assertRaises(Exception):
+            readout_mc_samples(b"MC_TIMER 7\n")
+
+    def test_invalid_sample(self):
+        with self.assertRaises(Exception):
+            readout_mc_samples(record(5, MC_INVALID_SAMPLE))
+
+    def test_counter_channels(self):
+        output = record(5, 50, 40, 1, 6, 60, 41, 2, channels=4)
+        self.assertEqual(readout_mc_samples(output), [5, 6])
+        self.assertEqual(readout_mc_samples(output, "cycles"), [50, 60])
+        self.assertEqual(readout_mc_samples(output, "cache-misses"), [1, 2])
+
+    def test_counters_fall_back_to_time(self):
+        self.assertEqual(readout_mc_samples(record(5, 6), "cycles"), [5, 6])
+        self.assertEqual(measured_channel("cycles"), "time")
+        self.assertEqual(measured_channel("time"), "time")
+
+
+class TestReadoutMcResult(unittest.TestCase):
+    def test_record_in_memfd(self):
+        fd = os.memfd_create("test")
+        try:
+            os.write(fd, record(5, 6))
+            self.assertEqual(readout_mc_samples(readout_mc_result(fd)), [5, 6])
+            os.ftruncate(fd, 0)
+            self.assertEqual(readout_mc_result(fd), b"")
+        finally:
+            os.close(fd)
+
+
+if __name__ == "__main__":
+    unittest.main()
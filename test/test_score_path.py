@@ -0,0 +1,63 @@
+import unittest
+
+from advisors.mc_advisor import MonteCarloAdvisor, State
+from utils import PartialScore
+
+
+class DummyAdvisor(MonteCarloAdvisor[int]):
+    def opt_args(self) -> list[str]:
+        return []
+
+    def get_rollout_decision(self, tv, heuristic) -> int:
+        return 0
+
+    def get_next_state(self, state: State[int], tv, heuristic) -> State[int]:
+        return state
+
+    def get_default_decision(self, advisor_type, tv, heuristic) -> int:
+        return 0
+
+    def set_state_as_fully_explored(self, state: State[int]):
+        return
+
+
+class TestScorePath(unittest.TestCase):
+    def test_repeated_path_reuses_score(self):
+        adv = DummyAdvisor("test")
+        measurements = []
+
+        def scoring_function():
+            measurements.append(1)
+            return 1.5
+
+        adv.current_path = [1, 2]
+        self.assertEqual(adv.score_path(scoring_function), 1.5)
+        self.assertEqual(adv.score_path(scoring_function), 1.5)
+        self.assertEqual(len(measurements), 1)
+
+        adv.current_path = [1, 3]
+        adv.score_path(scoring_function)
+        self.assertEqual(len(measurements), 2)
+
+    def test_repeated_path_is_refined(self):
+        adv = DummyAdvisor("test")
+        adv.max_refinements = 1
+        adv.refine_function = lambda: 1.0
+        adv.current_path = [4]
+        adv.score_path(lambda: 2.0)
+        self.assertEqual(adv.score_path(lambda: 2.0), 1.5)
+        adv.refine_function = lambda: 0.0
+        self.assertEqual(adv.score_path(lambda: 2.0), 1.5)
+        self.assertEqual(adv.path_scores[(4,)], (1.5, 2))
+
+    def test_partial_score_is_not_reused(self):
+        adv = DummyAdvisor("test")
+        adv.current_path = [5]
+        self.assertEqual(adv.score_path(lambda: PartialScore(0.5)), 0.5)
+        self.assertNotIn((5,), adv.path_scores)
+        self.assertEqual(adv.score_path(lambda: 0.8), 0.8)
+        self.assertEqual(adv.path_scores[(5,)], (0.8, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
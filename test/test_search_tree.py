@@ -0,0 +1,92 @@
+import unittest
+
+from advisors.search_tree import SearchTree
+
+
+class TestSearchTree(unittest.TestCase):
+    def test_decisions_are_rebuilt_from_parents(self):
+        tree = SearchTree()
+        a = tree.root.add_child(True)
+        b = a.add_child(4)
+        c = b.add_child(False)
+        self.assertEqual(tree.root.decisions, [])
+        self.assertEqual(c.decisions, [True, 4, False])
+        self.assertIs(type(c.decisions[0]), bool)
+        self.assertIs(type(c.decisions[1]), int)
+        self.assertEqual(c.depth, 3)
+
+    def test_handles_refer_to_nodes(self):
+        tree = SearchTree()
+        child = tree.root.add_child(3)
+        self.assertEqual(child.parent.index, tree.root.index)
+        self.assertEqual(tree.root.children[0].index, child.index)
+        self.assertEqual(tree.root[3].index, child.index)
+
+    def test_handles_compare_by_node(self):
+        tree = SearchTree()
+        a = tree.root.add_child(1, 1.5)
+        b = tree.root.add_child(2, 1.5)
+        self.assertNotEqual(a, b)
+        self.assertEqual(a, tree.root[1])
+        self.assertEqual(hash(a), hash(tree.root[1]))
+        self.assertEqual(len({a, b, tree.root[1]}), 2)
+
+    def test_bool_child_lookup(self):
+        tree = SearchTree()
+        self.assertIsNone(tree.root.child(False))
+        yes = tree.root.add_child(True)
+        self.assertIsNone(tree.root.child(False))
+        self.assertEqual(tree.root.child(True), yes)
+        no = tree.root.add_child(False)
+        self.assertEqual(tree.root.child(False), no)
+        self.assertEqual(tree.root[True], yes)
+
+    def test_children_sorted_by_decision(self):
+        tree = SearchTree()
+        for factor in [5, 1, 3]:
+            tree.root.add_child(factor)
+        self.assertEqual([c.decision for c in tree.root.children], [1, 3, 5])
+        self.assertEqual(tree.root.num_children(), 3)
+
+    def test_statistics_survive_growth(self):
+        tree = SearchTree(capacity=2)
+        current = tree.root
+        for i in range(100):
+            current = current.add_child(i % 2 == 0, score=i, speedup_sum=i, visits=1)
+        current.visits += 1
+        current.subtree_is_fully_explored = True
+        self.assertEqual(len(tree), 101)
+        self.assertEqual(current.score, 99.0)
+        self.assertEqual(current.visits, 2)
+        self.assertTrue(current.subtree_is_fully_explored)
+        self.assertEqual(len(current.decisions), 100)
+
+    def test_slot_lookup_and_unvisited_decisions(self):
+        tree = SearchTree()
+        node = tree.root.add_child(True)
+        for factor in [2, 32, 7]:
+            node.add_child(factor)
+        self.assertEqual(node.child(32).decision, 32)
+        self.assertIsNone(node.child(3))
+        self.assertFalse(node.has_bool_children())
+        self.assertTrue(tree.root.has_bool_children())
+        self.assertEqual(node.num_unvisited(32), 29)
+        unvisited = list(node.unvisited_decisions(1, 32))
+        self.assertEqual(len(unvisited), 29)
+        self.assertNotIn(7, unvisited)
+        with self.assertRaises(KeyError):
+            node[3]
+
+    def test_explored_children_counter(self):
+        tree = SearchTree()
+        a = tree.root.add_child(False)
+        b = tree.root.add_child(True)
+        a.subtree_is_fully_explored = True
+        a.subtree_is_fully_explored = True
+        self.assertEqual(tree.root.num_explored_children(), 1)
+        b.subtree_is_fully_explored = True
+        self.assertEqual(tree.root.num_explored_children(), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
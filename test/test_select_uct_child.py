@@ -0,0 +1,51 @@
+import unittest
+
+from advisors.mc_advisor import MonteCarloAdvisor, State
+
+
+class DummyAdvisor(MonteCarloAdvisor[int]):
+    def opt_args(self) -> list[str]:
+        return []
+
+    def get_rollout_decision(self, tv, heuristic) -> int:
+        return 0
+
+    def get_next_state(self, state: State[int], tv, heuristic) -> State[int]:
+        return state
+
+    def get_default_decision(self, advisor_type, tv, heuristic) -> int:
+        return 0
+
+    def set_state_as_fully_explored(self, state: State[int]):
+        return
+
+
+class TestSelectUctChild(unittest.TestCase):
+    def test_matches_scalar_uct(self):
+        adv = DummyAdvisor("test")
+        adv.root.visits = 60
+        for factor, (score, visits) in enumerate(
+            [(1.1, 20), (0.9, 2), (1.3, 30), (1.0, 8)], start=1
+        ):
+            adv.root.add_child(factor, score, score * visits, visits)
+        expected = max(adv.root.children, key=adv.uct)
+        self.assertEqual(adv.select_uct_child(adv.root).index, expected.index)
+
+    def test_skips_explored_children(self):
+        adv = DummyAdvisor("test")
+        adv.root.visits = 10
+        best = adv.root.add_child(True, 5.0, 5.0, 1)
+        other = adv.root.add_child(False, 1.0, 9.0, 9)
+        best.subtree_is_fully_explored = True
+        self.assertEqual(adv.select_uct_child(adv.root).index, other.index)
+
+    def test_prefers_unvisited_children(self):
+        adv = DummyAdvisor("test")
+        adv.root.visits = 10
+        adv.root.add_child(1, 5.0, 50.0, 10)
+        unvisited = adv.root.add_child(2)
+        self.assertEqual(adv.select_uct_child(adv.root).index, unvisited.index)
+
+
+if __name__ == "__main__":
+    unittest.main()
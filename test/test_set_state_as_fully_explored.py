@@ -5,7 +5,7 @@ from advisors.merged.merged_mc_advisor import MergedMonteCarloAdvisor
 
 class TestSubtreeFullyExplored(unittest.TestCase):
     def setup_advisor(self) -> MergedMonteCarloAdvisor:
-        advisor = MergedMonteCarloAdvisor("test")
+        advisor = MergedMonteCarloAdvisor("test", None)
         advisor.loop_unroll_advisor.MAX_UNROLL_FACTOR = 3
         return advisor
 
@@ -0,0 +1,56 @@
+import unittest
+
+from toolchain import Toolchain
+
+
+class TestToolchain(unittest.TestCase):
+    variables = {
+        "CC": "clang",
+        "EXTRA_FLAGS": "-DPOLYBENCH_USE_C99_PROTO -lm",
+        "EXTRA_OBJS": "/opt/polybench.o",
+        "LLC_FLAGS": "-O3 -filetype=obj",
+        "MAIN_OBJ": "/in/gemm_main.o",
+        "PROF_OBJ": "profiler/mc_profiler.o",
+        "MODULE_POST_BC": "/in/mod-post-mc.bc",
+        "MODULE_OBJ": "/in/mod-post-mc.o",
+        "OUT": "/in/gemm.out",
+        "BASELINE_OUT": "/in/baseline.out",
+    }
+
+    def test_commands_match_the_makefile_rules(self):
+        toolchain = Toolchain(self.variables)
+        self.assertEqual(
+            toolchain.llc_command(),
+            [
+                "llc",
+                "-O3",
+                "-filetype=obj",
+                "/in/mod-post-mc.bc",
+                "-o",
+                "/in/mod-post-mc.o",
+            ],
+        )
+        self.assertEqual(
+            toolchain.link_command(),
+            [
+                "clang",
+                "-DPOLYBENCH_USE_C99_PROTO",
+                "-lm",
+                "/in/gemm_main.o",
+                "profiler/mc_profiler.o",
+                "/in/mod-post-mc.o",
+                "/opt/polybench.o",
+                "-o",
+                "/in/gemm.out",
+            ],
+        )
+        self.assertEqual(toolchain.run_command(), ["/in/gemm.out"])
+        self.assertEqual(toolchain.baseline_command(), ["/in/baseline.out"])
+
+    def test_without_extra_objects(self):
+        toolchain = Toolchain(self.variables | {"EXTRA_OBJS": "", "EXTRA_FLAGS": ""})
+        self.assertEqual(toolchain.link_command()[-3], "/in/mod-post-mc.o")
+
+
+if __name__ == "__main__":
+    unittest.main()
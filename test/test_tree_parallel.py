@@ -0,0 +1,66 @@
+import unittest
+
+from advisors.mc_advisor import MonteCarloAdvisor, State
+
+
+class DummyAdvisor(MonteCarloAdvisor[int]):
+    BRANCHING_FACTOR = 4
+    DEPTH = 2
+
+    def opt_args(self) -> list[str]:
+        return []
+
+    def get_rollout_decision(self, tv, heuristic) -> int:
+        return 1
+
+    def get_next_state(self, state: State[int], tv, heuristic) -> State[int]:
+        if state.num_unvisited(self.BRANCHING_FACTOR) > 0:
+            decisions = state.unvisited_decisions(0, self.BRANCHING_FACTOR - 1)
+            return state.add_child(int(decisions[0]))
+        return self.select_uct_child(state)
+
+    def get_default_decision(self, advisor_type, tv, heuristic) -> int:
+        return 0
+
+    def set_state_as_fully_explored(self, state: State[int]):
+        state.subtree_is_fully_explored = True
+
+    def get_score(self, path, timeout, scoring_function):
+        for _ in range(self.DEPTH):
+            self.advice("", [], None)
+        return self.score_path(scoring_function)
+
+
+class TestTreeParallel(unittest.TestCase):
+    def test_virtual_loss_steers_selection(self):
+        adv = DummyAdvisor("test")
+        adv.root.visits = 2
+        busy = adv.root.add_child(0, 1.0, 1.0, 1)
+        idle = adv.root.add_child(1, 1.0, 1.0, 1)
+        # ties go to the first child
+        self.assertEqual(adv.select_uct_child(adv.root).index, busy.index)
+
+        adv.enter_state(busy)
+        self.assertEqual(adv.select_uct_child(adv.root).index, idle.index)
+        adv.clear_virtual_loss()
+        self.assertEqual(adv.tree.in_flight[busy.index], 0)
+
+    def test_pipelines_share_the_tree(self):
+        leader = DummyAdvisor("leader")
+        leader.default_path = [0, 0]
+        leader.root.visits = 1
+        leader.record_run([0, 0], 1.0)
+        pipelines = [leader, DummyAdvisor("p1"), DummyAdvisor("p2")]
+        leader.run_tree_parallel(
+            [(adv, "", lambda: 1.5, None) for adv in pipelines], 10, None
+        )
+
+        self.assertEqual(len(leader.all_runs), 11)  # the default run and 10 iterations
+        self.assertEqual(pipelines[1].all_runs, [])
+        self.assertEqual(leader.root.visits, 11)
+        self.assertFalse(leader.tree.in_flight[: len(leader.tree)].any())
+        self.assertIs(pipelines[2].tree, leader.tree)
+
+
+if __name__ == "__main__":
+    unittest.main()